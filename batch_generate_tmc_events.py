@@ -0,0 +1,264 @@
+# batch_generate_tmc_events.py - Run generate_tmc_events_for_arterials.py for many route pairs,
+#                                fanned out across a pool of worker processes.
+#
+# Usage: python batch_generate_tmc_events.py <route_list_file | ALL> <tmc_list_dir> <scratch_root>
+#                                            [--workers N] [--force]
+#
+# Parameters
+#   1. A file containing a newline-delimited list of MassDOT route_ids, or 'ALL' to process
+#      all arterial routes (see massdot_routes.py). Either or both directions of a route may
+#      be listed; each route PAIR is processed once.
+#   2. The directory containing the TMC list file for each route pair. The TMC list file for
+#      a route pair is named <route_id root, in lower case>_tmcs.txt, e.g., sr9_tmcs.txt.
+#   3. The "root" scratch directory. Each route pair is processed in its own scratch directory
+#      (a subdirectory of this one), so that concurrently running workers never write to the
+#      same geodatabase.
+#   4. (Optional) The number of worker processes; defaults to the number of CPUs.
+#   5. (Optional) --force: rebuild every route pair, even if its inputs have not changed.
+#
+# A route pair is skipped, and its existing final CSV file is retained, if the fingerprint of its
+# inputs (see incremental_build.py) is the same as that recorded in the build manifest when its
+# final CSV file was last built.
+#
+# Each worker process runs generate_tmc_events_for_arterials.py for ONE route pair, and then exits
+# (so that no arcpy state is carried over from one route pair to the next.) The outcome of each
+# route pair - success or failure, the elapsed time, and the error message if any - is reported
+# as it finishes, and a summary is reported at the end.
+#
+# This script must be run with the Python installation that accompanies ArcGIS.
+
+import argparse
+import multiprocessing
+import os
+import runpy
+import sys
+import time
+import traceback
+import incremental_build
+import lrse_event_index
+import massdot_routes
+import pipeline_logging
+import route_geometry_cache
+import tmc_store
+import town_boundaries
+
+# Full path of the per-route-pair script run by each worker
+route_pair_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'generate_tmc_events_for_arterials.py')
+
+# Path to "base directory" in which all output files are written (see generate_tmc_events_for_arterials.py)
+base_dir = r'\\lilliput\groups\Data_Resources\conflate-tmcs-and-massdot-arterials'
+# Full path of directory in which final (i.e., post-processed) CSV files are written
+output_csv_dir_2 = base_dir + "\\csv_final"
+# Full path of the build manifest
+build_manifest_path = output_csv_dir_2 + "\\build_manifest.json"
+
+# Inputs whose fingerprints are recorded in the build manifest (see generate_tmc_events_for_arterials.py)
+sde_mpodata_ro_connection = r'\\lindalino\users\Public\Documents\Public ArcGIS\Database Connections\CTPS 10.6.sde'
+MASSDOT_LRSN_Routes_19Dec2019 = sde_mpodata_ro_connection + '\\mpodata.mpodata.CTPS_RoadInventory_for_INRIX_2019\\mpodata.mpodata.MASSDOT_LRSN_Routes_19Dec2019'
+LRSE_Speed_Limit = base_dir + '\\LRSE_Speed_Limit_FC_redux.gdb\\LRSE_Speed_Limit'
+LRSE_Number_Travel_Lanes = base_dir + '\\LRSE_Number_Travel_Lanes_FC_redux.gdb\\LRSE_Number_Travel_Lanes'
+towns_pb_r = sde_mpodata_ro_connection + '\\mpodata.mpodata.boundary\\mpodata.mpodata.towns_pb_r'
+INRIX_MASSACHUSETTS_TMC_2019 = sde_mpodata_ro_connection + '\\mpodata.mpodata.INRIX_MASSACHUSETTS_TMC_2019'
+route_geometry_cache_dir = os.path.join(os.path.expanduser('~'), 'conflate-tmcs-and-massdot-arterials', 'route_geometry_cache')
+
+# tmc_list_file_name: Return the full path of the TMC list file for a route pair
+#
+def tmc_list_file_name(tmc_list_dir, route_id_root):
+    return tmc_list_dir + '\\' + route_id_root.lower() + '_tmcs.txt'
+# def tmc_list_file_name()
+
+# make_jobs: Return the list of "jobs," one per route pair, to be run by the workers
+#
+# Parameters: route_pairs - list of (route_id root, primary direction) tuples
+#             tmc_list_dir - directory containing the TMC list file for each route pair
+#             scratch_root - directory in which a scratch directory is created for each route pair
+# Return value: list of dicts, each with the fields 'route_id_root', 'primary_dir', 'tmc_list_file', 'scratch_dir',
+#               and 'output_csv' (full path of the final CSV file for the route pair)
+#
+def make_jobs(route_pairs, tmc_list_dir, scratch_root):
+    retval = []
+    for route_id_root, primary_dir in route_pairs:
+        retval.append({ 'route_id_root' : route_id_root, 'primary_dir' : primary_dir,
+                        'tmc_list_file' : tmc_list_file_name(tmc_list_dir, route_id_root),
+                        'scratch_dir' : os.path.join(scratch_root, route_id_root.lower() + '_' + primary_dir.lower()),
+                        'output_csv' : output_csv_dir_2 + '\\' + route_id_root.lower() + '_events_final.csv' })
+    # for
+    return retval
+# def make_jobs()
+
+# run_route_pair_script: Run generate_tmc_events_for_arterials.py for one route pair, in the current process
+#
+# Parameter: job - dict describing the route pair (see make_jobs); if its (optional) field 'caches_verified' is True,
+#                  the script opens the local caches without verifying that they are up to date
+# Return value: none; raises an exception if the script fails
+#
+def run_route_pair_script(job):
+    if not os.path.isdir(job['scratch_dir']):
+        os.makedirs(job['scratch_dir'])
+    # end_if
+    # arcpy.GetParameterAsText reads the script's parameters from sys.argv when not run as a geoprocessing tool
+    saved_argv = sys.argv
+    sys.argv = [route_pair_script, job['route_id_root'], job['primary_dir'], job['tmc_list_file'], job['scratch_dir']]
+    # The caches have been brought up to date by prepare_caches, before the workers were started
+    if job.get('caches_verified', False):
+        sys.argv.append('VERIFIED')
+    # end_if
+    try:
+        runpy.run_path(route_pair_script, run_name='__main__')
+    finally:
+        sys.argv = saved_argv
+        # Write any messages the script left buffered, e.g., if it failed
+        pipeline_logging.flush()
+    # try/finally
+# def run_route_pair_script()
+
+# run_route_pair_incremental: Run generate_tmc_events_for_arterials.py for one route pair, in the current process,
+#                             unless the fingerprint of its inputs is unchanged since its final CSV file was built
+#
+# Parameter: job - dict describing the route pair (see make_jobs), plus the fields 'config_hash' (see
+#                  incremental_build.pipeline_config_hash), 'towns_fingerprint' (see incremental_build.towns_fingerprint),
+#                  'previous_fingerprint' (from the build manifest, or None), and 'force' (True to run the script regardless);
+#                  the config hash and towns fingerprint are computed once, by the parent process, for all jobs
+# Return value: dict with the field 'fingerprint', and the field 'status' = 'SKIPPED' if the script was not run
+#
+def run_route_pair_incremental(job):
+    # The route geometry cache has been brought up to date by prepare_caches
+    route_geom_cache = route_geometry_cache.open_cache(MASSDOT_LRSN_Routes_19Dec2019, route_geometry_cache_dir, verify=False)
+    fingerprint = incremental_build.route_pair_fingerprint(job['route_id_root'], job['primary_dir'],
+                                                           massdot_routes.secondary_direction(job['primary_dir'], job['route_id_root']),
+                                                           job['tmc_list_file'], route_geom_cache,
+                                                           [LRSE_Speed_Limit, LRSE_Number_Travel_Lanes],
+                                                           job['towns_fingerprint'],
+                                                           job['config_hash'])
+    if not job['force'] and job['previous_fingerprint'] == fingerprint and os.path.exists(job['output_csv']):
+        return { 'status' : 'SKIPPED', 'fingerprint' : fingerprint }
+    # end_if
+    run_route_pair_script(job)
+    return { 'fingerprint' : fingerprint }
+# def run_route_pair_incremental()
+
+# prepare_caches: Build (or bring up to date) the route geometry cache, the LRSE event indices, the
+#                 statewide town event index, and the TMC store, in the current process, before any workers are started,
+#                 so that each is built ONCE per run and shared by all route pairs, rather than by each worker in turn
+#
+def prepare_caches():
+    route_geom_cache = route_geometry_cache.open_cache(MASSDOT_LRSN_Routes_19Dec2019, route_geometry_cache_dir)
+    town_boundaries.open_town_event_index(towns_pb_r, route_geom_cache, route_geometry_cache_dir)
+    tmc_store.open_store(INRIX_MASSACHUSETTS_TMC_2019, route_geometry_cache_dir)
+    route_geom_cache.close()
+    lrse_event_index.open_index(LRSE_Speed_Limit, ['speed_lim', 'op_dir_sl'], route_geometry_cache_dir)
+    lrse_event_index.open_index(LRSE_Number_Travel_Lanes, ['num_lanes', 'opp_lanes'], route_geometry_cache_dir)
+# def prepare_caches()
+
+# run_job: Run a job in a worker process, capturing its outcome
+#
+# Parameter: (worker_fn, job) tuple; worker_fn is called with job as its argument, and may return
+#            a dict of fields to be added to the result (including 'status', to override 'OK')
+# Return value: dict with the fields of job, plus 'status' ('OK', 'FAILED', or as returned by worker_fn),
+#               'elapsed' (seconds), and 'error'
+#
+def run_job(worker_fn_and_job):
+    worker_fn, job = worker_fn_and_job
+    result = dict(job)
+    start = time.time()
+    try:
+        result['status'] = 'OK'
+        result['error'] = ''
+        worker_result = worker_fn(job)
+        if worker_result is not None:
+            result.update(worker_result)
+        # end_if
+    except BaseException:
+        # NOTE: BaseException, since the script calls exit() on some errors.
+        result['status'] = 'FAILED'
+        result['error'] = traceback.format_exc()
+    # try/except
+    result['elapsed'] = time.time() - start
+    return result
+# def run_job()
+
+# run_batch: Run a list of jobs, fanned out across a pool of worker processes
+#
+# Parameters: jobs - list of dicts describing the jobs
+#             worker_fn - function run (in a worker process) for each job; must be defined at module level
+#             num_workers - number of worker processes
+#             report_fn - (optional) function called with a progress message as each job finishes
+# Return value: list of result dicts (see run_job), in the order in which the jobs finished
+#
+def run_batch(jobs, worker_fn=run_route_pair_script, num_workers=None, report_fn=None):
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    # end_if
+    num_workers = max(1, min(num_workers, len(jobs)))
+    results = []
+    # maxtasksperchild=1: each job runs in a fresh worker process
+    pool = multiprocessing.Pool(processes=num_workers, maxtasksperchild=1)
+    try:
+        for result in pool.imap_unordered(run_job, [(worker_fn, job) for job in jobs]):
+            results.append(result)
+            if report_fn is not None:
+                report_fn('[' + str(len(results)) + '/' + str(len(jobs)) + '] ' + result['route_id_root'] + ' ' +
+                          result['primary_dir'] + ': ' + result['status'] + ' (' + ('%.1f' % result['elapsed']) + ' s)')
+            # end_if
+        # for
+    finally:
+        pool.close()
+        pool.join()
+    # try/finally
+    return results
+# def run_batch()
+
+# report_summary: Report the outcome of a batch run
+#
+def report_summary(results, report_fn):
+    failures = [result for result in results if result['status'] == 'FAILED']
+    skipped = [result for result in results if result['status'] == 'SKIPPED']
+    report_fn(str(len(results) - len(failures) - len(skipped)) + " route pair(s) rebuilt; " + 
+              str(len(skipped)) + " unchanged and skipped; " + str(len(failures)) + " failed.")
+    for result in failures:
+        report_fn("*** " + result['route_id_root'] + ' ' + result['primary_dir'] + " failed:")
+        report_fn(result['error'])
+    # for
+# def report_summary()
+
+def print_msg(msg):
+    print(msg)
+# def print_msg()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate TMC events for many MassDOT route pairs in parallel.")
+    parser.add_argument('route_list_file', help="file containing a list of MassDOT route_ids, or ALL")
+    parser.add_argument('tmc_list_dir', help="directory containing the TMC list file for each route pair")
+    parser.add_argument('scratch_root', help="directory in which a scratch directory is created for each route pair")
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes (default: number of CPUs)")
+    parser.add_argument('--force', action='store_true', help="rebuild every route pair, even if its inputs are unchanged")
+    args = parser.parse_args()
+
+    route_pairs = massdot_routes.get_route_pairs(massdot_routes.get_route_list(args.route_list_file))
+    jobs = make_jobs(route_pairs, args.tmc_list_dir, args.scratch_root)
+    manifest = incremental_build.load_manifest(build_manifest_path)
+    print_msg("Preparing route geometry cache and LRSE event indices.")
+    prepare_caches()
+    # The inputs to the fingerprints that are common to all route pairs are computed once, here, rather than by each worker
+    config_hash = incremental_build.pipeline_config_hash(os.path.dirname(route_pair_script))
+    towns_fp = incremental_build.towns_fingerprint(towns_pb_r)
+    for job in jobs:
+        key = incremental_build.route_pair_key(job['route_id_root'], job['primary_dir'])
+        job['previous_fingerprint'] = manifest[key]['fingerprint'] if key in manifest else None
+        job['config_hash'] = config_hash
+        job['towns_fingerprint'] = towns_fp
+        job['force'] = args.force
+        job['caches_verified'] = True
+    # for
+    print_msg("Processing " + str(len(jobs)) + " route pair(s).")
+    results = run_batch(jobs, run_route_pair_incremental, args.workers, print_msg)
+    for result in results:
+        if result['status'] == 'OK':
+            incremental_build.record_build(manifest, incremental_build.route_pair_key(result['route_id_root'], result['primary_dir']),
+                                           result['fingerprint'])
+        # end_if
+    # for
+    incremental_build.save_manifest(build_manifest_path, manifest)
+    report_summary(results, print_msg)
+    sys.exit(0 if all(result['status'] != 'FAILED' for result in results) else 1)
+# end_if
@@ -0,0 +1,3 @@
+# benchmarks - Benchmarks of the TMC conflation pipeline, run against synthetic inputs.
+#
+# See run_benchmarks.py.
@@ -0,0 +1,267 @@
+# run_benchmarks.py - Time each stage of the TMC conflation pipeline against synthetic networks
+#                     (see synthetic_network.py) of increasing size, and write the results as JSON.
+#
+# Usage: python -m benchmarks.run_benchmarks [--route-pairs 1,5,35] [--seed 0] [--out benchmark_results.json]
+#        (run from the directory containing the pipeline scripts)
+#
+# The stages timed are those of generate_tmc_events_for_arterials.py, as performed by the native (non-arcpy)
+# modules in this directory, for each route pair of each network:
+#     1. tmc_projection - locate the TMCs along each route (lr_projection.py)
+#     2. lrse_index_build - index the speed limit and number-of-lanes event tables (lrse_event_index.py); once per network
+#     3. speed_limit_events, num_lanes_events - query the above indices for each route
+#     4. overlay_1, overlay_2, overlay_3 - the three successive overlays (route_event_overlay.py)
+#     5. overlay_multi - the same three overlays, performed in a single sweep, for comparison
+#     6. cleanup_sort_export - the cleanup operations, sort, coalescing (event_coalescing.py), and export of the
+#        intermediate CSV file; the compression ratio of the coalescing is reported for each network
+#     7. aggregation - phase 2, i.e., process_csv_file, reading the intermediate CSV file
+#     8. aggregation_columnar - phase 2 as performed by process_csv_columnar
+#     9. streaming_pipeline - stages 4 through 7 performed as a single stream of events (streaming_pipeline.py)
+#    10. town_index_build, town_location - index the town polygons, once per network, and clip each route
+#        against them (town_boundaries.py)
+# The overlays use the town events generated along with the synthetic network, rather than those of town_location,
+# so that the timings of the later stages do not depend upon it.
+#
+# For each stage, the report gives the total wall-clock and CPU time, the number of times it was performed,
+# and the total number of rows in and out (see pipeline_metrics.py). Comparing reports across commits (or across network sizes)
+# shows regressions in both the speed and the scaling of each stage.
+
+import argparse
+import contextlib
+import csv
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import event_cleanup
+import event_coalescing
+import external_sort
+import lr_projection
+import lrse_event_index
+import pipeline_logging
+import pipeline_metrics
+import route_event_overlay
+import streaming_pipeline
+import town_boundaries
+import process_csv_file
+import process_csv_columnar
+from benchmarks import synthetic_network
+
+# Event properties of all event tables in the pipeline
+event_properties = "route_id LINE from_meas to_meas"
+
+# Fields of the intermediate CSV file
+intermediate_csv_fields = [ 'route_id', 'from_meas', 'to_meas', 'tmc', 'tmctype', 'roadnum', 'firstnm', 'direction',
+                            'town', 'town_id', 'route_id_1', 'speed_lim', 'route_id_12', 'num_lanes', 'calc_len' ]
+
+# quiet: Context manager discarding the progress messages printed by the phase 2 modules
+#
+@contextlib.contextmanager
+def quiet():
+    with open(os.devnull, 'w') as devnull:
+        with contextlib.redirect_stdout(devnull):
+            yield
+            # Messages are buffered by the logger (see pipeline_logging.py)
+            pipeline_logging.flush()
+        # with
+    # with
+# def quiet()
+
+# lrse_to_events: Convert the events returned by an LrseEventIndex query to event table records
+#                 with the given value field (as written by lrse_event_index.write_event_table)
+#
+def lrse_to_events(lrse_events, value_field):
+    return [{ 'route_id' : e['route_id'], 'from_meas' : e['from_meas'], 'to_meas' : e['to_meas'],
+              value_field : e[value_field] } for e in lrse_events]
+# def lrse_to_events()
+
+# cleanup_sort_export: Perform the cleanup operations on the final overlay, sort it, coalesce it, and export it
+#                      to a CSV file, as is done by generate_tmc_events_for_arterials.py
+#
+# Parameters: overlay_events - list of dicts: the final overlay
+#             out_dir, out_file - the CSV file
+#             coalescer - event_coalescing.EventCoalescer
+# Return value: list of the records written
+#
+def cleanup_sort_export(overlay_events, out_dir, out_file, coalescer):
+    cleanup = event_cleanup.EventCleanup(event_cleanup.overlay_cleanup_rules())
+    # The overlay events are copied, as they are used again by later stages
+    recs = list(coalescer.apply(external_sort.sort_records(cleanup.apply(dict(e) for e in overlay_events),
+                                                           lambda rec: (rec['from_meas'], rec['tmc']))))
+    with open(os.path.join(out_dir, out_file), 'w') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=intermediate_csv_fields, extrasaction='ignore', lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(recs)
+    # with
+    return recs
+# def cleanup_sort_export()
+
+# aggregate: Perform phase 2 on an intermediate CSV file, as process_csv_file.main_routine does by default
+#            (i.e., sorting the records by TMC ID with an external merge sort), less writing the output
+#
+def aggregate(in_dir, in_file):
+    retval = []
+    recs_by_tmc = external_sort.sort_records(process_csv_file.iter_event_records(in_dir, in_file), lambda rec: rec.tmc,
+                                             external_sort.default_memory_budget)
+    for recs_to_process in process_csv_file.group_sorted_records(recs_by_tmc):
+        retval.append(process_csv_file.process_one_tmc_id(recs_to_process))
+    # for
+    return retval
+# def aggregate()
+
+# aggregate_columnar: Perform phase 2 on an intermediate CSV file, as process_csv_columnar does (less writing the output)
+#
+def aggregate_columnar(in_dir, in_file):
+    cols = process_csv_columnar.load_columns(in_dir, [in_file])
+    summaries_per_file, problem_tmcs = process_csv_columnar.aggregate_columns(cols)
+    return summaries_per_file[0] if len(summaries_per_file) > 0 else []
+# def aggregate_columnar()
+
+# run_network: Run the benchmark for one synthetic network
+#
+# Parameters: num_route_pairs - number of route pairs in the network
+#             seed - seed of the random number generator
+#             work_dir - directory in which the intermediate CSV files are written
+# Return value: dict describing the network and the times of each stage
+#
+def run_network(num_route_pairs, seed, work_dir):
+    gen_start = time.time()
+    network = synthetic_network.generate_network(num_route_pairs, seed)
+    gen_time = time.time() - gen_start
+    times = pipeline_metrics.PipelineMetrics()
+    # Coalesces the intermediate records of all route pairs of the network (see cleanup_sort_export)
+    coalescer = event_coalescing.EventCoalescer()
+    wall_start = time.time()
+
+    towns_by_route = route_event_overlay.group_events_by_route(network['town_events'], 'route_id')
+    num_lrse_records = len(network['speed_limit_events']) + len(network['num_lanes_events'])
+    def build_indices():
+        to_records = lambda events, fields: [tuple(e[f] for f in ['route_id', 'from_measure', 'to_measure'] + fields) for e in events]
+        return (lrse_event_index.LrseEventIndex(to_records(network['speed_limit_events'], ['speed_lim', 'op_dir_sl']), ['speed_lim', 'op_dir_sl']),
+                lrse_event_index.LrseEventIndex(to_records(network['num_lanes_events'], ['num_lanes', 'opp_lanes']), ['num_lanes', 'opp_lanes']))
+    # def build_indices()
+    speed_limit_index, num_lanes_index = times.time('lrse_index_build', build_indices, num_lrse_records,
+                                                    lambda indices: sum(len(index.routes) for index in indices))
+    town_polygons = [('TOWN ' + str(town_id), town_id, [ring]) for (town_id, ring) in network['town_polygons']]
+    town_index = times.time('town_index_build', lambda: town_boundaries.TownIndex(town_polygons), len(town_polygons),
+                            lambda index: len(index.towns))
+
+    for (route_id_root, primary_dir) in network['route_pairs']:
+        route_ids = [route_id_root + ' ' + primary_dir,
+                     route_id_root + ' ' + ('WB' if primary_dir == 'EB' else 'SB')]
+        tmc_events = []
+        for route_id in route_ids:
+            tmcs = network['tmcs'][route_id]
+            route = lr_projection.RouteGeometry(route_id, network['routes'][route_id])
+            events, discarded = times.time('tmc_projection', lambda: lr_projection.locate_tmc_events(route, tmcs),
+                                           len(tmcs), lambda value: len(value[0]))
+            tmc_events += events
+            times.time('town_location', lambda: town_boundaries.locate_towns_along_route(route, town_index), 1, len)
+        # for
+        town_events = []
+        for route_id in route_ids:
+            town_events += towns_by_route.get(route_id, [])
+        # for
+        last_m = dict((route_id, network['routes'][route_id][-1][-1][2]) for route_id in route_ids)
+        speed_limit_events = times.time('speed_limit_events',
+                                        lambda: lrse_to_events(sum([speed_limit_index.query(r, 0.0, last_m[r]) for r in route_ids], []), 'speed_lim'),
+                                        len(route_ids), len)
+        num_lanes_events = times.time('num_lanes_events',
+                                      lambda: lrse_to_events(sum([num_lanes_index.query(r, 0.0, last_m[r]) for r in route_ids], []), 'num_lanes'),
+                                      len(route_ids), len)
+
+        overlay_1 = times.time('overlay_1', lambda: route_event_overlay.overlay_route_events(tmc_events, event_properties,
+                                                                                              town_events, event_properties,
+                                                                                              'UNION', event_properties, 'NO_ZERO'),
+                               len(tmc_events) + len(town_events), len)
+        overlay_2 = times.time('overlay_2', lambda: route_event_overlay.overlay_route_events(overlay_1, event_properties,
+                                                                                              speed_limit_events, event_properties,
+                                                                                              'UNION', event_properties, 'NO_ZERO'),
+                               len(overlay_1) + len(speed_limit_events), len)
+        overlay_3 = times.time('overlay_3', lambda: route_event_overlay.overlay_route_events(overlay_2, event_properties,
+                                                                                              num_lanes_events, event_properties,
+                                                                                              'UNION', event_properties, 'ZERO'),
+                               len(overlay_2) + len(num_lanes_events), len)
+        tables = [tmc_events, town_events, speed_limit_events, num_lanes_events]
+        overlay_events = times.time('overlay_multi',
+                                    lambda: route_event_overlay.overlay_route_events_multi(tables, [event_properties] * 4, 'UNION',
+                                                                                           event_properties,
+                                                                                           streaming_pipeline.zero_length_events_list,
+                                                                                           streaming_pipeline.event_table_fields),
+                                    sum(len(table) for table in tables), len)
+
+        csv_file = route_id_root.lower() + '_events_output.csv'
+        # The intermediate CSV file is exported from the single-pass overlay, as generate_tmc_events_for_arterials.py does
+        recs = times.time('cleanup_sort_export', lambda: cleanup_sort_export(overlay_events, work_dir, csv_file, coalescer),
+                          len(overlay_events), len)
+        with quiet():
+            times.time('aggregation', lambda: aggregate(work_dir, csv_file), len(recs), len)
+            times.time('aggregation_columnar', lambda: aggregate_columnar(work_dir, csv_file), len(recs), len)
+            times.time('streaming_pipeline', lambda: streaming_pipeline.main_routine(tmc_events, town_events, speed_limit_events,
+                                                                                   num_lanes_events, work_dir, 'streaming_' + csv_file,
+                                                                                   coalescer=event_coalescing.EventCoalescer()),
+                       sum(len(table) for table in tables), lambda num_tmcs: num_tmcs)
+        # with
+    # for
+
+    return { 'num_route_pairs' : num_route_pairs, 'seed' : seed,
+             'inputs' : { 'routes' : len(network['routes']),
+                          'route_points' : sum(len(part) for parts in network['routes'].values() for part in parts),
+                          'tmcs' : sum(len(tmcs) for tmcs in network['tmcs'].values()),
+                          'town_polygons' : len(network['town_polygons']),
+                          'town_events' : len(network['town_events']),
+                          'speed_limit_events' : len(network['speed_limit_events']),
+                          'num_lanes_events' : len(network['num_lanes_events']) },
+             'generate_s' : gen_time,
+             'total_wall_s' : time.time() - wall_start,
+             'coalesce_compression_ratio' : coalescer.compression_ratio(),
+             'stages' : times.stage_report() }
+# def run_network()
+
+# run_benchmarks: Run the benchmark for each of a list of network sizes
+#
+# Parameters: route_pair_counts - list of the number of route pairs in each network
+#             seed - seed of the random number generator
+# Return value: dict: the report
+#
+def run_benchmarks(route_pair_counts, seed=0):
+    work_dir = tempfile.mkdtemp(prefix='tmc_benchmark_')
+    try:
+        runs = []
+        for num_route_pairs in route_pair_counts:
+            runs.append(run_network(num_route_pairs, seed, work_dir))
+        # for
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    # try/finally
+    return { 'benchmark' : 'conflate-tmcs-and-massdot-arterials',
+             'timestamp' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+             'python' : sys.version.split()[0],
+             'platform' : platform.platform(),
+             'runs' : runs }
+# def run_benchmarks()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the TMC conflation pipeline against synthetic networks.")
+    parser.add_argument('--route-pairs', default='1,5,' + str(synthetic_network.statewide_num_route_pairs),
+                        help="comma-separated list of network sizes, in route pairs (default: 1,5,35, the last being statewide)")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the random number generator")
+    parser.add_argument('--out', default='benchmark_results.json', help="file to which the report is written")
+    args = parser.parse_args()
+
+    report = run_benchmarks([int(n) for n in args.route_pairs.split(',')], args.seed)
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    # with
+    for run in report['runs']:
+        print(str(run['num_route_pairs']) + " route pair(s): " + ('%.2f' % run['total_wall_s']) + " s")
+        for name, stage in run['stages'].items():
+            print("    " + name.ljust(24) + ('%8.3f' % stage['wall_s']) + " s  " + str(stage['rows_in']) + " rows in, " +
+                  str(stage['rows_out']) + " rows out")
+        # for
+    # for
+    print("Report written to " + args.out)
+# end_if
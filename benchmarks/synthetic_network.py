@@ -0,0 +1,284 @@
+# synthetic_network.py - Generator of synthetic, but realistic, inputs to the TMC conflation pipeline.
+#
+# A synthetic "network" comprises:
+#     1. Route pairs: M-aware route polylines, one per direction. The primary direction (EB or NB) meanders
+#        across the "state"; the secondary direction (WB or SB) follows the same path in reverse, offset to
+#        one side. Coordinates are in meters; M-values are in miles, measured from the start of each route,
+#        as for the MassDOT LRSN routes.
+#     2. TMCs: consecutive segments of each route, whose end points are offset from the route by a small
+#        random amount (as the INRIX TMC geometry is offset from the MassDOT route geometry.) A few TMCs
+#        begin before the start of their route, so that the clamping of measures is exercised.
+#     3. Towns: a grid of square town polygons covering the routes, and the town events along each route.
+#     4. Speed limit and number-of-lanes events: the LRSE_Speed_Limit and LRSE_Number_Travel_Lanes event
+#        tables, which cover each route with gaps, and which use the sentinel conventions of the MassDOT data:
+#        a speed limit of 99 means "no value", and a gap (which becomes 0 when overlaid) means "no event".
+#
+# The network is generated deterministically from a seed, at any scale from a single route pair up to
+# (and beyond) the size of the statewide arterial network.
+
+import math
+import random
+
+# Number of meters in a mile
+meters_per_mile = 1609.344
+
+# Default parameters of a generated network
+default_route_length_miles = (5.0, 40.0)
+default_tmc_length_miles = (0.1, 1.5)
+default_town_size_meters = 8000.0
+default_num_towns = 351
+# Route pairs in the statewide arterial network (see massdot_routes.py)
+statewide_num_route_pairs = 35
+
+speed_limit_values = [20, 25, 30, 35, 40, 45, 50, 55]
+num_lanes_values = [1, 1, 2, 2, 2, 3, 4]
+street_names = ['MAIN ST', 'BROADWAY', 'WASHINGTON ST', 'CENTRAL ST', 'HIGH ST', 'ELM ST', 'PLEASANT ST', 'UNION ST']
+
+# meander_path: Generate the points of a path that heads in a given direction, meandering as it goes
+#
+# Parameters: rng - random.Random
+#             x, y - starting point
+#             heading - overall direction of the path, in radians
+#             length_meters - length of the path
+# Return value: list of (x, y) tuples
+#
+def meander_path(rng, x, y, heading, length_meters):
+    retval = [(x, y)]
+    travelled = 0.0
+    direction = heading
+    while travelled < length_meters:
+        step = min(rng.uniform(30.0, 250.0), length_meters - travelled)
+        # Wander, but never stray too far from the overall heading
+        direction += rng.uniform(-0.3, 0.3)
+        direction = heading + max(-0.8, min(0.8, direction - heading))
+        x += step * math.cos(direction)
+        y += step * math.sin(direction)
+        retval.append((x, y))
+        travelled += step
+    # while
+    return retval
+# def meander_path()
+
+# add_measures: Return a list of (x, y, m) tuples for a path, with M-values (in miles) measured from its start
+#
+def add_measures(points):
+    retval = []
+    m = 0.0
+    prev = None
+    for (x, y) in points:
+        if prev is not None:
+            m += math.hypot(x - prev[0], y - prev[1]) / meters_per_mile
+        # end_if
+        retval.append((x, y, m))
+        prev = (x, y)
+    # for
+    return retval
+# def add_measures()
+
+# point_at_meas: Return the (x, y) of the point at a given M-value along a list of (x, y, m) tuples
+#
+def point_at_meas(points, m):
+    if m <= points[0][2]:
+        return (points[0][0], points[0][1])
+    # end_if
+    for i in range(1, len(points)):
+        if points[i][2] >= m:
+            x0, y0, m0 = points[i-1]
+            x1, y1, m1 = points[i]
+            t = (m - m0) / (m1 - m0) if m1 > m0 else 0.0
+            return (x0 + t * (x1 - x0), y0 + t * (y1 - y0))
+        # end_if
+    # for
+    return (points[-1][0], points[-1][1])
+# def point_at_meas()
+
+# partition_route: Partition [0, route_length] into consecutive pieces whose lengths lie in the given range
+#
+# Return value: list of (from_meas, to_meas) tuples
+#
+def partition_route(rng, route_length, piece_length_range):
+    retval = []
+    from_meas = 0.0
+    while from_meas < route_length:
+        to_meas = min(route_length, from_meas + rng.uniform(piece_length_range[0], piece_length_range[1]))
+        retval.append((from_meas, to_meas))
+        from_meas = to_meas
+    # while
+    return retval
+# def partition_route()
+
+# town_id_of_cell: Return the town_id (1..num_towns) of the grid cell (col, row)
+#
+def town_id_of_cell(col, row, num_towns):
+    return ((row * 97 + col) % num_towns) + 1
+# def town_id_of_cell()
+
+# locate_towns: Generate the town events along a route, given by its (x, y, m) points, for a grid of square towns
+#
+# Return value: list of (from_meas, to_meas, town_id) tuples, in order along the route
+#
+def locate_towns(points, town_size, num_towns):
+    retval = []
+    for i in range(1, len(points)):
+        x0, y0, m0 = points[i-1]
+        x1, y1, m1 = points[i]
+        # Parameters (0..1) along the segment at which it crosses a grid line
+        ts = [0.0, 1.0]
+        for (a, b) in ((x0, x1), (y0, y1)):
+            lo = int(math.floor(min(a, b) / town_size)) + 1
+            hi = int(math.floor(max(a, b) / town_size))
+            for k in range(lo, hi + 1):
+                ts.append((k * town_size - a) / (b - a))
+            # for
+        # for
+        ts.sort()
+        for j in range(1, len(ts)):
+            if ts[j] <= ts[j-1]:
+                continue
+            # end_if
+            t_mid = (ts[j-1] + ts[j]) / 2.0
+            col = int(math.floor((x0 + t_mid * (x1 - x0)) / town_size))
+            row = int(math.floor((y0 + t_mid * (y1 - y0)) / town_size))
+            town_id = town_id_of_cell(col, row, num_towns)
+            from_meas = m0 + ts[j-1] * (m1 - m0); to_meas = m0 + ts[j] * (m1 - m0)
+            if len(retval) > 0 and retval[-1][2] == town_id:
+                retval[-1] = (retval[-1][0], to_meas, town_id)
+            else:
+                retval.append((from_meas, to_meas, town_id))
+            # end_if
+        # for
+    # for
+    return retval
+# def locate_towns()
+
+# town_polygons: Return the town polygons of the grid cells covering a set of points
+#
+# Return value: list of (town_id, ring) tuples, where ring is a closed list of (x, y) tuples
+#
+def town_polygons(all_points, town_size, num_towns):
+    min_col = int(math.floor(min(p[0] for p in all_points) / town_size))
+    max_col = int(math.floor(max(p[0] for p in all_points) / town_size))
+    min_row = int(math.floor(min(p[1] for p in all_points) / town_size))
+    max_row = int(math.floor(max(p[1] for p in all_points) / town_size))
+    retval = []
+    for row in range(min_row, max_row + 1):
+        for col in range(min_col, max_col + 1):
+            x0 = col * town_size; y0 = row * town_size
+            ring = [(x0, y0), (x0, y0 + town_size), (x0 + town_size, y0 + town_size), (x0 + town_size, y0), (x0, y0)]
+            retval.append((town_id_of_cell(col, row, num_towns), ring))
+        # for
+    # for
+    return retval
+# def town_polygons()
+
+# lrse_events: Generate the events of a LRSE table (e.g., speed limit) along a route, with gaps
+#
+# Parameters: rng - random.Random
+#             route_id - MassDOT route_id
+#             route_length - length of the route, in miles
+#             value_field, op_dir_field - names of the value and "opposite direction" value fields
+#             values - list of values from which the value of each event is chosen
+#             sentinel - (optional) the "no value" value, used for a few events
+# Return value: list of event dicts with the fields of the LRSE table
+#
+def lrse_events(rng, route_id, route_length, value_field, op_dir_field, values, sentinel=None):
+    retval = []
+    for (from_meas, to_meas) in partition_route(rng, route_length, (0.05, 2.0)):
+        r = rng.random()
+        if r < 0.08:
+            # Gap: no event
+            continue
+        # end_if
+        value = sentinel if (sentinel is not None and r < 0.13) else rng.choice(values)
+        retval.append({ 'route_id' : route_id, 'from_measure' : from_meas, 'to_measure' : to_meas,
+                        value_field : value, op_dir_field : value if rng.random() < 0.7 else 0 })
+    # for
+    return retval
+# def lrse_events()
+
+# generate_network: Generate a synthetic network
+#
+# Parameters: num_route_pairs - number of route pairs
+#             seed - (optional) seed of the random number generator
+#             route_length_miles - (optional) (min, max) length of each route
+#             tmc_length_miles - (optional) (min, max) length of each TMC
+#             town_size - (optional) size (in meters) of the side of each square town
+#             num_towns - (optional) number of distinct town_ids
+# Return value: dict with the fields:
+#     'route_pairs' - list of (route_id root, primary direction) tuples
+#     'routes' - dict mapping route_id to a list of parts, each a list of (x, y, m) tuples (one part per route)
+#     'tmcs' - dict mapping route_id to a list of TMC dicts, with the fields 'tmc', 'tmctype', 'roadnum',
+#              'firstnm', 'direction', 'from_x', 'from_y', 'to_x', 'to_y' (see lr_projection.locate_tmc_events)
+#     'town_polygons' - list of (town_id, ring) tuples
+#     'town_events' - list of town event dicts, with the fields 'route_id', 'from_meas', 'to_meas', 'town', 'town_id'
+#     'speed_limit_events' - list of LRSE_Speed_Limit event dicts, with the fields 'route_id', 'from_measure',
+#                            'to_measure', 'speed_lim', 'op_dir_sl'
+#     'num_lanes_events' - list of LRSE_Number_Travel_Lanes event dicts, with the fields 'route_id',
+#                          'from_measure', 'to_measure', 'num_lanes', 'opp_lanes'
+#
+def generate_network(num_route_pairs, seed=0, route_length_miles=default_route_length_miles,
+                     tmc_length_miles=default_tmc_length_miles, town_size=default_town_size_meters,
+                     num_towns=default_num_towns):
+    rng = random.Random(seed)
+    retval = { 'route_pairs' : [], 'routes' : {}, 'tmcs' : {}, 'town_polygons' : [], 'town_events' : [],
+               'speed_limit_events' : [], 'num_lanes_events' : [] }
+    # Extent of the "state," in meters (roughly that of Massachusetts, in the Mass State Plane coordinate system)
+    min_x, max_x, min_y, max_y = 40000.0, 330000.0, 780000.0, 960000.0
+    all_points = []
+    tmc_seq = 0
+    for pair_ix in range(num_route_pairs):
+        route_id_root = ('SR' if pair_ix % 5 else 'US') + str(pair_ix + 1)
+        primary_dir = 'EB' if pair_ix % 2 == 0 else 'NB'
+        secondary_dir = 'WB' if primary_dir == 'EB' else 'SB'
+        heading = 0.0 if primary_dir == 'EB' else math.pi / 2.0
+        length_meters = rng.uniform(route_length_miles[0], route_length_miles[1]) * meters_per_mile
+        path = meander_path(rng, rng.uniform(min_x, max_x), rng.uniform(min_y, max_y), heading, length_meters)
+        # The secondary direction runs the other way, 15 meters to the right of the primary direction
+        off_x = 15.0 * math.cos(heading - math.pi / 2.0); off_y = 15.0 * math.sin(heading - math.pi / 2.0)
+        reverse_path = [(x - off_x, y - off_y) for (x, y) in reversed(path)]
+        retval['route_pairs'].append((route_id_root, primary_dir))
+        for (route_dir, route_path) in ((primary_dir, path), (secondary_dir, reverse_path)):
+            route_id = route_id_root + ' ' + route_dir
+            points = add_measures(route_path)
+            route_length = points[-1][2]
+            retval['routes'][route_id] = [points]
+            all_points.extend(points)
+
+            # TMCs
+            tmcs = []
+            direction = { 'EB' : 'EASTBOUND', 'WB' : 'WESTBOUND', 'NB' : 'NORTHBOUND', 'SB' : 'SOUTHBOUND' }[route_dir]
+            for (from_meas, to_meas) in partition_route(rng, route_length, tmc_length_miles):
+                tmc_seq += 1
+                # A few TMCs begin (slightly) before the start of the route
+                if from_meas == 0.0 and rng.random() < 0.3:
+                    from_meas = -0.01
+                # end_if
+                from_x, from_y = point_at_meas(points, from_meas)
+                to_x, to_y = point_at_meas(points, to_meas)
+                if from_meas < 0.0:
+                    from_x -= 20.0 * math.cos(heading); from_y -= 20.0 * math.sin(heading)
+                # end_if
+                tmcs.append({ 'tmc' : '129' + ('+' if route_dir == primary_dir else '-') + ('%05d' % tmc_seq),
+                              'tmctype' : 'P1', 'roadnum' : route_id_root[2:], 'firstnm' : rng.choice(street_names),
+                              'direction' : direction,
+                              'from_x' : from_x + rng.uniform(-8.0, 8.0), 'from_y' : from_y + rng.uniform(-8.0, 8.0),
+                              'to_x' : to_x + rng.uniform(-8.0, 8.0), 'to_y' : to_y + rng.uniform(-8.0, 8.0) })
+            # for
+            retval['tmcs'][route_id] = tmcs
+
+            # Towns
+            for (from_meas, to_meas, town_id) in locate_towns(points, town_size, num_towns):
+                retval['town_events'].append({ 'route_id' : route_id, 'from_meas' : from_meas, 'to_meas' : to_meas,
+                                               'town' : 'TOWN ' + str(town_id), 'town_id' : town_id })
+            # for
+
+            # Speed limit and number of lanes
+            retval['speed_limit_events'] += lrse_events(rng, route_id, route_length, 'speed_lim', 'op_dir_sl',
+                                                        speed_limit_values, sentinel=99)
+            retval['num_lanes_events'] += lrse_events(rng, route_id, route_length, 'num_lanes', 'opp_lanes',
+                                                      num_lanes_values)
+        # for
+    # for
+    retval['town_polygons'] = town_polygons(all_points, town_size, num_towns)
+    return retval
+# def generate_network()
@@ -0,0 +1,291 @@
+# dynamic_segmentation.py - Native dynamic segmentation: cut the M-interpolated sub-polyline of each of a batch of
+#                           linear events, (route_id, from_measure, to_measure), out of the cached route polylines
+#                           (see route_geometry_cache.py).
+#
+# This is a replacement for the per-route SelectLayerByAttribute / TableToTable_conversion / MakeRouteEventLayer_lr /
+# CopyFeatures_management sequence that regenerate_LRSE_FCs.py performed for each route and each LRSE.
+#
+# The points of all routes on which there are events are gathered into single x, y, and M arrays, and each route's
+# M-values are offset so that the M-values of all routes form one increasing sequence of "keys". The vertices
+# of the routes lying within each event are then found for ALL events at once, by two binary searches (NumPy
+# searchsorted) of the keys, and the ends of each event are interpolated along the segments containing them.
+# The result, for all events, is a single set of flat coordinate arrays with offsets to the parts of each event.
+#
+# As with MakeRouteEventLayer_lr:
+#     1. an event's from- and to-measures may be given in either order
+#     2. the measures of an event lying beyond either end of its route are clamped to that end
+#     3. if an event spans a break between the parts of a multi-part route, its polyline has a part for each
+#     4. an event whose route is not in the cache, or that lies entirely within a break between two parts
+#        of its route, is not located, and has no polyline
+#
+# The M-values of each route are assumed to be non-decreasing along it.
+#
+# Results may be written to a GeoJSON file (each point's M-value is written as its third coordinate), which
+# requires nothing but the route geometry cache, or to a feature class, which requires arcpy.
+#
+# Usage (e.g., on Linux): python dynamic_segmentation.py <events CSV file> <route geometry cache dir> <output GeoJSON file>
+#     The events CSV file must have route_id, from_measure, and to_measure columns; all other columns are carried
+#     through as attributes.
+
+import csv
+import json
+import os
+import sys
+import numpy as np
+import route_geometry_cache
+
+try:
+    import arcpy
+    arcpy_present = True
+except:
+    arcpy_present = False
+# end_try_except
+
+# SegmentedEvents: The polylines of a batch of events
+#
+class SegmentedEvents(object):
+    # __init__: Parameters are the attributes of the same name:
+    #
+    #     xs, ys, ms - flat NumPy arrays of the coordinates and M-values of the points of all polylines
+    #     part_offsets - NumPy array: part p comprises the points part_offsets[p] .. part_offsets[p+1]-1
+    #     event_part_offsets - NumPy array: event i comprises parts event_part_offsets[i] .. event_part_offsets[i+1]-1;
+    #                          an event that was not located has none
+    #     located - NumPy boolean array: True for each event that was located
+    #
+    def __init__(self, xs, ys, ms, part_offsets, event_part_offsets, located):
+        self.xs = xs
+        self.ys = ys
+        self.ms = ms
+        self.part_offsets = part_offsets
+        self.event_part_offsets = event_part_offsets
+        self.located = located
+    # def __init__()
+
+    def __len__(self):
+        return len(self.located)
+    # def __len__()
+
+    # parts: Return the polyline of an event as a list of parts, each a list of (x, y, m) tuples
+    #
+    def parts(self, i):
+        retval = []
+        for p in range(self.event_part_offsets[i], self.event_part_offsets[i+1]):
+            lo = self.part_offsets[p]; hi = self.part_offsets[p+1]
+            retval.append(list(zip(self.xs[lo:hi].tolist(), self.ys[lo:hi].tolist(), self.ms[lo:hi].tolist())))
+        # for
+        return retval
+    # def parts()
+# class SegmentedEvents
+
+# gather_routes: Gather the points of a set of routes into single arrays
+#
+# Parameters: route_geom_cache - route_geometry_cache.RouteGeometryCache
+#             route_ids - list of route_ids, all of which are in the cache
+# Return value: dict with the fields:
+#     'xs', 'ys', 'ms', 'keys' - NumPy arrays over the points of all routes, in turn; 'keys' are the M-values,
+#                                offset so as to increase across all routes
+#     'first', 'end' - NumPy arrays: the points of route r are first[r] .. end[r]-1
+#     'key_base' - NumPy array: the offset added to the M-values of route r
+#     'part_start' - NumPy boolean array: True for each point that begins a part (other than the first) of its route
+#
+def gather_routes(route_geom_cache, route_ids):
+    xs = []; ys = []; ms = []
+    first = np.zeros(len(route_ids), dtype=np.int64)
+    end = np.zeros(len(route_ids), dtype=np.int64)
+    part_start_ixs = []
+    num_points = 0
+    for r, route_id in enumerate(route_ids):
+        route_xs, route_ys, route_ms, part_starts = route_geom_cache.get_points(route_id)
+        # Copies, so that the memory-mapped cache can be closed
+        xs.append(np.array(route_xs, dtype=np.float64)); ys.append(np.array(route_ys, dtype=np.float64))
+        ms.append(np.array(route_ms, dtype=np.float64))
+        route_xs.release(); route_ys.release(); route_ms.release()
+        first[r] = num_points
+        num_points += len(xs[-1])
+        end[r] = num_points
+        part_start_ixs += [first[r] + part_start for part_start in part_starts[1:]]
+    # for
+    xs = np.concatenate(xs) if len(xs) > 0 else np.zeros(0)
+    ys = np.concatenate(ys) if len(ys) > 0 else np.zeros(0)
+    ms = np.concatenate(ms) if len(ms) > 0 else np.zeros(0)
+    key_base = np.zeros(len(route_ids))
+    next_base = 0.0
+    for r in range(len(route_ids)):
+        if end[r] > first[r]:
+            route_min_m = ms[first[r]]; route_max_m = ms[end[r] - 1]
+            key_base[r] = next_base - route_min_m
+            next_base += (route_max_m - route_min_m) + 1.0
+        # end_if
+    # for
+    route_of_point = np.repeat(np.arange(len(route_ids)), end - first)
+    part_start = np.zeros(num_points, dtype=bool)
+    part_start[np.array(part_start_ixs, dtype=np.int64)] = True
+    return { 'xs' : xs, 'ys' : ys, 'ms' : ms, 'keys' : ms + key_base[route_of_point],
+             'first' : first, 'end' : end, 'key_base' : key_base, 'part_start' : part_start }
+# def gather_routes()
+
+# interpolate: Return the coordinates of the points at measures meas on the segments ending at points ix
+#
+def interpolate(routes, ix, meas):
+    xs = routes['xs']; ys = routes['ys']; ms = routes['ms']
+    span = ms[ix] - ms[ix - 1]
+    t = np.where(span > 0, (meas - ms[ix - 1]) / np.where(span > 0, span, 1.0), 1.0)
+    t = np.clip(t, 0.0, 1.0)
+    return (xs[ix - 1] + t * (xs[ix] - xs[ix - 1]), ys[ix - 1] + t * (ys[ix] - ys[ix - 1]), meas)
+# def interpolate()
+
+# segment_events: Cut the sub-polyline of each of a batch of events out of the cached route polylines
+#
+# Parameters: route_geom_cache - route_geometry_cache.RouteGeometryCache
+#             route_ids - sequence of the route_id of each event
+#             from_meas, to_meas - sequences of the measures of each event
+# Return value: SegmentedEvents
+#
+# Note: An event lying entirely within a break in the M-values between two parts of its route is not located.
+#
+def segment_events(route_geom_cache, route_ids, from_meas, to_meas):
+    num_events = len(route_ids)
+    from_meas = np.asarray(from_meas, dtype=np.float64); to_meas = np.asarray(to_meas, dtype=np.float64)
+    cached_route_ids = sorted(set(route_id for route_id in route_ids
+                                  if route_id in route_geom_cache.routes and route_geom_cache.routes[route_id]['count'] > 1))
+    route_ix_of = dict((route_id, r) for r, route_id in enumerate(cached_route_ids))
+    event_route = np.array([route_ix_of.get(route_id, -1) for route_id in route_ids], dtype=np.int64)
+    located = (event_route >= 0) & ~np.isnan(from_meas) & ~np.isnan(to_meas)
+    routes = gather_routes(route_geom_cache, cached_route_ids)
+    xs = routes['xs']; ys = routes['ys']; ms = routes['ms']; part_start = routes['part_start']
+
+    ev = np.flatnonzero(located)
+    r = event_route[ev]
+    first = routes['first'][r]; end = routes['end'][r]
+    # Clamp the measures of each event to its route
+    lo = np.clip(np.minimum(from_meas[ev], to_meas[ev]), ms[first], ms[end - 1])
+    hi = np.clip(np.maximum(from_meas[ev], to_meas[ev]), ms[first], ms[end - 1])
+    # Interior points of each event: the points with lo < M < hi, i.e., i0 .. i1-1; both searches are
+    # made over the points of all routes at once, as the keys of each route are offset past those of the last
+    i0 = np.clip(np.searchsorted(routes['keys'], lo + routes['key_base'][r], side='right'), first + 1, end - 1)
+    i1 = np.clip(np.searchsorted(routes['keys'], hi + routes['key_base'][r], side='left'), i0, end - 1)
+
+    # An event lying entirely within a break between two parts of its route has no polyline
+    in_break = (i0 == i1) & part_start[i0] & (lo > ms[i0 - 1]) & (hi < ms[i0])
+    located[ev[in_break]] = False
+    ev = ev[~in_break]; i0 = i0[~in_break]; i1 = i1[~in_break]; lo = lo[~in_break]; hi = hi[~in_break]
+
+    # The first point of each event lies on the segment ending at i0, or, if i0 begins a part (i.e., the event
+    # begins in a break between parts), is that point; similarly, its last point lies on the segment ending
+    # at i1, or is the point preceding i1
+    sx, sy, sm = interpolate(routes, i0, lo)
+    sx = np.where(part_start[i0], xs[i0], sx); sy = np.where(part_start[i0], ys[i0], sy); sm = np.where(part_start[i0], ms[i0], sm)
+    ex, ey, em = interpolate(routes, i1, hi)
+    ex = np.where(part_start[i1], xs[i1 - 1], ex); ey = np.where(part_start[i1], ys[i1 - 1], ey); em = np.where(part_start[i1], ms[i1 - 1], em)
+
+    # Points of each event: its first point, its interior points, and its last point
+    counts = (i1 - i0) + 2
+    point_offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+    event_of_point = np.repeat(np.arange(len(ev)), counts)
+    pos = np.arange(point_offsets[-1]) - point_offsets[event_of_point]
+    is_first = pos == 0
+    is_last = pos == counts[event_of_point] - 1
+    src = np.where(is_first | is_last, 0, i0[event_of_point] + pos - 1)
+    out_xs = np.where(is_first, sx[event_of_point], np.where(is_last, ex[event_of_point], xs[src] if len(xs) > 0 else 0.0))
+    out_ys = np.where(is_first, sy[event_of_point], np.where(is_last, ey[event_of_point], ys[src] if len(ys) > 0 else 0.0))
+    out_ms = np.where(is_first, sm[event_of_point], np.where(is_last, em[event_of_point], ms[src] if len(ms) > 0 else 0.0))
+
+    # A part begins at the first point of each event, and at each of its interior points, other than i0, that begins
+    # a part of its route
+    new_part = is_first.copy()
+    interior = ~is_first & ~is_last
+    new_part[interior] = part_start[src[interior]] & (pos[interior] > 1)
+    part_firsts = np.flatnonzero(new_part)
+    part_offsets = np.concatenate((part_firsts, [len(out_xs)])).astype(np.int64)
+
+    event_part_counts = np.zeros(num_events, dtype=np.int64)
+    event_part_counts[ev] = np.bincount(event_of_point[part_firsts], minlength=len(ev))
+    event_part_offsets = np.concatenate(([0], np.cumsum(event_part_counts))).astype(np.int64)
+    return SegmentedEvents(out_xs, out_ys, out_ms, part_offsets, event_part_offsets, located)
+# def segment_events()
+
+# write_geojson: Write the polylines of a batch of events, with their attributes, to a GeoJSON file
+#
+# Parameters: out_path - full path of the output file
+#             segments - SegmentedEvents
+#             attributes - list of dicts: the attributes of each event
+# Return value: number of features written (events that were not located are omitted)
+#
+def write_geojson(out_path, segments, attributes):
+    tmp_path = out_path + '.' + str(os.getpid()) + '.tmp'
+    retval = 0
+    with open(tmp_path, 'w') as f:
+        f.write('{"type": "FeatureCollection", "features": [\n')
+        for i in range(len(segments)):
+            if not segments.located[i]:
+                continue
+            # end_if
+            coords = [[[x, y, m] for (x, y, m) in part] for part in segments.parts(i)]
+            feature = { 'type' : 'Feature', 'geometry' : { 'type' : 'MultiLineString', 'coordinates' : coords },
+                        'properties' : attributes[i] }
+            f.write((',\n' if retval > 0 else '') + json.dumps(feature))
+            retval += 1
+        # for
+        f.write('\n]}\n')
+    # with
+    os.replace(tmp_path, out_path)
+    return retval
+# def write_geojson()
+
+# write_feature_class: Write the polylines of a batch of events, with their attributes, to a new M-aware polyline feature class
+#
+# Parameters: out_gdb - full path of the geodatabase in which the feature class is created
+#             out_fc_name - name of the feature class
+#             segments - SegmentedEvents
+#             attributes - list of tuples: the attribute values of each event
+#             fields - list of (field name, field type) tuples, parallel to the values in attributes
+#             spatial_reference - spatial reference of the feature class, e.g., that of the route feature class
+# Return value: number of features written (events that were not located are omitted)
+#
+def write_feature_class(out_gdb, out_fc_name, segments, attributes, fields, spatial_reference):
+    if not arcpy_present:
+        raise RuntimeError("Writing " + out_fc_name + " requires arcpy.")
+    # end_if
+    out_fc = out_gdb + '\\' + out_fc_name
+    if arcpy.Exists(out_fc):
+        arcpy.Delete_management(out_fc)
+    # end_if
+    arcpy.CreateFeatureclass_management(out_gdb, out_fc_name, "POLYLINE", "", "ENABLED", "DISABLED", spatial_reference)
+    for field_name, field_type in fields:
+        if field_type == 'TEXT':
+            arcpy.AddField_management(out_fc, field_name, field_type, '', '', 64)
+        else:
+            arcpy.AddField_management(out_fc, field_name, field_type)
+        # end_if
+    # for
+    retval = 0
+    out_csr = arcpy.da.InsertCursor(out_fc, ['shape@'] + [field_name for (field_name, field_type) in fields])
+    for i in range(len(segments)):
+        if not segments.located[i]:
+            continue
+        # end_if
+        parts = arcpy.Array([arcpy.Array([arcpy.Point(x, y, None, m) for (x, y, m) in part]) for part in segments.parts(i)])
+        out_csr.insertRow([arcpy.Polyline(parts, spatial_reference, False, True)] + list(attributes[i]))
+        retval += 1
+    # for
+    del out_csr
+    return retval
+# def write_feature_class()
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4:
+        print("Usage: python dynamic_segmentation.py <events CSV file> <route geometry cache dir> <output GeoJSON file>")
+        sys.exit(2)
+    # end_if
+    events_csv, cache_dir, out_path = sys.argv[1:4]
+    with open(events_csv, 'r', newline='') as f:
+        rows = list(csv.DictReader(f))
+    # with
+    cache = route_geometry_cache.RouteGeometryCache(cache_dir)
+    segments = segment_events(cache, [row['route_id'] for row in rows],
+                              [float(row['from_measure']) if row['from_measure'] != '' else float('nan') for row in rows],
+                              [float(row['to_measure']) if row['to_measure'] != '' else float('nan') for row in rows])
+    cache.close()
+    num_written = write_geojson(out_path, segments, rows)
+    print(str(num_written) + " of " + str(len(rows)) + " events written to " + out_path)
+# end_if
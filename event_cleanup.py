@@ -0,0 +1,127 @@
+# event_cleanup.py - Single-pass cleanup of overlay events, by a declared list of rules.
+#
+# After overlay #3, generate_tmc_events_for_arterials.py cleaned up overlay_events_3 in five separate passes,
+# each a select-then-delete or a select-then-calculate on a table view (delete town_id = 0; delete tmc = '';
+# set from_meas < 0 to 0; delete from_meas = to_meas; add and calculate calc_len), each of which re-scanned
+# the table, and re-wrote rows. Here, the cleanup operations are declared as a list of rules (see
+# overlay_cleanup_rules), and an EventCleanup applies all of them to each event in turn, in a single pass over
+# a stream of events, e.g., as they are read from overlay_events_3 with a SearchCursor, or as they are produced
+# by the streaming overlay (see streaming_pipeline.py). Each rule counts the events it removes or changes.
+#
+# A rule is either:
+#     'drop' - events for which its predicate is true are removed; no later rule sees them
+#     'transform' - events for which its predicate is true are passed to its transform, which changes them in place
+# Rules are applied in the order in which they are listed, as the passes were performed.
+#
+# Events are dicts, with (at least) the fields 'town_id', 'tmc', 'from_meas', and 'to_meas'.
+#
+# This module does not depend upon arcpy.
+
+# CleanupRule: A cleanup rule (see above)
+#
+class CleanupRule(object):
+    # __init__: Create a rule
+    #
+    # Parameters: name - name of the rule, under which the number of events it removes or changes is counted
+    #             action - 'drop' or 'transform'
+    #             predicate - function(event) returning True if the rule applies to the event
+    #             transform - (for 'transform' rules) function(event) changing the event in place
+    #
+    def __init__(self, name, action, predicate, transform=None):
+        if action not in ('drop', 'transform'):
+            raise ValueError("Cleanup rule " + name + ": unknown action " + str(action))
+        # end_if
+        if action == 'transform' and transform is None:
+            raise ValueError("Cleanup rule " + name + ": a transform rule requires a transform")
+        # end_if
+        self.name = name
+        self.action = action
+        self.predicate = predicate
+        self.transform = transform
+    # def __init__()
+# class CleanupRule
+
+# set_from_meas_to_zero: Transform of the rule for events with from_meas < 0
+#
+def set_from_meas_to_zero(event):
+    event['from_meas'] = 0.0
+# def set_from_meas_to_zero()
+
+# set_calc_len: Transform of the rule computing the calc_len (calculated length) of each event
+#
+def set_calc_len(event):
+    event['calc_len'] = event['to_meas'] - event['from_meas']
+# def set_calc_len()
+
+# overlay_cleanup_rules: Return the rules of the cleanup of the overlay events (overlay_events_3)
+#
+# Parameter: prune_no_tmc - (optional) if True (the default), drop events with tmc = '' (i.e., where no TMC
+#                           was located), as is done when a list of TMCs is specified
+# Return value: list of CleanupRules
+#
+def overlay_cleanup_rules(prune_no_tmc=True):
+    retval = []
+    # The MassDOT routes and events layers use TOWNS_POLYM to define town boundaries; we use towns_pb instead.
+    # Overlay events lying beyond the extent of the town events have a town_id of zero (see town_boundaries.py).
+    retval.append(CleanupRule('no_town', 'drop', lambda event: event['town_id'] == 0))
+    if prune_no_tmc:
+        retval.append(CleanupRule('no_tmc', 'drop', lambda event: event['tmc'] == ''))
+    # end_if
+    # Roads and Highways allows events with measure values < 0
+    retval.append(CleanupRule('negative_from_meas', 'transform', lambda event: event['from_meas'] < 0, set_from_meas_to_zero))
+    retval.append(CleanupRule('zero_length', 'drop', lambda event: event['from_meas'] == event['to_meas']))
+    retval.append(CleanupRule('calc_len', 'transform', lambda event: True, set_calc_len))
+    return retval
+# def overlay_cleanup_rules()
+
+# EventCleanup: Applies a list of CleanupRules to a stream of events, counting the events each removes or changes
+#
+class EventCleanup(object):
+    def __init__(self, rules):
+        self.rules = list(rules)
+        # Number of events input, and output
+        self.rows_in = 0
+        self.rows_out = 0
+        # Number of events removed or changed by each rule, by rule name
+        self.counts = {}
+        for rule in self.rules:
+            self.counts[rule.name] = 0
+        # for
+    # def __init__()
+
+    # apply: Apply the rules to a stream of events
+    #
+    # Parameter: events - iterable of dicts
+    # Return value: generator of the dicts not removed, as changed by the rules
+    #
+    def apply(self, events):
+        rules = [(rule.name, rule.action == 'drop', rule.predicate, rule.transform) for rule in self.rules]
+        counts = self.counts
+        for event in events:
+            self.rows_in += 1
+            dropped = False
+            for (name, drop, predicate, transform) in rules:
+                if predicate(event):
+                    counts[name] += 1
+                    if drop:
+                        dropped = True
+                        break
+                    # end_if
+                    transform(event)
+                # end_if
+            # for
+            if not dropped:
+                self.rows_out += 1
+                yield event
+            # end_if
+        # for
+    # def apply()
+
+    # report: Return a one-line summary of the cleanup, e.g., for a progress message
+    #
+    def report(self):
+        return ("Cleanup: " + str(self.rows_in) + " event(s) in, " + str(self.rows_out) + " out; " +
+                ', '.join([rule.name + ' ' + ('removed ' if rule.action == 'drop' else 'changed ') + str(self.counts[rule.name])
+                           for rule in self.rules]) + ".")
+    # def report()
+# class EventCleanup
@@ -0,0 +1,101 @@
+# event_coalescing.py - Coalescing of runs of contiguous overlay events with identical attributes.
+#
+# The UNION overlays split the route at every breakpoint of every input event table, so many adjacent output
+# events have the same values of all of the attributes that phase 2 uses (tmc, town_id, speed_lim, num_lanes, ...)
+# and differ only in their measures: e.g., a speed limit change on the secondary-direction route splits every TMC
+# event of the primary-direction route. Each such event is exported to the intermediate file, and handed to
+# process_csv_file.process_one_tmc_id, separately. An EventCoalescer merges each run of consecutive events that
+# have equal values of all of the coalesce_fields, and of which each begins (within a measure tolerance) where the
+# previous one ends, into a single event: the first event of the run, with the to_meas of the last, and the sum of
+# the calc_lens of all. The total length (calc_len) of the events is thus preserved, and the summary record that
+# phase 2 computes for each TMC is unchanged (its speed limit and number of lanes are length-weighted averages,
+# its towns are the distinct town_ids, and its from_meas and to_meas are those of its first and last events).
+#
+# The events are expected in ascending order of from_meas (e.g., sorted on from_meas and tmc, as the records of
+# output_event_table are), and are output in the same order: a merged event is output only once no later event
+# can extend it, i.e., once an event beginning beyond its end (plus the tolerance) is read, or the run is broken
+# by an event with the same attributes that does not adjoin it. Only the events not yet output are held in memory.
+#
+# Events are dicts, with (at least) the fields 'from_meas', 'to_meas', 'calc_len', and the coalesce_fields.
+#
+# This module does not depend upon arcpy.
+
+import collections
+
+# The attributes of an event used by phase 2 (see process_csv_file.event_record_fields), other than its measures
+coalesce_fields = ['route_id', 'tmc', 'tmctype', 'roadnum', 'direction', 'firstnm', 'town_id', 'speed_lim', 'num_lanes']
+
+# Default measure tolerance: the greatest gap (or overlap) between two events that are treated as contiguous
+default_measure_tolerance = 1e-6
+
+# EventCoalescer: Coalesces a stream of events (see above), counting the events input and output
+#
+class EventCoalescer(object):
+    # __init__: Create a coalescer
+    #
+    # Parameters: fields - (optional) the fields whose values must be equal for events to be merged
+    #             tolerance - (optional) measure tolerance
+    #
+    def __init__(self, fields=None, tolerance=default_measure_tolerance):
+        self.fields = list(fields) if fields is not None else list(coalesce_fields)
+        self.tolerance = tolerance
+        self.rows_in = 0
+        self.rows_out = 0
+    # def __init__()
+
+    # compression_ratio: Return the ratio of the number of events input to the number output (1.0 if none were input)
+    #
+    def compression_ratio(self):
+        return float(self.rows_in) / self.rows_out if self.rows_out > 0 else 1.0
+    # def compression_ratio()
+
+    # apply: Coalesce a stream of events
+    #
+    # Parameter: events - iterable of dicts, in ascending order of from_meas
+    # Return value: generator of dicts, in the same order; merged events are the first event of each run, changed in place
+    #
+    def apply(self, events):
+        fields = self.fields
+        tolerance = self.tolerance
+        # Events not yet output, in order; and the last of them with each tuple of attribute values (the only one that
+        # may yet be extended)
+        pending = collections.deque()
+        open_events = {}
+        for event in events:
+            self.rows_in += 1
+            key = tuple([event[field] for field in fields])
+            open_event = open_events.get(key)
+            if open_event is not None and abs(event['from_meas'] - open_event['to_meas']) <= tolerance:
+                open_event['to_meas'] = event['to_meas']
+                open_event['calc_len'] += event['calc_len']
+            else:
+                pending.append((key, event))
+                open_events[key] = event
+            # end_if
+            # Output the pending events that can no longer be extended
+            while len(pending) > 0:
+                first_key, first_event = pending[0]
+                if open_events.get(first_key) is first_event and event['from_meas'] <= first_event['to_meas'] + tolerance:
+                    break
+                # end_if
+                pending.popleft()
+                if open_events.get(first_key) is first_event:
+                    del open_events[first_key]
+                # end_if
+                self.rows_out += 1
+                yield first_event
+            # while
+        # for
+        while len(pending) > 0:
+            self.rows_out += 1
+            yield pending.popleft()[1]
+        # while
+    # def apply()
+
+    # report: Return a one-line summary of the coalescing, e.g., for a progress message
+    #
+    def report(self):
+        return ("Coalesced " + str(self.rows_in) + " event(s) into " + str(self.rows_out) +
+                " (compression ratio " + ('%.2f' % self.compression_ratio()) + ").")
+    # def report()
+# class EventCoalescer
@@ -0,0 +1,186 @@
+# external_sort.py - Sorting of record streams larger than memory: an external merge sort with a memory budget.
+#
+# The pipeline sorts the raw TMC event table (on from_meas), and the cleaned-up overlay event table (on from_meas
+# and tmc), and process_csv_file may have to group the records of the intermediate CSV file by TMC; for statewide
+# runs, none of these should require either holding a whole table in memory, or another geoprocessing round trip
+# (arcpy.Sort_management). sort_records sorts a stream of records (e.g., rows read with an arcpy.da.SearchCursor,
+# or EventRecords read from a CSV file), as follows:
+#     1. records are read into a "run" until the run would exceed the memory budget (the size of a record being
+#        estimated from the first record read; see estimate_record_size)
+#     2. each run is sorted in memory (Python's sort is stable) - unless it is already in order, which is noted
+#        as the records are read - and "spilled" to a temporary file
+#     3. the runs are merged, with a k-way merge (heapq.merge, which is also stable); if there are more than
+#        max_merge_fan_in runs, groups of runs are first merged into longer runs
+# If all of the records fit in a single run, nothing is written to disk; and if the input turns out to have been
+# in order (i.e., every run was in order, and each run began no earlier than the previous one ended), the runs are
+# simply read back in turn, rather than merged.
+#
+# Records are spilled with pickle, in batches, and so must be picklable (tuples, lists, dicts, and namedtuples
+# defined at the top level of a module, e.g., process_csv_file.EventRecord, are). The temporary files are deleted
+# when the sorted stream is exhausted or closed.
+#
+# This module does not depend upon arcpy.
+
+import heapq
+import os
+import pickle
+import sys
+import tempfile
+
+# Default memory budget for the records held in memory at once, in bytes
+default_memory_budget = 256 * 1024 * 1024
+
+# Maximum number of runs merged at once
+max_merge_fan_in = 64
+
+# Maximum number of records pickled (and read back) as a single batch
+max_batch_records = 1000
+
+# estimate_record_size: Return an estimate of the number of bytes of memory occupied by a record (and a reference to it)
+#
+# Parameter: rec - a record: tuple, list, or dict (of scalar values)
+# Return value: number of bytes
+#
+def estimate_record_size(rec):
+    values = rec.values() if isinstance(rec, dict) else rec if isinstance(rec, (tuple, list)) else []
+    return sys.getsizeof(rec) + sum(sys.getsizeof(value) for value in values) + 8
+# def estimate_record_size()
+
+# write_run: Write a run of records to a temporary file
+#
+# Parameters: run - list of records
+#             batch_size - number of records pickled together
+#             tmp_dir - directory in which the file is written; None for the system's temporary directory
+# Return value: full path of the file
+#
+def write_run(run, batch_size, tmp_dir=None):
+    fd, path = tempfile.mkstemp(prefix='tmc_sort_', suffix='.run', dir=tmp_dir)
+    with os.fdopen(fd, 'wb') as f:
+        for b in range(0, len(run), batch_size):
+            pickle.dump(run[b:b+batch_size], f, pickle.HIGHEST_PROTOCOL)
+        # for
+    # with
+    return path
+# def write_run()
+
+# read_run: Read back, one at a time, the records of a run written by write_run
+#
+def read_run(path):
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                batch = pickle.load(f)
+            except EOFError:
+                break
+            # try/except
+            for rec in batch:
+                yield rec
+            # for
+        # while
+    # with
+# def read_run()
+
+# merge_runs: Merge runs written by write_run into a single run, reducing the number of runs to at most max_merge_fan_in
+#
+# Parameters: run_paths - list of full paths of the runs, in the order in which they were read; the files are deleted
+#             key - function returning the sort key of a record
+#             batch_size, tmp_dir - see write_run
+# Return value: list of the full paths of the runs remaining
+#
+def merge_runs(run_paths, key, batch_size, tmp_dir=None):
+    while len(run_paths) > max_merge_fan_in:
+        group = run_paths[:max_merge_fan_in]
+        fd, path = tempfile.mkstemp(prefix='tmc_sort_', suffix='.run', dir=tmp_dir)
+        with os.fdopen(fd, 'wb') as f:
+            batch = []
+            for rec in heapq.merge(*[read_run(run_path) for run_path in group], key=key):
+                batch.append(rec)
+                if len(batch) == batch_size:
+                    pickle.dump(batch, f, pickle.HIGHEST_PROTOCOL)
+                    batch = []
+                # end_if
+            # for
+            if len(batch) > 0:
+                pickle.dump(batch, f, pickle.HIGHEST_PROTOCOL)
+            # end_if
+        # with
+        for run_path in group:
+            os.remove(run_path)
+        # for
+        # The merged run takes the place of the runs merged, so that equal records remain in the order in which they were read
+        run_paths = [path] + run_paths[max_merge_fan_in:]
+    # while
+    return run_paths
+# def merge_runs()
+
+# sort_records: Sort a stream of records, holding (about) at most memory_budget bytes of records in memory at once
+#
+# Parameters: records - iterable of records
+#             key - function returning the sort key of a record
+#             memory_budget - (optional) memory budget, in bytes
+#             tmp_dir - (optional) directory in which runs are written; None for the system's temporary directory
+# Return value: generator of the records, in order (stable)
+#
+def sort_records(records, key, memory_budget=default_memory_budget, tmp_dir=None):
+    run_paths = []
+    try:
+        run = []; run_capacity = None; batch_size = None
+        # Whether each run, and all of the input so far, are in order
+        run_in_order = True; all_in_order = True
+        last_key = None
+        for rec in records:
+            if run_capacity is None:
+                run_capacity = max(1, memory_budget // estimate_record_size(rec))
+                # During the merge, a batch from each of (up to) max_merge_fan_in runs is held in memory
+                batch_size = max(1, min(max_batch_records, run_capacity // (max_merge_fan_in + 1)))
+            # end_if
+            rec_key = key(rec)
+            if last_key is not None and rec_key < last_key:
+                if len(run) > 0:
+                    run_in_order = False
+                # end_if
+                all_in_order = False
+            # end_if
+            last_key = rec_key
+            run.append(rec)
+            if len(run) == run_capacity:
+                if not run_in_order:
+                    run.sort(key=key)
+                # end_if
+                run_paths.append(write_run(run, batch_size, tmp_dir))
+                run = []; run_in_order = True
+            # end_if
+        # for
+        if not run_in_order:
+            run.sort(key=key)
+        # end_if
+        if len(run_paths) == 0:
+            for rec in run:
+                yield rec
+            # for
+            return
+        # end_if
+        if len(run) > 0:
+            run_paths.append(write_run(run, batch_size, tmp_dir))
+        # end_if
+        run = []
+        if all_in_order:
+            for run_path in run_paths:
+                for rec in read_run(run_path):
+                    yield rec
+                # for
+            # for
+        else:
+            run_paths = merge_runs(run_paths, key, batch_size, tmp_dir)
+            for rec in heapq.merge(*[read_run(run_path) for run_path in run_paths], key=key):
+                yield rec
+            # for
+        # end_if
+    finally:
+        for run_path in run_paths:
+            if os.path.exists(run_path):
+                os.remove(run_path)
+            # end_if
+        # for
+    # try/finally
+# def sort_records()
@@ -21,6 +21,15 @@
 #   3. A file containing a list of TMC ID's whose corresponing 'Speed Limit'
 #      and 'Number of Travel Lanes' features are to be located against
 #      the specified route pair.
+#   4. (Optional) A "scratch" directory, in which the file geodatabases
+#      containing the event tables generated along the way are created.
+#      This allows several instances of this script to run concurrently
+#      (see batch_generate_tmc_events.py). If not specified, the event tables
+#      are written to the geodatabases in the base directory.
+#   5. (Optional) 'VERIFIED' if the caller has already brought the local caches
+#      (the route geometry cache, the town event index, the TMC store, and the
+#      LRSE event indices) up to date, as batch_generate_tmc_events.py does before
+#      starting its workers. The caches are then opened without being verified.
 #
 # NOTE: Parameters (1) and (2) are sufficient to create a query string that
 #      will select the desired route pair (primary and secondary direction.)
@@ -44,8 +53,26 @@
 # 03/11-12/2020
 # ---------------------------------------------------------------------------
 
+import os
 import arcpy
 import process_csv_file
+import lr_projection
+import route_geometry_cache
+import lrse_event_index
+import intermediate_format
+import process_csv_columnar
+import pipeline_metrics
+import pipeline_logging
+import pipeline_dag
+import external_sort
+import event_cleanup
+import event_coalescing
+import streaming_pipeline
+import route_event_overlay
+import massdot_routes
+import town_boundaries
+import tmc_store
+import tmc_location_cache
 
 try:
     import pydash
@@ -57,33 +84,73 @@ except:
     exit()
 # try/except
    
+# Progress messages are written through the (leveled, buffered) logger shared by the pipeline; see pipeline_logging.py.
+# Per-TMC messages are logged at DEBUG, and are only written if the TMC_LOG_LEVEL environment variable is set to DEBUG.
+log = pipeline_logging.get_logger()
+
 # Script parameters
 # First parameter, MassDOT route_id "route" is REQUIRED
-MassDOT_route_id_root = arcpy.GetParameterAsText(0)
+MassDOT_route_id_root = arcpy.GetParameterAsText(0).strip()
 # Debug/trace
-arcpy.AddMessage("Processing " + MassDOT_route_id_root) 
+log.info("Processing " + MassDOT_route_id_root) 
 
 # Second parameter, primary route direction, is REQUIRED
 primary_route_dir = arcpy.GetParameterAsText(1)
-secondary_route_dir = 'SB' if primary_route_dir == 'NB' else 'WB'
+# The secondary direction of some routes is coded irregularly, e.g., 'SR135 EB' / 'SR135 SB' (see massdot_routes.py)
+#
+# *** Beginning of original code:
+#
+# secondary_route_dir = 'SB' if primary_route_dir == 'NB' else 'WB'
+#
+# *** End of original code
+#
+secondary_route_dir = massdot_routes.secondary_direction(primary_route_dir, MassDOT_route_id_root)
 
-MassDOT_route_query_string  = "route_id = " + "'" + MassDOT_route_id_root + primary_route_dir + "'"
-MassDOT_route_query_string += " OR route_id = "  + "'"  + MassDOT_route_id_root + secondary_route_dir + "'"
-arcpy.AddMessage("MassDOT_route_query_string = " + MassDOT_route_query_string)
+# MassDOT route_id of the primary direction of the route, e.g., "SR9 EB"
+MassDOT_route_id = MassDOT_route_id_root + ' ' + primary_route_dir
 
-arcpy.Warning("*** WARNING: This script is under development.")
+MassDOT_route_query_string  = "route_id = " + "'" + MassDOT_route_id_root + ' ' + primary_route_dir + "'"
+MassDOT_route_query_string += " OR route_id = "  + "'"  + MassDOT_route_id_root + ' ' + secondary_route_dir + "'"
+log.info("MassDOT_route_query_string = " + MassDOT_route_query_string)
+
+log.warning("*** WARNING: This script is under development.")
 
 # Third parameter, indicating a file containing a specified list of TMCs, is REQUIRED.    
 TMC_list_file = arcpy.GetParameterAsText(2)
 #  Debug/trace
-arcpy.AddMessage("TMC_list_file = " + TMC_list_file)
+log.info("TMC_list_file = " + TMC_list_file)
 
-f = open(TMC_list_file, 'r')
-str1 = f.read()
-str2 = str1.replace('\n', '')
-INRIX_query_string = "tmc IN (" + str2 + ")"
-arcpy.AddMessage("Using specified list of TMCs.")
-arcpy.AddMessage("INRIX_query_string = " + INRIX_query_string)
+# The listed TMCs are selected from the local TMC store (see tmc_store.py and below), rather than
+# by passing a "tmc IN (...)" where-clause, which may be enormous, to MakeFeatureLayer_management.
+#
+# *** Beginning of original code:
+#
+# f = open(TMC_list_file, 'r')
+# str1 = f.read()
+# str2 = str1.replace('\n', '')
+# INRIX_query_string = "tmc IN (" + str2 + ")"
+# log.info("Using specified list of TMCs.")
+# log.info("INRIX_query_string = " + INRIX_query_string)
+#
+# *** End of original code
+#
+tmc_ids, duplicate_tmc_ids, malformed_tmc_ids = tmc_store.read_tmc_list(TMC_list_file)
+log.info("Using specified list of " + str(len(tmc_ids)) + " TMCs.")
+# List at most this many of the IDs in any warning about them
+max_listed_tmc_ids = 20
+for (tmc_id_list, problem) in [(duplicate_tmc_ids, 'duplicate'), (malformed_tmc_ids, 'malformed')]:
+    if len(tmc_id_list) > 0:
+        more = ' and ' + str(len(tmc_id_list) - max_listed_tmc_ids) + ' more' if len(tmc_id_list) > max_listed_tmc_ids else ''
+        log.warning("*** WARNING: " + str(len(tmc_id_list)) + " " + problem + " TMC ID(s) in " + TMC_list_file + " ignored: " + 
+                    ', '.join(tmc_id_list[:max_listed_tmc_ids]) + more)
+    # end_if
+# for
+
+# Fourth parameter, the "scratch" directory, is OPTIONAL.
+scratch_dir = arcpy.GetParameterAsText(3)
+
+# Fifth parameter, whether the local caches have already been verified, is OPTIONAL.
+verify_caches = arcpy.GetParameterAsText(4).upper() != 'VERIFIED'
 
 
 # Path to "base directory" in which all output files are written,
@@ -131,19 +198,34 @@ towns_pb_r = sde_mpodata_ro_connection + '\mpodata.mpodata.boundary\mpodata.mpod
 
 # OUTPUT DATA: Event tables and CSV file
 
+# Full path of local directory containing the route geometry cache (see route_geometry_cache.py)
+route_geometry_cache_dir = os.path.join(os.path.expanduser('~'), 'conflate-tmcs-and-massdot-arterials', 'route_geometry_cache')
+
 # Full path to geodatabase containing "template" TMC event table.
 tmc_template_event_table_gdb =  base_dir + "\\tmc_event_table_template.gdb"
 
 # Full paths of geodatabases in which event tables are written
 #
-tmc_event_table_gdb = base_dir + "\\tmc_events.gdb"
-town_event_table_gdb = base_dir + "\\town_events.gdb"
-overlay_events_1_gdb = base_dir + "\\overlay_1.gdb"
-speed_limit_event_table_gdb = base_dir + "\\speed_limit_events.gdb"
-overlay_events_2_gdb = base_dir + "\\overlay_2.gdb"
-num_lanes_event_table_gdb = base_dir + "\\num_lanes_events.gdb"
-overlay_events_3_gdb = base_dir + "\\overlay_3.gdb"
-output_events_gdb = base_dir + "\\output_prep.gdb"
+event_table_dir = scratch_dir if scratch_dir != '' else base_dir
+tmc_event_table_gdb = event_table_dir + "\\tmc_events.gdb"
+town_event_table_gdb = event_table_dir + "\\town_events.gdb"
+overlay_events_1_gdb = event_table_dir + "\\overlay_1.gdb"
+speed_limit_event_table_gdb = event_table_dir + "\\speed_limit_events.gdb"
+overlay_events_2_gdb = event_table_dir + "\\overlay_2.gdb"
+num_lanes_event_table_gdb = event_table_dir + "\\num_lanes_events.gdb"
+overlay_events_3_gdb = event_table_dir + "\\overlay_3.gdb"
+output_events_gdb = event_table_dir + "\\output_prep.gdb"
+
+# Create the geodatabases in the scratch directory, if they don't already exist there
+if scratch_dir != '':
+    arcpy.env.scratchWorkspace = scratch_dir
+    for gdb in [tmc_event_table_gdb, town_event_table_gdb, overlay_events_1_gdb, speed_limit_event_table_gdb, 
+                overlay_events_2_gdb, num_lanes_event_table_gdb, overlay_events_3_gdb, output_events_gdb]:
+        if not arcpy.Exists(gdb):
+            arcpy.CreateFileGDB_management(scratch_dir, gdb.split('\\')[-1])
+        # end_if
+    # for
+# end_if
 
 # Full path of directory in which intermediate CSV file is written
 # 
@@ -171,6 +253,7 @@ overlay_event_table_3_name = base_table_name + "_events_overlay_3"
 # Subsequent processing (by process_csv_file.py) writes out the FINAL CSV file.
 output_event_table_name = base_table_name + "_events_output"
 output_csv_file_name_1 = base_table_name + "_events_output.csv"
+output_npy_file_name_1 = base_table_name + "_events_output" + intermediate_format.file_extension
 output_csv_file_name_2 = base_table_name + "_events_final.csv"
 
 # Full path of "template" TMC event table
@@ -193,6 +276,34 @@ output_event_table = output_events_gdb + "\\" + output_event_table_name
 # Full path of generated intermediate CSV file
 #
 output_csv_1 = output_csv_dir_1 + "\\" + output_csv_file_name_1
+
+# Full path of directory in which the metrics record for each route pair is written (see pipeline_metrics.py)
+metrics_dir = base_dir + "\\metrics"
+metrics_file_name = base_table_name + "_metrics.json"
+
+# Format of the intermediate file read by phase 2: 'npy' for the typed, columnar format read by 
+# memory-mapping it (see intermediate_format.py), or 'csv' for the intermediate CSV file
+intermediate_file_format = 'npy'
+# Export the intermediate CSV file, even if it is not the intermediate file read by phase 2
+export_intermediate_csv = True
+# Mode in which the overlays, cleanup, sort, export, and phase 2 are performed: 'tables' to produce each
+# intermediate event table and file in turn, using arcpy; or 'streaming' to perform them all as a single
+# stream of events, in memory, writing only the final CSV file (see streaming_pipeline.py)
+pipeline_mode = 'tables'
+# Write the town, speed limit, and number-of-lanes events of the route pair to event tables (for inspection) in 'tables'
+# mode; the overlay reads the events in memory (see route_event_overlay.py), rather than from these tables
+write_event_tables = False
+# Log the stages that generate the events of the route, and their critical path, without running them (see below)
+pipeline_dry_run = False
+# Maximum number of those stages run at once (see pipeline_dag.py)
+max_stage_workers = 4
+# Memory budget, in bytes, of the native (external merge) sorts of the event tables and of the intermediate file
+# (see external_sort.py), which take the place of arcpy.Sort_management
+sort_memory_budget = external_sort.default_memory_budget
+# Merge runs of contiguous overlay events with identical attributes before they are exported, or aggregated 
+# (see event_coalescing.py), and the measure tolerance within which events are treated as contiguous
+coalesce_events = True
+coalesce_measure_tolerance = event_coalescing.default_measure_tolerance
 #
 # Full path of generated final CSV file
 output_csv_2 = output_csv_dir_2 + "\\" + output_csv_file_name_2
@@ -200,16 +311,24 @@ output_csv_2 = output_csv_dir_2 + "\\" + output_csv_file_name_2
 
 # Processing, per se, begins here
 
-# Make Feature Layer "INRIX_TMCS": from INRIX TMCs, select TMCs using the INRIX_query_string
-arcpy.MakeFeatureLayer_management(INRIX_MASSACHUSETTS_TMC_2019, INRIX_TMCS, INRIX_query_string, 
-                                  "", "objectid objectid HIDDEN NONE;tmc tmc VISIBLE NONE;tmctype tmctype VISIBLE NONE;linrtmc linrtmc HIDDEN NONE;frc frc VISIBLE NONE;lenmiles lenmiles VISIBLE NONE;strtlat strtlat HIDDEN NONE;strtlong strtlong HIDDEN NONE;endlat endlat HIDDEN NONE;endlong endlong HIDDEN NONE;roadnum roadnum VISIBLE NONE;roadname roadname VISIBLE NONE;firstnm firstnm VISIBLE NONE;direction direction VISIBLE NONE;country country HIDDEN NONE;state state HIDDEN NONE;zipcode zipcode HIDDEN NONE;shape shape HIDDEN NONE;st_length(shape) st_length(shape) HIDDEN NONE")
+# Record the time spent in, and the number of rows input to and output by, each stage of processing
+metrics = pipeline_metrics.PipelineMetrics({ 'route_id_root' : MassDOT_route_id_root, 'primary_dir' : primary_route_dir, 
+                                             'route_id' : MassDOT_route_id })
+
+# The listed TMCs are selected from the local TMC store (see below), rather than by making a feature layer.
+#
+# *** Beginning of original code:
+#
+# # Make Feature Layer "INRIX_TMCS": from INRIX TMCs, select TMCs using the INRIX_query_string
+# arcpy.MakeFeatureLayer_management(INRIX_MASSACHUSETTS_TMC_2019, INRIX_TMCS, INRIX_query_string, 
+#                                   "", "objectid objectid HIDDEN NONE;tmc tmc VISIBLE NONE;tmctype tmctype VISIBLE NONE;linrtmc linrtmc HIDDEN NONE;frc frc VISIBLE NONE;lenmiles lenmiles VISIBLE NONE;strtlat strtlat HIDDEN NONE;strtlong strtlong HIDDEN NONE;endlat endlat HIDDEN NONE;endlong endlong HIDDEN NONE;roadnum roadnum VISIBLE NONE;roadname roadname VISIBLE NONE;firstnm firstnm VISIBLE NONE;direction direction VISIBLE NONE;country country HIDDEN NONE;state state HIDDEN NONE;zipcode zipcode HIDDEN NONE;shape shape HIDDEN NONE;st_length(shape) st_length(shape) HIDDEN NONE")
+#
+# *** End of original code
 
 # Make Feature Layer "Selected_LRSN_Route": from MASSDOT LRSN_Routes select route with MassDOT_route_id
 arcpy.MakeFeatureLayer_management(MASSDOT_LRSN_Routes_19Dec2019, Selected_LRSN_Route, MassDOT_route_query_string, 
                                    "", "objectid objectid HIDDEN NONE;from_date from_date HIDDEN NONE;to_date to_date HIDDEN NONE;route_system route_system HIDDEN NONE;route_number route_number HIDDEN NONE;route_direction route_direction HIDDEN NONE;route_id route_id VISIBLE NONE;route_type route_type VISIBLE NONE;route_qualifier route_qualifier HIDDEN NONE;alternate_route_number alternate_route_number HIDDEN NONE;created_by created_by HIDDEN NONE;date_created date_created HIDDEN NONE;edited_by edited_by HIDDEN NONE;date_edited date_edited HIDDEN NONE;globalid globalid HIDDEN NONE;shape shape HIDDEN NONE;st_length(shape) st_length(shape) HIDDEN NONE")
 
-arcpy.AddMessage("Generating TMC events.")
-
 # Generate TMC events: "locate" TMCs along MassDOT routes
 #
 # NOTE: We found that the out-of-the-box ESRI 'Locate Features Along Routes' doesn't quite do the job we need.
@@ -231,17 +350,36 @@ arcpy.AddMessage("Generating TMC events.")
 #
 # *** Beginning of replacement code:
 #
-# Make a copy of the "template" TMC event table into which the raw (unsorted) TMC events will be written
-arcpy.CreateTable_management(tmc_event_table_gdb, tmc_event_table_name_raw, tmc_template_event_table)
-
 # Indices in the vector of fields (i.e., attributes) to be read in from the TMC FC
 route_feat_route_id_ix = 0; route_feat_shape_ix = 1
 #
-# Get the geometry of the selected LRSN route
-route_sc = arcpy.da.SearchCursor(Selected_LRSN_Route,['route_id', 'shape@'])
+# Get the route_id of the selected LRSN route
+route_sc = arcpy.da.SearchCursor(Selected_LRSN_Route,['route_id'])
 route_feat = route_sc.next()
-route_feat_last_m_value = route_feat[route_feat_shape_ix].lastPoint.M
-
+del route_sc
+# Get the geometry of the selected LRSN route from the local route geometry cache (see route_geometry_cache.py),
+# which is rebuilt from MASSDOT_LRSN_Routes_19Dec2019 only if it has changed, and hold it in the native 
+# linear referencing engine (see lr_projection.py), which projects all of the TMC endpoints in a single batch.
+route_geom_cache = route_geometry_cache.open_cache(MASSDOT_LRSN_Routes_19Dec2019, route_geometry_cache_dir, verify_caches)
+route_geom = route_geom_cache.get_route_geometry(route_feat[route_feat_route_id_ix])
+route_feat_last_m_value = route_geom.last_m_value
+# The route_ids of both routes of the route pair, and the M-value of the last point of each
+# (used to query the LRSE event indices; see below)
+route_pair_route_ids = [MassDOT_route_id_root + ' ' + primary_route_dir, MassDOT_route_id_root + ' ' + secondary_route_dir]
+route_pair_route_ids = [route_id for route_id in route_pair_route_ids if route_id in route_geom_cache.routes]
+route_pair_last_m_values = {}
+for route_id in route_pair_route_ids:
+    route_pair_last_m_values[route_id] = route_geom_cache.get_route_geometry(route_id).last_m_value
+# for
+
+# The TMC, town, speed limit, and number-of-lanes events depend only upon the selected route (and route pair),
+# not upon each other, so their generation is expressed as the stages of a dependency graph (see pipeline_dag.py),
+# and the stages that do not depend upon each other are run concurrently. Stages that call arcpy - opening the
+# local TMC store and event indices (which may check, or rebuild, them), and writing event tables - are run in
+# the main thread; the others (selecting and projecting TMCs, and querying the indices) run on a pool of threads.
+# Each stage is recorded in the metrics under its name. If pipeline_dry_run is set, the graph, and its critical
+# path (estimated from the metrics record of the previous run, if any), are logged, and nothing is run.
+stage_graph = pipeline_dag.PipelineGraph(metrics)
 
 # Names of fields (i.e., attributes) read in from the TMC FC
 tmc_fc_fieldnames = ['tmc', 'tmctype','roadnum', 'firstnm', 'direction', 'shape@']
@@ -255,226 +393,521 @@ et_fieldnames = ['route_id', 'from_meas', 'to_meas', 'tmc', 'tmctype', 'roadnum'
 et_route_id_ix = 0; et_from_meas_ix = 1; et_to_meas_ix = 2; et_tmc_ix = 3; 
 et_tmctype_ix = 4; et_roadnum_ix = 5; et_firstnm_ix = 6; et_direction_ix = 7
 
-# "Insert" cursor for output event table
-out_csr = arcpy.da.InsertCursor(tmc_event_table_raw, et_fieldnames)
+# Names and types of the fields of the output event table (i.e., the cleaned-up, sorted overlay events)
+# following those of the TMC event table, in the order of the fields of the original overlay_events_3:
+# the route_id fields of the speed limit and number-of-lanes event tables are carried through by the overlay
+# as route_id_1 and route_id_12 (see streaming_pipeline.event_table_fields)
+output_event_table_added_fields = [('town', 'TEXT'), ('town_id', 'LONG'), ('route_id_1', 'TEXT'), ('speed_lim', 'LONG'),
+                                   ('route_id_12', 'TEXT'), ('num_lanes', 'LONG'), ('calc_len', 'DOUBLE')]
 
-# Loop over the selected TMC features, which are to be located on the selected route feature
+# Read the selected TMC features, which are to be located on the selected route feature,
+# retaining their attributes and the coordinates of their first and last points
 #
-for tmc_feat in arcpy.da.SearchCursor(INRIX_TMCS, tmc_fc_fieldnames):
-    tmc_id = tmc_feat[tmc_feat_tmc_id_ix]
- 
-    tmc_feat_fromPoint = tmc_feat[tmc_feat_shape_ix].firstPoint
-    tmc_feat_toPoint = tmc_feat[tmc_feat_shape_ix].lastPoint
-
-    projected_fromPtGeom = route_feat[route_feat_shape_ix].queryPointAndDistance(tmc_feat_fromPoint)
-    projected_toPtGeom = route_feat[route_feat_shape_ix].queryPointAndDistance(tmc_feat_toPoint)
+# The TMCs are looked up, by ID, in the local store of the attributes and endpoints of all INRIX TMCs
+# (see tmc_store.py), which is rebuilt from INRIX_MASSACHUSETTS_TMC_2019 only if it has changed.
+#
+# *** Beginning of original code:
+#
+# for tmc_feat in arcpy.da.SearchCursor(INRIX_TMCS, tmc_fc_fieldnames):
+#     tmc_feats.append(tmc_feat[:tmc_feat_shape_ix])
+#     tmc_from_xs.append(tmc_feat[tmc_feat_shape_ix].firstPoint.X)
+#     tmc_from_ys.append(tmc_feat[tmc_feat_shape_ix].firstPoint.Y)
+#     tmc_to_xs.append(tmc_feat[tmc_feat_shape_ix].lastPoint.X)
+#     tmc_to_ys.append(tmc_feat[tmc_feat_shape_ix].lastPoint.Y)
+# # for tmc_feat
+#
+# *** End of original code
+#
+tmc_store_stage = stage_graph.add_stage('tmc_store', lambda: tmc_store.open_store(INRIX_MASSACHUSETTS_TMC_2019, route_geometry_cache_dir, verify_caches),
+                                        main_thread=True)
 
-    # If the M-value of the "projected" point lies beyond either the beginning or the end of the route,
-    # force it to the M-value of the beginning of the route (0.0) or to route_feat_last_m_value, respectively.
-    if projected_fromPtGeom[0].firstPoint.M >= 0.0:
-        from_meas = projected_fromPtGeom[0].firstPoint.M if (projected_fromPtGeom[0].firstPoint.M <= route_feat_last_m_value) else route_feat_last_m_value
-    else:
-        from_meas = 0.0
-    # end_if
-    
-    if projected_toPtGeom[0].firstPoint.M >= 0.0:
-        to_meas = projected_toPtGeom[0].firstPoint.M if (projected_toPtGeom[0].firstPoint.M <= route_feat_last_m_value) else route_feat_last_m_value
-    else:
-        to_meas = 0.0
+# locate_tmcs: Select the listed TMCs from the TMC store, and locate them along the selected route
+#
+# Parameter: inrix_tmc_store - tmc_store.TmcStore
+# Return value: tuple of (list of the attributes of each TMC, from_meas array, to_meas array, list of booleans
+#               indicating which events are to be kept)
+#
+def locate_tmcs(inrix_tmc_store):
+    log.info("Generating TMC events.")
+    selected_tmcs, missing_tmc_ids = inrix_tmc_store.select(tmc_ids)
+    if len(missing_tmc_ids) > 0:
+        more = ' and ' + str(len(missing_tmc_ids) - max_listed_tmc_ids) + ' more' if len(missing_tmc_ids) > max_listed_tmc_ids else ''
+        log.warning("*** WARNING: " + str(len(missing_tmc_ids)) + " listed TMC(s) not found in " + INRIX_MASSACHUSETTS_TMC_2019 + ": " + 
+                    ', '.join(missing_tmc_ids[:max_listed_tmc_ids]) + more)
     # end_if
-    
-    # OLD CODE:
-    # from_meas = projected_fromPtGeom[0].firstPoint.M if (projected_fromPtGeom[0].firstPoint.M >= 0.0) else 0.0
-    # to_meas = projected_toPtGeom[0].firstPoint.M if (projected_toPtGeom[0].firstPoint.M >= 0.0) else 0.0
-    
-    # debug/trace
-    # print 'Processing ' + tmc_id + ', ' + str(from_meas) + ', ' + str(to_meas)      
-       
-    # Do not write out zero-length events
-    if (from_meas >= 0.0 and to_meas > 0.0) and (from_meas != to_meas):
-        roh = [route_feat[route_feat_route_id_ix], from_meas, to_meas, 
-               tmc_feat[tmc_feat_tmc_id_ix], tmc_feat[tmc_feat_tmctype_ix], 
-               tmc_feat[tmc_feat_roadnum_ix], tmc_feat[tmc_feat_firstnm_ix], tmc_feat[tmc_feat_direction_ix]]   
-        out_csr.insertRow(roh)
-        arcpy.AddMessage('Inserted event: ' + tmc_id + ', ' + str(from_meas) + ', ' + str(to_meas))
-    else:
-        # Zero-length event
-        arcpy.AddMessage('Discarded zero-length event: ' + tmc_id + ', ' + str(from_meas) + ', ' + str(to_meas))
-    # if
-# for tmc_feat
-
-# Close the insert cursor - not exactly the best choice of API name!
-del out_csr 
-arcpy.AddMessage('Closed insert cursor.')
-
-
-# Sort the raw TMC event table in ascending order on the 'from_meas' field
-arcpy.Sort_management(tmc_event_table_raw, tmc_event_table, [["from_meas", "ASCENDING"]])
+    tmc_feats = []
+    tmc_from_xs = []; tmc_from_ys = []; tmc_to_xs = []; tmc_to_ys = []
+    for (tmc_attrs, from_x, from_y, to_x, to_y) in selected_tmcs:
+        tmc_feats.append(tmc_attrs)
+        tmc_from_xs.append(from_x)
+        tmc_from_ys.append(from_y)
+        tmc_to_xs.append(to_x)
+        tmc_to_ys.append(to_y)
+    # for
+
+    # Project the first and last points of all TMCs onto the route as a batch: with NumPy, each point against the
+    # segments in the grid cells around it, one at a time only for points far from the route (see lr_projection.py).
+    # If the M-value of a "projected" point lies beyond either the beginning or the end of the route,
+    # it is forced to the M-value of the beginning of the route (0.0) or to route_feat_last_m_value, respectively.
+    # Zero-length events are flagged in tmc_keep.
+    # Only the TMCs whose locations (keyed by the geometry of the TMC and of the route) are not in the local
+    # TMC location cache are projected (see tmc_location_cache.py).
+    tmc_locations = tmc_location_cache.TmcLocationCache(route_geometry_cache_dir)
+    tmc_from_meas, tmc_to_meas, tmc_keep, num_tmcs_projected = \
+        tmc_location_cache.locate_events_cached(tmc_locations, route_geom,
+                                                tmc_location_cache.route_geometry_hash(route_geom_cache, route_geom.route_id),
+                                                [tmc_feat[tmc_feat_tmc_id_ix] for tmc_feat in tmc_feats],
+                                                tmc_from_xs, tmc_from_ys, tmc_to_xs, tmc_to_ys)
+    tmc_locations.close()
+    log.info(str(num_tmcs_projected) + " of " + str(len(tmc_feats)) + " TMC(s) projected; the locations of the others were cached.")
+    metrics.count('tmcs_selected', len(tmc_feats))
+    metrics.count('zero_length_tmc_events_discarded', tmc_keep.count(False))
+    metrics.count('tmcs_projected', num_tmcs_projected)
+    return (tmc_feats, tmc_from_meas, tmc_to_meas, tmc_keep)
+# def locate_tmcs()
+tmc_location_stage = stage_graph.add_stage('tmc_location', locate_tmcs, [tmc_store_stage], rows_out_fn=lambda located: located[3].count(True))
+
+# write_tmc_event_table: Write the located TMCs to the (sorted) TMC event table
+#
+# Parameter: located - value of locate_tmcs
+# Return value: list of the TMC events written, as dicts (used by the streaming pipeline; see below)
+#
+def write_tmc_event_table(located):
+    tmc_feats, tmc_from_meas, tmc_to_meas, tmc_keep = located
+    # The located TMCs are sorted (natively) in ascending order on from_meas before they are written, 
+    # so the TMC event table is written directly, rather than by sorting a "raw" TMC event table.
+    #
+    # *** Beginning of original code:
+    #
+    # # Make a copy of the "template" TMC event table into which the raw (unsorted) TMC events will be written
+    # arcpy.CreateTable_management(tmc_event_table_gdb, tmc_event_table_name_raw, tmc_template_event_table)
+    #
+    # *** End of original code
+    #
+    arcpy.CreateTable_management(tmc_event_table_gdb, tmc_event_table_name, tmc_template_event_table)
+
+    # "Insert" cursor for output event table
+    out_csr = arcpy.da.InsertCursor(tmc_event_table, et_fieldnames)
+
+    # Loop over the located TMCs, in ascending order on from_meas
+    #
+    log_tmc_events = log.enabled(pipeline_logging.DEBUG)
+    tmc_events = []
+    located_tmcs = external_sort.sort_records(zip(tmc_feats, tmc_from_meas, tmc_to_meas, tmc_keep), lambda located_tmc: located_tmc[1], 
+                                              sort_memory_budget)
+    for tmc_feat, from_meas, to_meas, keep in located_tmcs:
+        tmc_id = tmc_feat[tmc_feat_tmc_id_ix]
+           
+        # Do not write out zero-length events
+        if keep:
+            roh = [route_feat[route_feat_route_id_ix], from_meas, to_meas, 
+                   tmc_feat[tmc_feat_tmc_id_ix], tmc_feat[tmc_feat_tmctype_ix], 
+                   tmc_feat[tmc_feat_roadnum_ix], tmc_feat[tmc_feat_firstnm_ix], tmc_feat[tmc_feat_direction_ix]]   
+            out_csr.insertRow(roh)
+            tmc_events.append(dict(zip(et_fieldnames, roh)))
+            if log_tmc_events:
+                log.debug('Inserted event: ' + tmc_id + ', ' + str(from_meas) + ', ' + str(to_meas))
+            # end_if
+        else:
+            # Zero-length event
+            if log_tmc_events:
+                log.debug('Discarded zero-length event: ' + tmc_id + ', ' + str(from_meas) + ', ' + str(to_meas))
+            # end_if
+        # if
+    # for tmc_feat
+
+    # Close the insert cursor - not exactly the best choice of API name!
+    del out_csr 
+    log.info('Inserted ' + str(tmc_keep.count(True)) + ' TMC events; discarded ' + str(tmc_keep.count(False)) + ' zero-length event(s).')
+
+
+    # *** Beginning of original code:
+    #
+    # # Sort the raw TMC event table in ascending order on the 'from_meas' field
+    # arcpy.Sort_management(tmc_event_table_raw, tmc_event_table, [["from_meas", "ASCENDING"]])
+    #
+    # *** End of original code
+    #
+    return tmc_events
+# def write_tmc_event_table()
+tmc_event_table_stage = stage_graph.add_stage('tmc_event_table', write_tmc_event_table, [tmc_location_stage], main_thread=True,
+                                              rows_out_fn=len)
 #
 #
 # *** End of replacement code for 'Locate Features Along Routes'
 
-arcpy.AddMessage("Generating town events.")
-
+# Look up the town events of the selected route in the statewide town event index (see town_boundaries.py),
+# which is built (by clipping every route against only those town polygons whose bounding boxes it touches)
+# once, and rebuilt only when the route geometry or towns_pb_r changes, rather than locating all of towns_pb_r
+# along the route. Slivers (e.g., town_id = 0) are merged into the adjacent towns when the index is built.
+#
+# *** Beginning of original code:
+#
 # Locate Features Along Routes: locate towns_pb (political boundaries) along selected MassDOT route
 # output is: town_event_table
-town_event_table_properties = "route_id LINE from_meas to_meas"
-arcpy.LocateFeaturesAlongRoutes_lr(towns_pb_r, Selected_LRSN_Route, "route_id", "0 Meters", town_event_table, town_event_table_properties, 
-                                   "FIRST", "DISTANCE", "NO_ZERO", "FIELDS", "M_DIRECTON")
-                                   
+# town_event_table_properties = "route_id LINE from_meas to_meas"
+# arcpy.LocateFeaturesAlongRoutes_lr(towns_pb_r, Selected_LRSN_Route, "route_id", "0 Meters", town_event_table, town_event_table_properties, 
+#                                    "FIRST", "DISTANCE", "NO_ZERO", "FIELDS", "M_DIRECTON")
 # Delete un-needed fields from town_event_table
-arcpy.DeleteField_management(town_event_table, "shape_leng;boundary_link_id")                                  
-
-arcpy.AddMessage("Generating overlay #1.")
-                                 
-# HERE: tmc_event_table and town_event_table have been generated.
-#       Generate overlay #1.
-# Overlay Route Events: inputs: overlay tmc_events, town_events
-#                       output: overlay_events_1
-overlay_event_table_1_properties = "route_id LINE from_meas to_meas"
-arcpy.OverlayRouteEvents_lr(tmc_event_table, "route_id LINE from_meas to_meas", 
-                            town_event_table, "route_id LINE from_meas to_meas", "UNION", 
-                            overlay_events_1, overlay_event_table_1_properties, "NO_ZERO", "FIELDS", "INDEX")
+# arcpy.DeleteField_management(town_event_table, "shape_leng;boundary_link_id")                                  
+#
+# *** End of original code
+#
+town_event_index_stage = stage_graph.add_stage('town_event_index', 
+                                               lambda: town_boundaries.open_town_event_index(towns_pb_r, route_geom_cache, route_geometry_cache_dir, verify_caches),
+                                               main_thread=True)
+
+# generate_town_events: Return the town events of the selected route, given the town event index
+#
+def generate_town_events(town_event_index):
+    log.info("Generating town events.")
+    town_events = town_event_index.query(route_feat[route_feat_route_id_ix])
+    log.info(str(len(town_events)) + " town events.")
+    return town_events
+# def generate_town_events()
+town_events_stage = stage_graph.add_stage('town_events', generate_town_events, [town_event_index_stage], rows_out_fn=len)
+if pipeline_mode == 'tables' and write_event_tables:
+    stage_graph.add_stage('town_event_table', 
+                          lambda town_events: lrse_event_index.write_event_table(town_event_table_gdb, town_event_table_name, town_events, 
+                                                                                 [('town', 'TEXT'), ('town_id', 'LONG')]),
+                          [town_events_stage], main_thread=True)
+# end_if
 
+# Generate speed limit events for the route pair from the in-memory index of LRSE_Speed_Limit (see lrse_event_index.py),
+# which is built once (and cached locally) rather than spatially selecting from the statewide LRSE layer for each route.
+#
+# *** Beginning of original code:
+#
 # Make Feature Layer "Speed_Limit_Layer": 
-arcpy.MakeFeatureLayer_management(LRSE_Speed_Limit, Speed_Limit_Layer, "to_date IS NULL", "", "objectid objectid HIDDEN NONE;from_date from_date HIDDEN NONE;to_date to_date HIDDEN NONE;event_id event_id HIDDEN NONE;route_id route_id VISIBLE NONE;from_measure from_measure VISIBLE NONE;to_measure to_measure VISIBLE NONE;speed_lim speed_lim VISIBLE NONE;op_dir_sl op_dir_sl VISIBLE NONE;created_by created_by HIDDEN NONE;date_created date_created HIDDEN NONE;edited_by edited_by HIDDEN NONE;date_edited date_edited HIDDEN NONE;locerror locerror HIDDEN NONE;globalid globalid HIDDEN NONE;regulation regulation HIDDEN NONE;amendment amendment HIDDEN NONE;time_per time_per HIDDEN NONE;shape shape HIDDEN NONE;st_length(shape) st_length(shape) HIDDEN NONE")
-
+# arcpy.MakeFeatureLayer_management(LRSE_Speed_Limit, Speed_Limit_Layer, "to_date IS NULL", "", "objectid objectid HIDDEN NONE;from_date from_date HIDDEN NONE;to_date to_date HIDDEN NONE;event_id event_id HIDDEN NONE;route_id route_id VISIBLE NONE;from_measure from_measure VISIBLE NONE;to_measure to_measure VISIBLE NONE;speed_lim speed_lim VISIBLE NONE;op_dir_sl op_dir_sl VISIBLE NONE;created_by created_by HIDDEN NONE;date_created date_created HIDDEN NONE;edited_by edited_by HIDDEN NONE;date_edited date_edited HIDDEN NONE;locerror locerror HIDDEN NONE;globalid globalid HIDDEN NONE;regulation regulation HIDDEN NONE;amendment amendment HIDDEN NONE;time_per time_per HIDDEN NONE;shape shape HIDDEN NONE;st_length(shape) st_length(shape) HIDDEN NONE")
 # Select Layer By Location: from Speed_Limit_Layer, select records that lie WITHIN the Selected_LRSN_Route
-arcpy.SelectLayerByLocation_management(Speed_Limit_Layer, "WITHIN", Selected_LRSN_Route, "", "NEW_SELECTION", "NOT_INVERT")
-#
-# Attribute-based selection to replace the above spatial selection, if needed
-# arcpy.SelectLayerByAttribute_management(Speed_Limit_Layer, "NEW_SELECTION", MassDOT_route_query_string)
-
-arcpy.AddMessage("Generating speed limit events.")
-
+# arcpy.SelectLayerByLocation_management(Speed_Limit_Layer, "WITHIN", Selected_LRSN_Route, "", "NEW_SELECTION", "NOT_INVERT")
 # Locate Features Along Routes: locate records in Speed_Limit_Layer along the Selected_LRSN_Route
-# output is: speed_limit_event_table
-speed_limit_event_table_properties = "route_id LINE from_meas to_meas"
-arcpy.LocateFeaturesAlongRoutes_lr(Speed_Limit_Layer, Selected_LRSN_Route, "route_id", "0.0002 Meters", speed_limit_event_table, speed_limit_event_table_properties, 
-                                   "FIRST", "DISTANCE", "ZERO", "FIELDS", "M_DIRECTON")
-
+# speed_limit_event_table_properties = "route_id LINE from_meas to_meas"
+# arcpy.LocateFeaturesAlongRoutes_lr(Speed_Limit_Layer, Selected_LRSN_Route, "route_id", "0.0002 Meters", speed_limit_event_table, speed_limit_event_table_properties, 
+#                                    "FIRST", "DISTANCE", "ZERO", "FIELDS", "M_DIRECTON")
 # Delete un-needed fields from speed_limit_event_table
-arcpy.DeleteField_management(speed_limit_event_table, "from_date;to_date;event_id;route_id2;from_measure;to_measure;op_dir_sl;created_by;date_created;edited_by;date_edited;locerror;globalid;regulation;amendment;time_per")
-  
-arcpy.AddMessage("Generating overlay #2.")
-  
-# HERE: overlay_events_1 and speed_limit_events have been generated.
-#       Generate overlay #2.
-# Overlay Route Events: inputs: overlay overlay_events_1, speed_limit_events
-#                       output: overlay_events_2
-overlay_event_table_2_properties = "route_id LINE from_meas to_meas"
-arcpy.OverlayRouteEvents_lr(overlay_events_1, "route_id LINE from_meas to_meas", 
-                            speed_limit_event_table, "route_id LINE from_meas to_meas", "UNION", 
-                            overlay_events_2, overlay_event_table_2_properties, "NO_ZERO", "FIELDS", "INDEX")
-
+# arcpy.DeleteField_management(speed_limit_event_table, "from_date;to_date;event_id;route_id2;from_measure;to_measure;op_dir_sl;created_by;date_created;edited_by;date_edited;locerror;globalid;regulation;amendment;time_per")
+#
+# *** End of original code
+#
+# query_route_pair_events: Return the events of both routes of the route pair in an LRSE event index
+#
+# Parameters: index - lrse_event_index.LrseEventIndex
+#             description - description of the events, for progress messages, e.g., 'speed limit'
+# Return value: list of event dicts
+#
+def query_route_pair_events(index, description):
+    log.info("Generating " + description + " events.")
+    events = []
+    for route_id in route_pair_route_ids:
+        events += index.query(route_id, 0.0, route_pair_last_m_values[route_id])
+    # for
+    log.info(str(len(events)) + " " + description + " events.")
+    return events
+# def query_route_pair_events()
+
+speed_limit_index_stage = stage_graph.add_stage('speed_limit_index', 
+                                                lambda: lrse_event_index.open_index(LRSE_Speed_Limit, ['speed_lim', 'op_dir_sl'], route_geometry_cache_dir, verify_caches),
+                                                main_thread=True)
+speed_limit_events_stage = stage_graph.add_stage('speed_limit_events', lambda index: query_route_pair_events(index, 'speed limit'),
+                                                 [speed_limit_index_stage], rows_out_fn=len)
+if pipeline_mode == 'tables' and write_event_tables:
+    stage_graph.add_stage('speed_limit_event_table', 
+                          lambda speed_limit_events: lrse_event_index.write_event_table(speed_limit_event_table_gdb, speed_limit_event_table_name, 
+                                                                                        speed_limit_events, [('speed_lim', 'LONG')]),
+                          [speed_limit_events_stage], main_thread=True)
+# end_if
 
+# Generate number-of-lanes events for the route pair from the in-memory index of LRSE_Number_Travel_Lanes
+# (see lrse_event_index.py), as for the speed limit events.
+#
+# *** Beginning of original code:
+#
 # Make Feature Layer: "Num_Lanes_Layer" (number of travel lanes layer)
-arcpy.MakeFeatureLayer_management(LRSE_Number_Travel_Lanes, Num_Lanes_Layer, "to_date IS NULL", "", "objectid objectid HIDDEN NONE;from_date from_date HIDDEN NONE;to_date to_date HIDDEN NONE;event_id event_id HIDDEN NONE;route_id route_id VISIBLE NONE;from_measure from_measure VISIBLE NONE;to_measure to_measure VISIBLE NONE;num_lanes num_lanes VISIBLE NONE;opp_lanes opp_lanes HIDDEN NONE;created_by created_by HIDDEN NONE;date_created date_created HIDDEN NONE;edited_by edited_by HIDDEN NONE;date_edited date_edited HIDDEN NONE;locerror locerror HIDDEN NONE;globalid globalid HIDDEN NONE;shape shape VISIBLE NONE;st_length(shape) st_length(shape) VISIBLE NONE")
-
+# arcpy.MakeFeatureLayer_management(LRSE_Number_Travel_Lanes, Num_Lanes_Layer, "to_date IS NULL", "", "objectid objectid HIDDEN NONE;from_date from_date HIDDEN NONE;to_date to_date HIDDEN NONE;event_id event_id HIDDEN NONE;route_id route_id VISIBLE NONE;from_measure from_measure VISIBLE NONE;to_measure to_measure VISIBLE NONE;num_lanes num_lanes VISIBLE NONE;opp_lanes opp_lanes HIDDEN NONE;created_by created_by HIDDEN NONE;date_created date_created HIDDEN NONE;edited_by edited_by HIDDEN NONE;date_edited date_edited HIDDEN NONE;locerror locerror HIDDEN NONE;globalid globalid HIDDEN NONE;shape shape VISIBLE NONE;st_length(shape) st_length(shape) VISIBLE NONE")
 # Select Layer By Location: from Num_Lanes_Layer select records that lie WITHIN Selected_LRSN_Route
-arcpy.SelectLayerByLocation_management(Num_Lanes_Layer, "WITHIN", Selected_LRSN_Route, "", "NEW_SELECTION", "NOT_INVERT")
-#
-# Attribute-based selection to replace the above spatial selection, if needed
-# arcpy.SelectLayerByAttribute_management(Num_Lanes_Layer, "NEW_SELECTION", MassDOT_route_query_string)
-
-arcpy.AddMessage("Generating number-of-lanes events.")
-
+# arcpy.SelectLayerByLocation_management(Num_Lanes_Layer, "WITHIN", Selected_LRSN_Route, "", "NEW_SELECTION", "NOT_INVERT")
 # Locate Features Along Routes: locate records in Num_Lanes_Layer along the selected LRSN_Route
-# output is: num_lanes_event_table
-num_lanes_event_table_properties = "route_id LINE from_meas to_meas"
-arcpy.LocateFeaturesAlongRoutes_lr(Num_Lanes_Layer, Selected_LRSN_Route, "route_id", "0.0002 Meters", num_lanes_event_table, num_lanes_event_table_properties, 
-                                   "FIRST", "DISTANCE", "ZERO", "FIELDS", "M_DIRECTON")
-
+# num_lanes_event_table_properties = "route_id LINE from_meas to_meas"
+# arcpy.LocateFeaturesAlongRoutes_lr(Num_Lanes_Layer, Selected_LRSN_Route, "route_id", "0.0002 Meters", num_lanes_event_table, num_lanes_event_table_properties, 
+#                                    "FIRST", "DISTANCE", "ZERO", "FIELDS", "M_DIRECTON")
 # Delete un-needed fields frm num_lanes_event_table
-arcpy.DeleteField_management(num_lanes_event_table, "from_date;to_date;event_id;route_id2;from_measure;to_measure;opp_lanes;created_by;date_created;edited_by;date_edited;locerror;globalid")
-
-arcpy.AddMessage("Generating overlay #3.")
-
-# HERE: overlay_events_2 and num_lanes event_table have been generated
-#       Generate overlay #3
-# Overlay Route Events: inputs: overlay overlay_events_2, num_lanes_event_table
-#                       output: overlay_events_3
-overlay_event_table_3_properties = "route_id LINE from_meas to_meas"
-arcpy.OverlayRouteEvents_lr(overlay_events_2, "route_id LINE from_meas to_meas", 
-                            num_lanes_event_table, "route_id LINE from_meas to_meas", "UNION", 
-                            overlay_events_3, overlay_event_table_3_properties, "ZERO", "FIELDS", "INDEX")
-
-# HERE: overlay_events_3 has been generated
-#       Perform miscellaneous cleanup operations, and generate intermediate CSV file
-
-# Make Table View of overlay_events_3
-overlay_events_3_View = "overlay_event_table_3_View"
-arcpy.MakeTableView_management(overlay_events_3, overlay_events_3_View, "", "", "objectid objectid VISIBLE NONE;route_id route_id VISIBLE NONE;from_meas from_meas VISIBLE NONE;to_meas to_meas VISIBLE NONE;tmc tmc VISIBLE NONE;tmctype tmctype VISIBLE NONE;roadnum roadnum VISIBLE NONE;firstnm firstnm VISIBLE NONE;direction direction VISIBLE NONE;town town VISIBLE NONE;town_id town_id VISIBLE NONE;st_area_shape_ st_area_shape_ VISIBLE NONE;st_perimeter_shape_ st_perimeter_shape_ VISIBLE NONE;route_id_1 route_id_1 VISIBLE NONE;speed_lim speed_lim VISIBLE NONE;route_id_12 route_id_12 VISIBLE NONE;num_lanes num_lanes VISIBLE NONE;st_length_shape_ st_length_shape_ VISIBLE NONE")
-
-# The MassDOT routes and events layers use TOWNS_POLYM to define town boundaries. We're using towns_pb instead (in order to inlcude water, etc. in town boundaries.)
-# There is a slight difference between these, which results in an occasional overlay event with a TOWN_ID of zero. Remove these.
-#
-# Select records in overlay_events_3 with town_id = 0, delete them, and then clear selection
-arcpy.SelectLayerByAttribute_management(overlay_events_3_View, "NEW_SELECTION", "\"town_id\" = 0")
-arcpy.DeleteRows_management(overlay_events_3_View)
-arcpy.SelectLayerByAttribute_management(overlay_events_3_View, "CLEAR_SELECTION", "")
-
-# If a list of TMCs was specified as an input parameter, it's all but certain that some portions of the
-# indicated route will have no TMC located along it. In this case, delete all records where tmc = ''.
-if TMC_list_file:
-    # Select records in overlay_events_3 with tmc = '', delete them, and then clear selection
-    arcpy.AddMessage("Pruning records with tmc = ''.")
-    arcpy.SelectLayerByAttribute_management(overlay_events_3_View, "NEW_SELECTION", "tmc = ''")
-    arcpy.DeleteRows_management(overlay_events_3_View)
-    arcpy.SelectLayerByAttribute_management(overlay_events_3_View, "CLEAR_SELECTION", "")
-# end_if
-
-# Roads and Highways allows (among other things) events with measure values < 0. In particular, we are concerned with from_measure values < 0.
-# Clean these up by setting the relevant from_measures to 0.
+# arcpy.DeleteField_management(num_lanes_event_table, "from_date;to_date;event_id;route_id2;from_measure;to_measure;opp_lanes;created_by;date_created;edited_by;date_edited;locerror;globalid")
 #
-# Select records in overlay_events_3 with from_meas < 0, set the from_meas of these records to 0, and clear selection
-arcpy.SelectLayerByAttribute_management(overlay_events_3_View, "NEW_SELECTION", "from_meas < 0")
-arcpy.CalculateField_management(overlay_events_3_View, "from_meas", "0.0", "PYTHON_9.3", "")
-arcpy.SelectLayerByAttribute_management(overlay_events_3_View, "CLEAR_SELECTION", "")
-
-# Remove zero-length records (i.e., records for which from_meas == to_meas), if any
-arcpy.AddMessage("Pruning zero-length records.")
-arcpy.SelectLayerByAttribute_management(overlay_events_3_View, "NEW_SELECTION", "from_meas = to_meas")
-arcpy.DeleteRows_management(overlay_events_3_View)
-arcpy.SelectLayerByAttribute_management(overlay_events_3_View, "CLEAR_SELECTION", "")
-
-
-# Sort the table in ascending order on from_meas, and add a "calc_len" (calculated length) field to each record, 
-# and calculate its value appropriately.
-# output is in output_event_table
-# These operations could be performed in the subsequent processing of the generated CSV file, but we do them here anyway.
-arcpy.Sort_management(overlay_events_3_View, output_event_table, "from_meas ASCENDING;tmc ASCENDING", "UR")
+# *** End of original code
+#
+num_lanes_index_stage = stage_graph.add_stage('num_lanes_index', 
+                                              lambda: lrse_event_index.open_index(LRSE_Number_Travel_Lanes, ['num_lanes', 'opp_lanes'], route_geometry_cache_dir, verify_caches),
+                                              main_thread=True)
+num_lanes_events_stage = stage_graph.add_stage('num_lanes_events', lambda index: query_route_pair_events(index, 'number-of-lanes'),
+                                               [num_lanes_index_stage], rows_out_fn=len)
+if pipeline_mode == 'tables' and write_event_tables:
+    stage_graph.add_stage('num_lanes_event_table', 
+                          lambda num_lanes_events: lrse_event_index.write_event_table(num_lanes_event_table_gdb, num_lanes_event_table_name, 
+                                                                                      num_lanes_events, [('num_lanes', 'LONG')]),
+                          [num_lanes_events_stage], main_thread=True)
+# end_if
 
-arcpy.AddMessage("Generating output event table.")
+if pipeline_dry_run:
+    previous_durations = pipeline_dag.durations_from_metrics(metrics_dir + "\\" + metrics_file_name)
+    log.info("Pipeline stages (dry run; * marks the critical path):\n" + '\n'.join(stage_graph.dry_run(previous_durations)))
+    pipeline_logging.flush()
+    exit()
+# end_if
 
-# Add a "calc_len" field to output_event_table, and calc it to (to_meas - from_meas)
-arcpy.AddField_management(output_event_table, "calc_len", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
-arcpy.CalculateField_management(output_event_table, "calc_len", "!to_meas! - !from_meas!", "PYTHON_9.3", "")
+stage_outputs = stage_graph.run(max_stage_workers)
+tmc_events = stage_outputs['tmc_event_table']
+town_events = stage_outputs['town_events']
+speed_limit_events = stage_outputs['speed_limit_events']
+num_lanes_events = stage_outputs['num_lanes_events']
+log.info("Critical path: " + ' -> '.join(name + ' (' + ('%.2f' % stage_graph.durations[name]) + ' s)' 
+                                         for name in stage_graph.schedule(stage_graph.durations)[1]))
+
+if pipeline_mode == 'streaming':
+    # Overlay the event tables, clean up the overlay, and aggregate it by TMC in a single stream (see streaming_pipeline.py),
+    # writing only the final CSV file. The TMC events were collected as they were written to the TMC event table.
+    log.info("Generating final CSV file from the streamed overlay of the TMC, town, speed limit, and number-of-lanes events.")
+    metrics.start('streaming_pipeline', rows_in=len(tmc_events) + len(town_events) + len(speed_limit_events) + len(num_lanes_events))
+    num_prior_problem_tmcs = len(process_csv_file.problem_tmcs)
+    overlay_cleanup = event_cleanup.EventCleanup(event_cleanup.overlay_cleanup_rules(TMC_list_file != ''))
+    overlay_coalescer = event_coalescing.EventCoalescer(tolerance=coalesce_measure_tolerance) if coalesce_events else None
+    num_tmcs = streaming_pipeline.main_routine(tmc_events, town_events, speed_limit_events, num_lanes_events,
+                                               output_csv_dir_2, output_csv_file_name_2, TMC_list_file != '', overlay_cleanup,
+                                               overlay_coalescer)
+    log.info(overlay_cleanup.report())
+    for rule_name in overlay_cleanup.counts:
+        metrics.count('cleanup_' + rule_name, overlay_cleanup.counts[rule_name])
+    # for
+    if overlay_coalescer is not None:
+        log.info(overlay_coalescer.report())
+        metrics.set_value('coalesce_compression_ratio', overlay_coalescer.compression_ratio())
+    # end_if
+    metrics.end('streaming_pipeline', rows_out=num_tmcs)
+    metrics.set_value('problem_tmcs', len(process_csv_file.problem_tmcs) - num_prior_problem_tmcs)
+else:
+    # The TMC, town, speed limit, and number-of-lanes events are overlaid natively, in a single sweep over their
+    # breakpoints (see route_event_overlay.py), rather than by three chained arcpy.OverlayRouteEvents_lr UNIONs
+    # writing overlay_events_1, overlay_events_2, and overlay_events_3; the output events are cleaned up, sorted,
+    # and written to output_event_table as they are produced (see below), so no overlay event table is written.
+    #
+    # *** Beginning of original code:
+    #
+    # log.info("Generating overlay #1.")
+    #
+    # # HERE: tmc_event_table, town_event_table, speed_limit_events, and num_lanes_events have been generated.
+    # #       Generate overlay #1.
+    # # Overlay Route Events: inputs: overlay tmc_events, town_events
+    # #                       output: overlay_events_1
+    # overlay_event_table_1_properties = "route_id LINE from_meas to_meas"
+    # metrics.start('overlay_1', rows_in=tmc_event_count + town_event_count)
+    # arcpy.OverlayRouteEvents_lr(tmc_event_table, "route_id LINE from_meas to_meas", 
+    #                             town_event_table, "route_id LINE from_meas to_meas", "UNION", 
+    #                             overlay_events_1, overlay_event_table_1_properties, "NO_ZERO", "FIELDS", "INDEX")
+    # overlay_1_count = pipeline_metrics.table_row_count(overlay_events_1)
+    # metrics.end('overlay_1', rows_out=overlay_1_count)
+    #
+    # log.info("Generating overlay #2.")
+    #
+    # # HERE: overlay_events_1 and speed_limit_events have been generated.
+    # #       Generate overlay #2.
+    # # Overlay Route Events: inputs: overlay overlay_events_1, speed_limit_events
+    # #                       output: overlay_events_2
+    # overlay_event_table_2_properties = "route_id LINE from_meas to_meas"
+    # metrics.start('overlay_2', rows_in=overlay_1_count + len(speed_limit_events))
+    # arcpy.OverlayRouteEvents_lr(overlay_events_1, "route_id LINE from_meas to_meas", 
+    #                             speed_limit_event_table, "route_id LINE from_meas to_meas", "UNION", 
+    #                             overlay_events_2, overlay_event_table_2_properties, "NO_ZERO", "FIELDS", "INDEX")
+    # overlay_2_count = pipeline_metrics.table_row_count(overlay_events_2)
+    # metrics.end('overlay_2', rows_out=overlay_2_count)
+    #
+    #
+    # log.info("Generating overlay #3.")
+    #
+    # # HERE: overlay_events_2 and num_lanes event_table have been generated
+    # #       Generate overlay #3
+    # # Overlay Route Events: inputs: overlay overlay_events_2, num_lanes_event_table
+    # #                       output: overlay_events_3
+    # overlay_event_table_3_properties = "route_id LINE from_meas to_meas"
+    # metrics.start('overlay_3', rows_in=overlay_2_count + len(num_lanes_events))
+    # arcpy.OverlayRouteEvents_lr(overlay_events_2, "route_id LINE from_meas to_meas", 
+    #                             num_lanes_event_table, "route_id LINE from_meas to_meas", "UNION", 
+    #                             overlay_events_3, overlay_event_table_3_properties, "ZERO", "FIELDS", "INDEX")
+    # overlay_3_count = pipeline_metrics.table_row_count(overlay_events_3)
+    # metrics.end('overlay_3', rows_out=overlay_3_count)
+    #
+    # *** End of original code
+    #
+    log.info("Generating overlay of the TMC, town, speed limit, and number-of-lanes events.")
+    overlay_events = route_event_overlay.iter_overlay_route_events_multi([tmc_events, town_events, speed_limit_events, num_lanes_events],
+                                                                         [streaming_pipeline.event_properties] * 4, "UNION",
+                                                                         streaming_pipeline.event_properties,
+                                                                         streaming_pipeline.zero_length_events_list,
+                                                                         streaming_pipeline.event_table_fields)
+
+    # HERE: the overlay events (those of overlay_events_3) are generated as they are consumed
+    #       Perform miscellaneous cleanup operations, and generate intermediate CSV file
+
+    # The cleanup operations (see event_cleanup.py), the sort, and the calculation of calc_len are performed in a single
+    # pass: each cleanup rule is applied to each overlay event in turn, as it is produced, and the remaining
+    # events are sorted (see below) and written, with their calc_len, to output_event_table. The number of records
+    # removed or changed by each rule is recorded in the metrics.
+    #
+    # *** Beginning of original code:
+    #
+    # metrics.start('cleanup', rows_in=overlay_3_count)
+    # # Make Table View of overlay_events_3
+    # overlay_events_3_View = "overlay_event_table_3_View"
+    # arcpy.MakeTableView_management(overlay_events_3, overlay_events_3_View, "", "", "objectid objectid VISIBLE NONE;route_id route_id VISIBLE NONE;from_meas from_meas VISIBLE NONE;to_meas to_meas VISIBLE NONE;tmc tmc VISIBLE NONE;tmctype tmctype VISIBLE NONE;roadnum roadnum VISIBLE NONE;firstnm firstnm VISIBLE NONE;direction direction VISIBLE NONE;town town VISIBLE NONE;town_id town_id VISIBLE NONE;st_area_shape_ st_area_shape_ VISIBLE NONE;st_perimeter_shape_ st_perimeter_shape_ VISIBLE NONE;route_id_1 route_id_1 VISIBLE NONE;speed_lim speed_lim VISIBLE NONE;route_id_12 route_id_12 VISIBLE NONE;num_lanes num_lanes VISIBLE NONE;st_length_shape_ st_length_shape_ VISIBLE NONE")
+    #
+    # # The MassDOT routes and events layers use TOWNS_POLYM to define town boundaries. We're using towns_pb instead (in order to inlcude water, etc. in town boundaries.)
+    # # There is a slight difference between these, which results in an occasional overlay event with a TOWN_ID of zero. Remove these.
+    # # (The town events themselves no longer contain such slivers - see town_boundaries.py - but overlay events lying
+    # # beyond the extent of the town events have no town.)
+    # #
+    # # Select records in overlay_events_3 with town_id = 0, delete them, and then clear selection
+    # arcpy.SelectLayerByAttribute_management(overlay_events_3_View, "NEW_SELECTION", "\"town_id\" = 0")
+    # arcpy.DeleteRows_management(overlay_events_3_View)
+    # arcpy.SelectLayerByAttribute_management(overlay_events_3_View, "CLEAR_SELECTION", "")
+    #
+    # # If a list of TMCs was specified as an input parameter, it's all but certain that some portions of the
+    # # indicated route will have no TMC located along it. In this case, delete all records where tmc = ''.
+    # if TMC_list_file:
+    #     # Select records in overlay_events_3 with tmc = '', delete them, and then clear selection
+    #     log.info("Pruning records with tmc = ''.")
+    #     arcpy.SelectLayerByAttribute_management(overlay_events_3_View, "NEW_SELECTION", "tmc = ''")
+    #     arcpy.DeleteRows_management(overlay_events_3_View)
+    #     arcpy.SelectLayerByAttribute_management(overlay_events_3_View, "CLEAR_SELECTION", "")
+    # # end_if
+    #
+    # # Roads and Highways allows (among other things) events with measure values < 0. In particular, we are concerned with from_measure values < 0.
+    # # Clean these up by setting the relevant from_measures to 0.
+    # #
+    # # Select records in overlay_events_3 with from_meas < 0, set the from_meas of these records to 0, and clear selection
+    # arcpy.SelectLayerByAttribute_management(overlay_events_3_View, "NEW_SELECTION", "from_meas < 0")
+    # arcpy.CalculateField_management(overlay_events_3_View, "from_meas", "0.0", "PYTHON_9.3", "")
+    # arcpy.SelectLayerByAttribute_management(overlay_events_3_View, "CLEAR_SELECTION", "")
+    #
+    # # Remove zero-length records (i.e., records for which from_meas == to_meas), if any
+    # log.info("Pruning zero-length records.")
+    # arcpy.SelectLayerByAttribute_management(overlay_events_3_View, "NEW_SELECTION", "from_meas = to_meas")
+    # arcpy.DeleteRows_management(overlay_events_3_View)
+    # arcpy.SelectLayerByAttribute_management(overlay_events_3_View, "CLEAR_SELECTION", "")
+    # metrics.end('cleanup', rows_out=pipeline_metrics.table_row_count(overlay_events_3_View))
+    #
+    # *** End of original code
+    #
+    # If a list of TMCs was specified as an input parameter, it's all but certain that some portions of the
+    # indicated route will have no TMC located along it. In this case, records where tmc = '' are removed.
+    overlay_cleanup = event_cleanup.EventCleanup(event_cleanup.overlay_cleanup_rules(TMC_list_file != ''))
+
+
+    # Sort the table in ascending order on from_meas, and add a "calc_len" (calculated length) field to each record, 
+    # and calculate its value appropriately.
+    # output is in output_event_table
+    # These operations could be performed in the subsequent processing of the generated CSV file, but we do them here anyway.
+    #
+    # The records are sorted natively (see external_sort.py), within sort_memory_budget, as they are produced by
+    # the overlay and cleaned up, and are written to output_event_table in a single pass.
+    #
+    # *** Beginning of original code:
+    #
+    # arcpy.Sort_management(overlay_events_3_View, output_event_table, "from_meas ASCENDING;tmc ASCENDING", "UR")
+    #
+    # log.info("Generating output event table.")
+    #
+    # # Add a "calc_len" field to output_event_table, and calc it to (to_meas - from_meas)
+    # arcpy.AddField_management(output_event_table, "calc_len", "DOUBLE", "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
+    # arcpy.CalculateField_management(output_event_table, "calc_len", "!to_meas! - !from_meas!", "PYTHON_9.3", "")
+    #
+    # *** End of original code
+    #
+    metrics.start('overlay_cleanup_sort', rows_in=len(tmc_events) + len(town_events) + len(speed_limit_events) + len(num_lanes_events))
+    log.info("Generating output event table.")
+    # output_event_table has the fields of overlay_events_3 (those of the TMC event table, followed by those that the
+    # overlay carries through from the other event tables), and calc_len
+    arcpy.CreateTable_management(output_events_gdb, output_event_table_name, tmc_template_event_table)
+    for field_name, field_type in output_event_table_added_fields:
+        arcpy.AddField_management(output_event_table, field_name, field_type, "", "", "", "", "NULLABLE", "NON_REQUIRED", "")
+    # for
+    output_fieldnames = et_fieldnames + [field_name for field_name, field_type in output_event_table_added_fields]
+    out_csr = arcpy.da.InsertCursor(output_event_table, output_fieldnames)
+    output_events = external_sort.sort_records(overlay_cleanup.apply(overlay_events), 
+                                               lambda event: (event['from_meas'], event['tmc'] or ''), sort_memory_budget)
+    # Runs of contiguous events with identical attributes are merged as they are written (see event_coalescing.py)
+    if coalesce_events:
+        overlay_coalescer = event_coalescing.EventCoalescer(tolerance=coalesce_measure_tolerance)
+        output_events = overlay_coalescer.apply(output_events)
+    # end_if
+    output_event_count = 0
+    for event in output_events:
+        out_csr.insertRow([event[fieldname] for fieldname in output_fieldnames])
+        output_event_count += 1
+    # for
+    del out_csr
+    log.info(overlay_cleanup.report())
+    for rule_name in overlay_cleanup.counts:
+        metrics.count('cleanup_' + rule_name, overlay_cleanup.counts[rule_name])
+    # for
+    if coalesce_events:
+        log.info(overlay_coalescer.report())
+        metrics.set_value('coalesce_compression_ratio', overlay_coalescer.compression_ratio())
+    # end_if
+    metrics.count('overlay_events', overlay_cleanup.rows_in)
+    metrics.end('overlay_cleanup_sort', rows_out=output_event_count)
 
+    metrics.start('export', rows_in=output_event_count)
+    if intermediate_file_format == 'npy':
+        log.info("Exporting output event table to typed, columnar intermediate file.")
+        intermediate_format.export_table(output_event_table, output_csv_dir_1, output_npy_file_name_1)
+    # end_if
 
-arcpy.AddMessage("Exporting output event table to CSV file.")
+    if intermediate_file_format == 'csv' or export_intermediate_csv:
+        log.info("Exporting output event table to CSV file.")
+        # Export final_event_table to CSV file
+        #
+        # Code generated by model:
+        arcpy.TableToTable_conversion(output_event_table, output_csv_dir_1, output_csv_file_name_1)
+    # end_if
+    #
+    #
+    # ... and if that doesn't work, the following has been known to do so in the past:
+    # (Source: http://gis.stackexchange.com/questions/109008/python-script-to-export-csv-tables-from-gdb)
+    #
+    # fields = arcpy.ListFields(output_event_table)
+    # field_names = [field.name for field in fields]
+    # with open(output_csv_1,'wb') as f:
+    #    w = csv.writer(f)
+    #    w.writerow(field_names)
+    #    for row in arcpy.SearchCursor(output_event_table):
+    #        field_vals = [row.getValue(field.name) for field in fields]
+    #        w.writerow(field_vals)
+    #    del row
+    #
+    metrics.end('export')
+    if intermediate_file_format == 'npy':
+        intermediate_file_name_1 = output_npy_file_name_1
+    else:
+        intermediate_file_name_1 = output_csv_file_name_1
+    # end_if
+    log.info("Finished executing phase 1: " + MassDOT_route_id + ". Intermediate output is in: " + output_csv_dir_1 + "\\" + intermediate_file_name_1)
 
-# Export final_event_table to CSV file
-#
-# Code generated by model:
-arcpy.TableToTable_conversion(output_event_table, output_csv_dir_1, output_csv_file_name_1)
-#
-#
-# ... and if that doesn't work, the following has been known to do so in the past:
-# (Source: http://gis.stackexchange.com/questions/109008/python-script-to-export-csv-tables-from-gdb)
-#
-# fields = arcpy.ListFields(output_event_table)
-# field_names = [field.name for field in fields]
-# with open(output_csv_1,'wb') as f:
-#    w = csv.writer(f)
-#    w.writerow(field_names)
-#    for row in arcpy.SearchCursor(output_event_table):
-#        field_vals = [row.getValue(field.name) for field in fields]
-#        w.writerow(field_vals)
-#    del row
-#
-arcpy.AddMessage("Finished executing phase 1: " + MassDOT_route_id + ". Intermediate output is in: " + output_csv_dir_1 + "\\" + output_csv_file_name_1)
+    metrics.start('post_processing', rows_in=output_event_count)
+    num_prior_problem_tmcs = len(process_csv_file.problem_tmcs)
+    if intermediate_file_format == 'npy':
+        log.info("Post-processing typed, columnar intermediate file.")
+        process_csv_columnar.main_routine(output_csv_dir_1, output_npy_file_name_1, output_csv_dir_2, output_csv_file_name_2)
+    else:
+        log.info("Post-processing CSV file.")
+        process_csv_file.main_routine(output_csv_dir_1, output_csv_file_name_1, output_csv_dir_2, output_csv_file_name_2,
+                                      sort_memory_budget=sort_memory_budget)
+    # end_if
+    metrics.end('post_processing')
+    metrics.set_value('problem_tmcs', len(process_csv_file.problem_tmcs) - num_prior_problem_tmcs)
+# end_if
+log.info("Finished executing phase 2: " + MassDOT_route_id + ". Final output is in: " + output_csv_dir_2 + "\\" + output_csv_file_name_2)
 
-arcpy.AddMessage("Post-processing CSV file.")
-process_csv_file.main_routine(output_csv_dir_1, output_csv_file_name_1, output_csv_dir_2, output_csv_file_name_2)
-arcpy.AddMessage("Finished executing phase 2: " + MassDOT_route_id + ". Final output is in: " + output_csv_dir_2 + "\\" + output_csv_file_name_2)
\ No newline at end of file
+metrics.finish()
+metrics.write(metrics_dir, metrics_file_name)
+log.info("Metrics written to: " + metrics_dir + "\\" + metrics_file_name)
+pipeline_logging.flush()
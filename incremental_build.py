@@ -0,0 +1,163 @@
+# incremental_build.py - Fingerprints of the inputs to the processing of a route pair, and the "build manifest"
+#                        that records them, so that batch runs can skip route pairs whose inputs have not changed.
+#
+# The fingerprint of a route pair is a SHA-1 hash of:
+#     1. the contents of its TMC list file
+#     2. the geometry of its primary- and secondary-direction routes (from the route geometry cache;
+#        see route_geometry_cache.py)
+#     3. the current (to_date IS NULL) records of the LRSE_Speed_Limit and LRSE_Number_Travel_Lanes
+#        event tables for its primary- and secondary-direction routes
+#     4. the towns_pb layer (town_id, area, and perimeter of each polygon)
+#     5. the "pipeline configuration": the source code of the scripts and modules that process a route pair
+#
+# The build manifest is a JSON file mapping the key of each route pair (e.g., 'SR9 EB') to the fingerprint
+# of the inputs from which its final CSV file was built, and the time at which it was built.
+#
+# Computing (3) and (4) requires arcpy.
+
+import hashlib
+import json
+import os
+import time
+
+try:
+    import arcpy
+    arcpy_present = True
+except:
+    arcpy_present = False
+# end_try_except
+
+# The scripts and modules whose source code is part of the "pipeline configuration"
+pipeline_modules = [ 'generate_tmc_events_for_arterials.py', 'process_csv_file.py', 'lr_projection.py',
+                     'route_geometry_cache.py', 'lrse_event_index.py', 'intermediate_format.py',
+                     'process_csv_columnar.py', 'pipeline_metrics.py', 'streaming_pipeline.py',
+                     'route_event_overlay.py', 'town_boundaries.py', 'secondary_direction_events.py',
+                     'tmc_store.py', 'tmc_location_cache.py', 'pipeline_dag.py',
+                     'external_sort.py', 'event_cleanup.py',
+                     'event_coalescing.py', 'massdot_routes.py' ]
+
+# route_pair_key: Return the key of a route pair in the build manifest, e.g., 'SR9 EB'
+#
+def route_pair_key(route_id_root, primary_dir):
+    return route_id_root + ' ' + primary_dir
+# def route_pair_key()
+
+# hash_file: Add the contents of a file to a hash
+#
+def hash_file(h, path):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(1 << 20)
+            if not chunk:
+                break
+            # end_if
+            h.update(chunk)
+        # while
+    # with
+# def hash_file()
+
+# hash_table_rows: Add the values of the given fields of (selected) records of a table to a hash.
+#                  The records are sorted first, so that the hash does not depend on the order in which they are read.
+#
+# Parameters: h - hash object
+#             table - full path to table or feature class
+#             fields - list of field names (or arcpy "tokens," e.g., 'SHAPE@AREA')
+#             where_clause - (optional) SQL where clause selecting records
+#
+def hash_table_rows(h, table, fields, where_clause=None):
+    if not arcpy_present:
+        raise RuntimeError("Computing the fingerprint of " + table + " requires arcpy.")
+    # end_if
+    rows = [tuple(str(value) for value in row) for row in arcpy.da.SearchCursor(table, fields, where_clause)]
+    rows.sort()
+    h.update((table + '\n').encode('utf-8'))
+    for row in rows:
+        h.update(('|'.join(row) + '\n').encode('utf-8'))
+    # for
+# def hash_table_rows()
+
+# pipeline_config_hash: Return a hash of the pipeline configuration
+#
+# Parameters: script_dir - directory containing the pipeline scripts and modules
+#             settings - (optional) dict of any other settings that affect the output
+# Return value: hex string
+#
+def pipeline_config_hash(script_dir, settings=None):
+    h = hashlib.sha1()
+    for module_name in pipeline_modules:
+        h.update((module_name + '\n').encode('utf-8'))
+        hash_file(h, os.path.join(script_dir, module_name))
+    # for
+    h.update(json.dumps(settings if settings is not None else {}, sort_keys=True).encode('utf-8'))
+    return h.hexdigest()
+# def pipeline_config_hash()
+
+# towns_fingerprint: Return a fingerprint of the towns_pb layer
+#
+def towns_fingerprint(towns_fc):
+    h = hashlib.sha1()
+    hash_table_rows(h, towns_fc, ['town_id', 'SHAPE@AREA', 'SHAPE@LENGTH'])
+    return h.hexdigest()
+# def towns_fingerprint()
+
+# route_pair_fingerprint: Return the fingerprint of the inputs to the processing of a route pair
+#
+# Parameters: route_id_root, primary_dir, secondary_dir - identify the route pair
+#             tmc_list_file - full path of the route pair's TMC list file
+#             route_geom_cache - open route_geometry_cache.RouteGeometryCache
+#             lrse_tables - list of full paths of the LRSE feature classes (or event tables) used
+#             towns_fp - fingerprint of the towns_pb layer (see towns_fingerprint)
+#             config_hash - hash of the pipeline configuration (see pipeline_config_hash)
+# Return value: hex string
+#
+def route_pair_fingerprint(route_id_root, primary_dir, secondary_dir, tmc_list_file, route_geom_cache,
+                           lrse_tables, towns_fp, config_hash):
+    route_ids = [route_id_root + ' ' + primary_dir, route_id_root + ' ' + secondary_dir]
+    h = hashlib.sha1()
+    h.update(('config ' + config_hash + '\ntowns ' + towns_fp + '\n').encode('utf-8'))
+    hash_file(h, tmc_list_file)
+    for route_id in route_ids:
+        h.update(('route ' + route_id + '\n').encode('utf-8'))
+        if route_id in route_geom_cache.routes:
+            xs, ys, ms, part_starts = route_geom_cache.get_points(route_id)
+            for values in (xs, ys, ms):
+                h.update(values.tobytes())
+            # for
+            h.update(json.dumps(part_starts).encode('utf-8'))
+        # end_if
+    # for
+    where_clause = "to_date IS NULL AND route_id IN ('" + "', '".join(route_ids) + "')"
+    for table in lrse_tables:
+        fields = [f.name for f in arcpy.ListFields(table) if f.name.lower() in ('route_id', 'from_measure', 'to_measure',
+                                                                               'speed_lim', 'op_dir_sl', 'num_lanes', 'opp_lanes')]
+        hash_table_rows(h, table, fields, where_clause)
+    # for
+    return h.hexdigest()
+# def route_pair_fingerprint()
+
+# load_manifest: Load the build manifest; an empty manifest is returned if the file does not exist
+#
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    # end_if
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+    # with
+# def load_manifest()
+
+# save_manifest: Save the build manifest (via a temporary file, so that it is never left half-written)
+#
+def save_manifest(manifest_path, manifest):
+    tmp_path = manifest_path + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    # with
+    os.replace(tmp_path, manifest_path)
+# def save_manifest()
+
+# record_build: Record in the manifest that the output for a route pair was built from inputs with the given fingerprint
+#
+def record_build(manifest, key, fingerprint):
+    manifest[key] = { 'fingerprint' : fingerprint, 'built' : time.strftime('%Y-%m-%d %H:%M:%S') }
+# def record_build()
@@ -0,0 +1,175 @@
+# intermediate_format.py - Typed, column-oriented alternative to the intermediate CSV file
+#                          (i.e., the *_events_output.csv file) written by phase 1 of
+#                          generate_tmc_events_for_arterials.py and read by phase 2.
+#
+# The intermediate event table is written as a NumPy structured array in a .npy file, e.g.,
+# sr9_events_output.npy, with one field per column that phase 2 uses. The string-valued fields
+# are fixed-width UTF-8 byte strings; the numeric fields are 4-byte integers and 8-byte floats,
+# so that they need not be re-parsed from text and cast by hand (as in process_csv_file.iter_csv),
+# and take up less space than their text representation in the CSV file.
+#
+# Because the array contains no Python objects, the file can be memory-mapped when it is read:
+# load_columns returns the numeric columns as (zero-copy) views of the memory-mapped file, and
+# decodes only the (short) string columns; the columns can be passed directly to
+# process_csv_columnar.aggregate_columns.
+#
+# The intermediate CSV file can still be exported alongside the .npy file (see
+# generate_tmc_events_for_arterials.py).
+#
+# This module depends upon numpy. Only export_table requires arcpy.
+
+import os
+import numpy as np
+
+try:
+    import arcpy
+    arcpy_present = True
+except:
+    arcpy_present = False
+# end_try_except
+
+# File name extension of intermediate files in this format
+file_extension = '.npy'
+
+# Names of the string-valued fields of the intermediate file
+string_field_names = ['tmc', 'tmctype', 'route_id', 'roadnum', 'direction', 'firstnm']
+# Names and types of the numeric fields of the intermediate file
+numeric_field_types = [ ('town_id', '<i4'), ('speed_lim', '<i4'), ('num_lanes', '<i4'),
+                        ('from_meas', '<f8'), ('to_meas', '<f8'), ('calc_len', '<f8') ]
+
+# is_intermediate_file: Return True if the named file is an intermediate file in this format (rather than a CSV file)
+#
+def is_intermediate_file(file_name):
+    return file_name.lower().endswith(file_extension)
+# def is_intermediate_file()
+
+# record_dtype: Return the NumPy dtype of the records of an intermediate file
+#
+# Parameter: string_widths - dict giving the width (in bytes, when encoded as UTF-8) of each string-valued field
+# Return value: numpy.dtype
+#
+def record_dtype(string_widths):
+    fields = [(name, 'S' + str(max(1, string_widths.get(name, 1)))) for name in string_field_names]
+    return np.dtype(fields + numeric_field_types)
+# def record_dtype()
+
+# columns_to_records: Pack a dict of columns into a structured array of records
+#
+# Parameter: cols - dict of columns (sequences or NumPy arrays) keyed by field name;
+#                   other keys in it (e.g., 'source') are ignored
+# Return value: NumPy structured array
+#
+def columns_to_records(cols):
+    num_recs = len(cols[string_field_names[0]])
+    encoded = {}
+    string_widths = {}
+    for name in string_field_names:
+        encoded[name] = [str(value).encode('utf-8') for value in cols[name]]
+        string_widths[name] = max([len(value) for value in encoded[name]]) if num_recs > 0 else 1
+    # for
+    retval = np.zeros(num_recs, dtype=record_dtype(string_widths))
+    for name in string_field_names:
+        retval[name] = encoded[name]
+    # for
+    for name, dtype in numeric_field_types:
+        retval[name] = cols[name]
+    # for
+    return retval
+# def columns_to_records()
+
+# save_columns: Write a dict of columns to an intermediate file
+#
+# Parameters: out_dir - full path of directory into which the intermediate file is to be written
+#             out_file - name of the intermediate file
+#             cols - dict of columns keyed by field name
+# Return value: none
+#
+def save_columns(out_dir, out_file, cols):
+    save_records(out_dir, out_file, columns_to_records(cols))
+# def save_columns()
+
+# save_records: Write a structured array of records to an intermediate file
+#
+# Note: The file is written under a temporary name and then renamed, so that it is never seen half-written.
+#
+def save_records(out_dir, out_file, recs):
+    out_fn = os.path.join(out_dir, out_file)
+    tmp_fn = out_fn + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_fn, 'wb') as f:
+        np.save(f, recs, allow_pickle=False)
+    # with
+    os.replace(tmp_fn, out_fn)
+# def save_records()
+
+# load_records: Read an intermediate file
+#
+# Parameters: in_dir - full path of directory containing the intermediate file
+#             in_file - name of the intermediate file
+#             mmap - (optional) if True (the default), memory-map the file rather than reading it
+# Return value: NumPy structured array
+#
+def load_records(in_dir, in_file, mmap=True):
+    return np.load(os.path.join(in_dir, in_file), mmap_mode='r' if mmap else None, allow_pickle=False)
+# def load_records()
+
+# load_columns: Read an intermediate file into a dict of typed NumPy arrays, in the form
+#               returned by process_csv_columnar.load_columns for a single CSV file
+#
+# Parameters: in_dir - full path of directory containing the intermediate file
+#             in_file - name of the intermediate file
+#             mmap - (optional) if True (the default), the numeric columns are views of the memory-mapped file
+# Return value: dict of NumPy arrays, keyed by field name; the string-valued columns are decoded to Unicode
+#
+def load_columns(in_dir, in_file, mmap=True):
+    recs = load_records(in_dir, in_file, mmap)
+    retval = {}
+    for name in string_field_names:
+        retval[name] = np.char.decode(recs[name], 'utf-8')
+    # for
+    for name, dtype in numeric_field_types:
+        retval[name] = recs[name]
+    # for
+    return retval
+# def load_columns()
+
+# iter_records: Read an intermediate file, yielding its records one at a time as dicts,
+#               in the same form as process_csv_file.iter_csv
+#
+def iter_records(in_dir, in_file):
+    recs = load_records(in_dir, in_file)
+    names = recs.dtype.names
+    for rec in recs:
+        retval = dict(zip(names, rec.tolist()))
+        for name in string_field_names:
+            retval[name] = retval[name].decode('utf-8')
+        # for
+        yield retval
+    # for
+# def iter_records()
+
+# export_table: Export an event table (e.g., the output event table of phase 1) to an intermediate file
+#
+# Parameters: table - full path of the event table
+#             out_dir - full path of directory into which the intermediate file is to be written
+#             out_file - name of the intermediate file
+# Return value: none
+#
+def export_table(table, out_dir, out_file):
+    if not arcpy_present:
+        raise RuntimeError("Exporting " + table + " requires arcpy.")
+    # end_if
+    field_names = string_field_names + [name for name, dtype in numeric_field_types]
+    null_values = {}
+    for name in string_field_names:
+        null_values[name] = ''
+    # for
+    for name, dtype in numeric_field_types:
+        null_values[name] = 0
+    # for
+    arr = arcpy.da.TableToNumPyArray(table, field_names, null_value=null_values)
+    cols = {}
+    for name in field_names:
+        cols[name] = arr[name]
+    # for
+    save_columns(out_dir, out_file, cols)
+# def export_table()
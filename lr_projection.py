@@ -0,0 +1,396 @@
+# lr_projection.py - Pure-Python linear referencing engine for locating TMC endpoints along a MassDOT route.
+#
+# This is a replacement for the arcpy Polyline.queryPointAndDistance calls that were made twice per TMC
+# in generate_tmc_events_for_arterials.py. A route's polyline is held as parallel x, y, and M arrays,
+# together with a uniform-grid spatial index of its segments, so that each point is compared only
+# against the segments in nearby grid cells rather than against every segment of the route.
+# Nothing here depends upon arcpy, except RouteGeometry.from_arcpy, which is merely a convenience
+# for building a RouteGeometry from an arcpy Polyline.
+#
+# The M-value of a projected point is interpolated linearly along the nearest segment of the route,
+# which is what queryPointAndDistance does. The M-values of the TMC endpoints are then clamped to
+# [0, M-value of the last point of the route], and zero-length events are flagged for discarding,
+# exactly as the original TMC-location loop did.
+#
+# RouteGeometry.project_points, which projects a batch of points, and points_at_measures, the inverse of projection
+# (the point of a route at each of a batch of measures), use NumPy.
+
+import math
+from array import array
+import numpy as np
+
+# Radii, in grid cells, of the successively larger blocks of cells searched by RouteGeometry.project_points
+block_radii = [1, 4, 16]
+
+# RouteGeometry: An M-aware (multi-part) route polyline, with a spatial index over its segments
+#
+class RouteGeometry(object):
+    # __init__: Build a RouteGeometry from a list of parts
+    #
+    # Parameters: route_id - MassDOT route_id of the route
+    #             parts - list of parts, each of which is a list of (x, y, m) tuples;
+    #                     a segment joins each pair of consecutive points within a part
+    #
+    def __init__(self, route_id, parts):
+        xs = array('d'); ys = array('d'); ms = array('d')
+        part_starts = []
+        for part in parts:
+            part_starts.append(len(xs))
+            for (x, y, m) in part:
+                xs.append(x)
+                ys.append(y)
+                ms.append(m)
+            # for
+        # for
+        self._init_arrays(route_id, xs, ys, ms, part_starts)
+    # def __init__()
+
+    # from_arrays: Build a RouteGeometry from parallel x, y, and M arrays, without copying them.
+    #              The arrays may be any indexable sequences of floats, e.g., slices of a memoryview
+    #              of a memory-mapped file (see route_geometry_cache.py).
+    #
+    # Parameters: route_id - MassDOT route_id of the route
+    #             xs, ys, ms - parallel sequences of the coordinates and M-values of the route's points
+    #             part_starts - list of the index (in xs, ys, ms) of the first point of each part
+    #
+    @classmethod
+    def from_arrays(cls, route_id, xs, ys, ms, part_starts):
+        retval = cls.__new__(cls)
+        retval._init_arrays(route_id, xs, ys, ms, part_starts)
+        return retval
+    # def from_arrays()
+
+    # _init_arrays: Common initialization; a segment joins each pair of consecutive points within a part
+    #
+    def _init_arrays(self, route_id, xs, ys, ms, part_starts):
+        self.route_id = route_id
+        self.xs = xs
+        self.ys = ys
+        self.ms = ms
+        self.part_starts = list(part_starts)
+        # Index (in xs, ys, ms) of the first point of each segment
+        self.seg_starts = array('l')
+        part_ends = self.part_starts[1:] + [len(xs)]
+        for first_ix, end_ix in zip(self.part_starts, part_ends):
+            for ix in range(first_ix, end_ix - 1):
+                self.seg_starts.append(ix)
+            # for
+        # for
+        if len(self.xs) == 0:
+            raise ValueError("Route " + str(route_id) + " has no points.")
+        # end_if
+        self.last_m_value = self.ms[len(self.ms) - 1]
+        self._build_index()
+    # def _init_arrays()
+
+    # from_arcpy: Build a RouteGeometry from an arcpy Polyline (e.g., the 'shape@' of a LRSN route feature)
+    #
+    @classmethod
+    def from_arcpy(cls, route_id, polyline):
+        parts = []
+        for part_ix in range(polyline.partCount):
+            part = []
+            for pt in polyline.getPart(part_ix):
+                if pt is not None:
+                    part.append((pt.X, pt.Y, pt.M))
+                # end_if
+            # for
+            parts.append(part)
+        # for
+        return cls(route_id, parts)
+    # def from_arcpy()
+
+    # _build_index: Build a uniform-grid index over the bounding boxes of the route's segments.
+    #               The cell size is the average segment length, so that each segment is
+    #               registered in only a few cells.
+    #
+    def _build_index(self):
+        xs = self.xs; ys = self.ys
+        self.min_x = min(xs); self.min_y = min(ys)
+        width = max(xs) - self.min_x
+        height = max(ys) - self.min_y
+        num_segs = len(self.seg_starts)
+        total_len = 0.0
+        for i in self.seg_starts:
+            total_len += math.hypot(xs[i+1] - xs[i], ys[i+1] - ys[i])
+        # for
+        cell_size = total_len / num_segs if num_segs > 0 else 0.0
+        if cell_size <= 0.0:
+            cell_size = max(width, height, 1.0)
+        # end_if
+        self.cell_size = cell_size
+        self.num_cols = int(width / cell_size) + 1
+        self.num_rows = int(height / cell_size) + 1
+        self.cells = {}
+        for seg_ix, i in enumerate(self.seg_starts):
+            c0 = int((min(xs[i], xs[i+1]) - self.min_x) / cell_size)
+            c1 = int((max(xs[i], xs[i+1]) - self.min_x) / cell_size)
+            r0 = int((min(ys[i], ys[i+1]) - self.min_y) / cell_size)
+            r1 = int((max(ys[i], ys[i+1]) - self.min_y) / cell_size)
+            for c in range(c0, c1 + 1):
+                for r in range(r0, r1 + 1):
+                    self.cells.setdefault(r * self.num_cols + c, []).append(seg_ix)
+                # for
+            # for
+        # for
+    # def _build_index()
+
+    # _project_onto_segment: Return (squared distance, M-value) of the point on segment seg_ix nearest (x, y)
+    #
+    def _project_onto_segment(self, seg_ix, x, y):
+        i = self.seg_starts[seg_ix]
+        x0 = self.xs[i]; y0 = self.ys[i]
+        dx = self.xs[i+1] - x0; dy = self.ys[i+1] - y0
+        seg_len_sq = dx * dx + dy * dy
+        if seg_len_sq > 0.0:
+            t = ((x - x0) * dx + (y - y0) * dy) / seg_len_sq
+            t = 0.0 if t < 0.0 else (1.0 if t > 1.0 else t)
+        else:
+            t = 0.0
+        # end_if
+        px = x0 + t * dx - x; py = y0 + t * dy - y
+        m = self.ms[i] + t * (self.ms[i+1] - self.ms[i])
+        return (px * px + py * py, m)
+    # def _project_onto_segment()
+
+    # project_point: Project a point onto the route
+    #
+    # Parameters: x, y - coordinates of the point, in the route's coordinate system
+    # Return value: tuple of (M-value of nearest point on route, distance from the point to the route)
+    #
+    # Note: Grid cells are searched in square "rings" of increasing radius around the cell containing
+    #       the point. Once the nearest segment found so far is closer than the inner edge of the next
+    #       ring, no unsearched segment can be closer. Ties are broken in favor of the segment that
+    #       comes first along the route.
+    #
+    def project_point(self, x, y):
+        if len(self.seg_starts) == 0:
+            return (self.ms[0], math.hypot(self.xs[0] - x, self.ys[0] - y))
+        # end_if
+        col = int(math.floor((x - self.min_x) / self.cell_size))
+        row = int(math.floor((y - self.min_y) / self.cell_size))
+        # Rings closer to the point than this contain no grid cells
+        radius = max(0, -col, col - (self.num_cols - 1), -row, row - (self.num_rows - 1))
+        max_radius = max(abs(col), abs(col - (self.num_cols - 1)), abs(row), abs(row - (self.num_rows - 1)))
+        best = None
+        while radius <= max_radius:
+            for r in range(max(row - radius, 0), min(row + radius, self.num_rows - 1) + 1):
+                if r == row - radius or r == row + radius:
+                    ring_cols = range(max(col - radius, 0), min(col + radius, self.num_cols - 1) + 1)
+                else:
+                    ring_cols = [c for c in (col - radius, col + radius) if c >= 0 and c < self.num_cols]
+                # end_if
+                for c in ring_cols:
+                    for seg_ix in self.cells.get(r * self.num_cols + c, ()):
+                        d2, m = self._project_onto_segment(seg_ix, x, y)
+                        if best is None or (d2, seg_ix) < (best[0], best[1]):
+                            best = (d2, seg_ix, m)
+                        # end_if
+                    # for
+                # for
+            # for
+            if best is not None and math.sqrt(best[0]) < radius * self.cell_size:
+                break
+            # end_if
+            radius += 1
+        # while
+        return (best[2], math.sqrt(best[0]))
+    # def project_point()
+
+    # _segment_arrays: Return the NumPy arrays used by project_points, building them on first use: the start point,
+    #                  extent, squared length, and M-values of each segment, and the grid index in compressed form
+    #                  (the sorted IDs of the occupied cells, the offset of each one's segments in cell_segs, and cell_segs)
+    #
+    def _segment_arrays(self):
+        if getattr(self, '_seg_arrays', None) is None:
+            xs = np.asarray(self.xs, dtype=np.float64)
+            ys = np.asarray(self.ys, dtype=np.float64)
+            ms = np.asarray(self.ms, dtype=np.float64)
+            seg_starts = np.asarray(self.seg_starts, dtype=np.int64)
+            x0 = xs[seg_starts]; y0 = ys[seg_starts]
+            dx = xs[seg_starts + 1] - x0; dy = ys[seg_starts + 1] - y0
+            cell_keys = np.array(sorted(self.cells.keys()), dtype=np.int64)
+            cell_counts = np.array([len(self.cells[key]) for key in cell_keys.tolist()], dtype=np.int64)
+            cell_offsets = np.concatenate(([0], np.cumsum(cell_counts)))
+            cell_segs = np.array([seg_ix for key in cell_keys.tolist() for seg_ix in self.cells[key]], dtype=np.int64)
+            self._seg_arrays = (x0, y0, dx, dy, dx * dx + dy * dy, ms[seg_starts], ms[seg_starts + 1] - ms[seg_starts],
+                                cell_keys, cell_offsets, cell_segs)
+        # end_if
+        return self._seg_arrays
+    # def _segment_arrays()
+
+    # _project_onto_blocks: Project a batch of points, with NumPy, onto all the segments in the square block of
+    #                       (2 * radius + 1) x (2 * radius + 1) grid cells around each point, at once
+    #
+    # Parameters: px, py - NumPy arrays of point coordinates
+    #             radius - radius of the block of grid cells, in cells
+    # Return value: tuple of NumPy arrays (M-value of the nearest point on the nearest candidate segment of each
+    #               point, True where that segment is the nearest segment of the route, i.e., where it is closer
+    #               than radius cell widths, so that no segment outside the block can be as close)
+    #
+    def _project_onto_blocks(self, px, py, radius):
+        x0, y0, dx, dy, len_sq, m0, dm, cell_keys, cell_offsets, cell_segs = self._segment_arrays()
+        num_points = len(px)
+        width = 2 * radius + 1
+
+        # Candidate (point, segment) pairs, from the block of cells around each point
+        col = np.floor((px - self.min_x) / self.cell_size).astype(np.int64)
+        row = np.floor((py - self.min_y) / self.cell_size).astype(np.int64)
+        offsets = np.arange(-radius, radius + 1, dtype=np.int64)
+        block_cols = np.repeat(col[:, None, None] + offsets[None, None, :], width, axis=1).reshape(-1)
+        block_rows = np.repeat(row[:, None, None] + offsets[None, :, None], width, axis=2).reshape(-1)
+        in_grid = (block_cols >= 0) & (block_cols < self.num_cols) & (block_rows >= 0) & (block_rows < self.num_rows)
+        keys = block_rows * self.num_cols + block_cols
+        pos = np.minimum(np.searchsorted(cell_keys, keys), len(cell_keys) - 1)
+        occupied = in_grid & (cell_keys[pos] == keys)
+        counts = np.where(occupied, cell_offsets[pos + 1] - cell_offsets[pos], 0)
+        pair_starts = np.cumsum(counts) - counts
+        num_pairs = int(counts.sum())
+        pair_block = np.repeat(np.arange(len(keys)), counts)
+        pair_point = pair_block // (width * width)
+        pair_seg = cell_segs[cell_offsets[pos][pair_block] + (np.arange(num_pairs) - pair_starts[pair_block])]
+
+        # Project each point onto each of its candidate segments, as _project_onto_segment does
+        sx0 = x0[pair_seg]; sy0 = y0[pair_seg]; sdx = dx[pair_seg]; sdy = dy[pair_seg]; slen_sq = len_sq[pair_seg]
+        qx = px[pair_point]; qy = py[pair_point]
+        t = np.where(slen_sq > 0.0, ((qx - sx0) * sdx + (qy - sy0) * sdy) / np.where(slen_sq > 0.0, slen_sq, 1.0), 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        ex = sx0 + t * sdx - qx; ey = sy0 + t * sdy - qy
+        d2 = ex * ex + ey * ey
+        m = m0[pair_seg] + t * dm[pair_seg]
+
+        # The nearest candidate segment of each point; ties are broken in favor of the segment that comes first along the route
+        order = np.lexsort((pair_seg, d2, pair_point))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = pair_point[order][1:] != pair_point[order][:-1]
+        best = order[first]
+        meas = np.zeros(num_points)
+        resolved = np.zeros(num_points, dtype=bool)
+        meas[pair_point[best]] = m[best]
+        resolved[pair_point[best]] = np.sqrt(d2[best]) < radius * self.cell_size
+        return (meas, resolved)
+    # def _project_onto_blocks()
+
+    # project_points: Project a batch of points onto the route
+    #
+    # Parameters: xs, ys - parallel sequences of point coordinates
+    # Return value: array of the M-values of the nearest points on the route
+    #
+    # Note: The points are projected with NumPy (see _project_onto_blocks), first onto the segments in the 3 x 3
+    #       block of grid cells around each point, and then, for the points whose nearest segment is not in that
+    #       block, onto those in successively larger blocks. Only the points whose nearest segment is not in the
+    #       largest block (i.e., points far from the route) are projected one at a time, by project_point.
+    #       The result is the same as that of project_point for every point.
+    #
+    def project_points(self, xs, ys):
+        px = np.asarray(xs, dtype=np.float64)
+        py = np.asarray(ys, dtype=np.float64)
+        if len(px) == 0 or len(self.seg_starts) == 0:
+            return array('d', [self.project_point(x, y)[0] for x, y in zip(xs, ys)])
+        # end_if
+        meas = np.zeros(len(px))
+        pending = np.arange(len(px))
+        for radius in block_radii:
+            block_meas, resolved = self._project_onto_blocks(px[pending], py[pending], radius)
+            meas[pending[resolved]] = block_meas[resolved]
+            pending = pending[~resolved]
+            if len(pending) == 0:
+                break
+            # end_if
+        # for
+        retval = array('d', meas.tolist())
+        for i in pending.tolist():
+            retval[i] = self.project_point(float(px[i]), float(py[i]))[0]
+        # for
+        return retval
+    # def project_points()
+# class RouteGeometry
+
+# points_at_measures: Return the coordinates of the points of a route at the given measures
+#
+# Parameters: route - RouteGeometry
+#             meas - NumPy array of measures
+# Return value: tuple of parallel NumPy arrays (xs, ys)
+#
+# Note: The M-values of the route are assumed to be non-decreasing along it; measures beyond
+#       either end of the route are located at that end.
+#
+def points_at_measures(route, meas):
+    xs = np.asarray(route.xs, dtype=np.float64)
+    ys = np.asarray(route.ys, dtype=np.float64)
+    ms = np.asarray(route.ms, dtype=np.float64)
+    seg_starts = np.asarray(route.seg_starts, dtype=np.int64)
+    if len(seg_starts) == 0:
+        return (np.full(len(meas), xs[0]), np.full(len(meas), ys[0]))
+    # end_if
+    m0 = ms[seg_starts]
+    m1 = ms[seg_starts + 1]
+    seg = np.clip(np.searchsorted(m1, meas, side='left'), 0, len(seg_starts) - 1)
+    span = m1[seg] - m0[seg]
+    t = np.where(span > 0, (meas - m0[seg]) / np.where(span > 0, span, 1.0), 0.0)
+    t = np.clip(t, 0.0, 1.0)
+    x0 = xs[seg_starts[seg]]; x1 = xs[seg_starts[seg] + 1]
+    y0 = ys[seg_starts[seg]]; y1 = ys[seg_starts[seg] + 1]
+    return (x0 + t * (x1 - x0), y0 + t * (y1 - y0))
+# def points_at_measures()
+
+# clamp_meas: Force an M-value lying beyond the beginning or the end of the route
+#             to the M-value of the beginning of the route (0.0) or to last_m_value, respectively
+#
+def clamp_meas(m, last_m_value):
+    if m >= 0.0:
+        return m if m <= last_m_value else last_m_value
+    else:
+        return 0.0
+    # end_if
+# def clamp_meas()
+
+# locate_events: Locate a batch of linear features (e.g., TMCs), given by their endpoints, along a route
+#
+# Parameters: route - RouteGeometry
+#             from_xs, from_ys - coordinates of the first point of each feature
+#             to_xs, to_ys - coordinates of the last point of each feature
+# Return value: tuple of (from_meas array, to_meas array, list of booleans indicating which
+#               events are to be kept, i.e., are not zero-length)
+#
+def locate_events(route, from_xs, from_ys, to_xs, to_ys):
+    from_meas = route.project_points(from_xs, from_ys)
+    to_meas = route.project_points(to_xs, to_ys)
+    keep = []
+    for i in range(len(from_meas)):
+        from_meas[i] = clamp_meas(from_meas[i], route.last_m_value)
+        to_meas[i] = clamp_meas(to_meas[i], route.last_m_value)
+        # Do not keep zero-length events
+        keep.append((from_meas[i] >= 0.0 and to_meas[i] > 0.0) and (from_meas[i] != to_meas[i]))
+    # for
+    return (from_meas, to_meas, keep)
+# def locate_events()
+
+# locate_tmc_events: Locate a batch of TMCs along a route, producing TMC event records
+#
+# Parameters: route - RouteGeometry
+#             tmc_recs - list of dicts, each with the fields 'tmc', 'tmctype', 'roadnum', 'firstnm',
+#                        'direction' (harvested from the INRIX data), and 'from_x', 'from_y',
+#                        'to_x', 'to_y' (the TMC's first and last points)
+# Return value: tuple of (1) list of event dicts with the fields of the TMC event table, i.e.,
+#               'route_id', 'from_meas', 'to_meas', 'tmc', 'tmctype', 'roadnum', 'firstnm', 'direction',
+#               and (2) list of the event dicts for the zero-length events that were discarded
+#
+def locate_tmc_events(route, tmc_recs):
+    from_meas, to_meas, keep = locate_events(route,
+                                             [rec['from_x'] for rec in tmc_recs], [rec['from_y'] for rec in tmc_recs],
+                                             [rec['to_x'] for rec in tmc_recs], [rec['to_y'] for rec in tmc_recs])
+    events = []
+    discarded = []
+    for i, rec in enumerate(tmc_recs):
+        event = { 'route_id' : route.route_id, 'from_meas' : from_meas[i], 'to_meas' : to_meas[i],
+                  'tmc' : rec['tmc'], 'tmctype' : rec['tmctype'], 'roadnum' : rec['roadnum'],
+                  'firstnm' : rec['firstnm'], 'direction' : rec['direction'] }
+        if keep[i]:
+            events.append(event)
+        else:
+            discarded.append(event)
+        # end_if
+    # for
+    return (events, discarded)
+# def locate_tmc_events()
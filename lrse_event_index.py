@@ -0,0 +1,276 @@
+# lrse_event_index.py - In-memory index of the events in a MassDOT LRSE event table (or feature class),
+#                       e.g., LRSE_Speed_Limit or LRSE_Number_Travel_Lanes, by route_id and measure.
+#
+# This replaces the per-route spatial selection of the statewide LRSE layer (SelectLayerByLocation "WITHIN"
+# the selected route), followed by LocateFeaturesAlongRoutes, that was performed for each route processed.
+# The events of the entire LRSE table are read ONCE, and grouped by route_id. The events of each route
+# are held in parallel arrays sorted on from_measure, which are treated as an implicit balanced binary
+# search tree: the "node" for the sub-array [lo, hi) is its midpoint, and each node records the maximum
+# to_measure of the events in its subtree. This allows the question "which events on route R overlap
+# the measure interval [a, b]?" to be answered in O(log n + k) time, where k is the number of such events.
+#
+# Note: Selecting events by route_id is the "attribute-based selection" noted in the comments in
+#       generate_tmc_events_for_arterials.py as an alternative to the spatial selection. Because the
+#       LRSE FCs used are regenerated from the LRSE event tables and the LRSN, the measures of an event
+#       on its own route are those recorded in its from_measure and to_measure fields.
+#
+# The index can be saved to (and loaded from) a file in a local cache directory, so that it is built only
+# once per run (and only when the LRSE table has changed) even when routes are processed in separate
+# worker processes (see batch_generate_tmc_events.py). Only reading the LRSE table requires arcpy.
+
+import os
+import pickle
+from array import array
+import route_geometry_cache
+
+try:
+    import arcpy
+    arcpy_present = True
+except:
+    arcpy_present = False
+# end_try_except
+
+# RouteEvents: The events on one route, sorted on from_measure, with the implicit interval tree described above
+#
+class RouteEvents(object):
+    # __init__: Build the index for one route
+    #
+    # Parameter: events - list of (from_measure, to_measure, values) tuples, where values is a tuple
+    #                     of the values of the event's "value fields" (e.g., (speed_lim, op_dir_sl))
+    #
+    def __init__(self, events):
+        events = sorted(events, key=lambda event: (event[0], event[1]))
+        self.from_meas = array('d', [event[0] for event in events])
+        self.to_meas = array('d', [event[1] for event in events])
+        self.values = [event[2] for event in events]
+        self.max_to_meas = array('d', self.to_meas)
+        self._build(0, len(events))
+    # def __init__()
+
+    # _build: Compute max_to_meas for the subtree for the sub-array [lo, hi); return the maximum
+    #
+    def _build(self, lo, hi):
+        if lo >= hi:
+            return None
+        # end_if
+        mid = (lo + hi) // 2
+        retval = self.to_meas[mid]
+        for child_max in (self._build(lo, mid), self._build(mid + 1, hi)):
+            if child_max is not None and child_max > retval:
+                retval = child_max
+            # end_if
+        # for
+        self.max_to_meas[mid] = retval
+        return retval
+    # def _build()
+
+    # __len__: Return the number of events on the route
+    #
+    def __len__(self):
+        return len(self.from_meas)
+    # def __len__()
+
+    # query: Return the indices (in from_meas, to_meas, values) of the events overlapping [a, b],
+    #        in ascending order of from_measure. An event "overlaps" [a, b] if it shares at least
+    #        one point with it, i.e., events that merely touch [a, b] are included.
+    #
+    def query(self, a, b):
+        retval = []
+        # Stack of sub-arrays [lo, hi) to be searched; the left subtree of a node is searched before
+        # the node itself, and the node before its right subtree. An entry of the form (i, None)
+        # stands for the event at i itself.
+        stack = [(0, len(self.from_meas))]
+        while stack:
+            lo, hi = stack.pop()
+            if hi is None:
+                if self.to_meas[lo] >= a:
+                    retval.append(lo)
+                # end_if
+                continue
+            # end_if
+            if lo >= hi:
+                continue
+            # end_if
+            mid = (lo + hi) // 2
+            # No event in this subtree ends at or after a
+            if self.max_to_meas[mid] < a:
+                continue
+            # end_if
+            if self.from_meas[mid] <= b:
+                # The event at mid, and possibly some in the right subtree, begin at or before b
+                stack.append((mid + 1, hi))
+                stack.append((mid, None))
+            # end_if
+            stack.append((lo, mid))
+        # while
+        return retval
+    # def query()
+# class RouteEvents
+
+# LrseEventIndex: Index of the events in a LRSE table, by route_id and measure
+#
+class LrseEventIndex(object):
+    # __init__: Build the index
+    #
+    # Parameters: records - iterable of (route_id, from_measure, to_measure, value_1, ..., value_n) tuples
+    #             value_fields - list of the names of the n value fields, e.g., ['speed_lim', 'op_dir_sl']
+    #             fingerprint - (optional) fingerprint of the LRSE table from which the records were read
+    #
+    def __init__(self, records, value_fields, fingerprint=None):
+        self.value_fields = list(value_fields)
+        self.fingerprint = fingerprint
+        events_by_route = {}
+        for rec in records:
+            if rec[0] is None or rec[1] is None or rec[2] is None:
+                continue
+            # end_if
+            events_by_route.setdefault(rec[0], []).append((rec[1], rec[2], tuple(rec[3:])))
+        # for
+        self.routes = {}
+        for route_id in events_by_route:
+            self.routes[route_id] = RouteEvents(events_by_route[route_id])
+        # for
+    # def __init__()
+
+    # route_ids: Return the list of route_ids that have events
+    #
+    def route_ids(self):
+        return list(self.routes.keys())
+    # def route_ids()
+
+    # query: Return the events on a route that overlap the measure interval [a, b]
+    #
+    # Parameters: route_id - MassDOT route_id
+    #             a, b - the measure interval; if omitted, all events on the route are returned
+    # Return value: list of dicts, each with the fields 'route_id', 'from_meas', 'to_meas', and the
+    #               value fields of the index, in ascending order of from_meas
+    #
+    def query(self, route_id, a=None, b=None):
+        route_events = self.routes.get(route_id)
+        if route_events is None:
+            return []
+        # end_if
+        if a is None and b is None:
+            ixs = range(len(route_events))
+        else:
+            ixs = route_events.query(a if a is not None else float('-inf'), b if b is not None else float('inf'))
+        # end_if
+        retval = []
+        for i in ixs:
+            event = { 'route_id' : route_id, 'from_meas' : route_events.from_meas[i], 'to_meas' : route_events.to_meas[i] }
+            for field_name, value in zip(self.value_fields, route_events.values[i]):
+                event[field_name] = value
+            # for
+            retval.append(event)
+        # for
+        return retval
+    # def query()
+
+    # save: Save the index to a file
+    #
+    def save(self, path):
+        tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+        # with
+        os.replace(tmp_path, path)
+    # def save()
+
+    # load: Load an index saved by save
+    #
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+        # with
+    # def load()
+# class LrseEventIndex
+
+# read_lrse_table: Generator yielding (route_id, from_measure, to_measure, value_1, ..., value_n) tuples
+#                  for the current (to_date IS NULL) records of a LRSE table
+#
+def read_lrse_table(lrse_table, value_fields, where_clause="to_date IS NULL"):
+    if not arcpy_present:
+        raise RuntimeError("Reading " + lrse_table + " requires arcpy.")
+    # end_if
+    for row in arcpy.da.SearchCursor(lrse_table, ['route_id', 'from_measure', 'to_measure'] + list(value_fields), where_clause):
+        yield row
+    # for
+# def read_lrse_table()
+
+# build_index: Build the index for a LRSE table
+#
+# Parameters: lrse_table - full path to the LRSE table or feature class
+#             value_fields - list of the names of the value fields to be indexed
+#             fingerprint - (optional) fingerprint of lrse_table, if already computed
+# Return value: LrseEventIndex
+#
+def build_index(lrse_table, value_fields, fingerprint=None):
+    return LrseEventIndex(read_lrse_table(lrse_table, value_fields), value_fields, fingerprint)
+# def build_index()
+
+# index_file_name: Return the name of the file in which the index for a LRSE table is cached, e.g., LRSE_Speed_Limit.index
+#
+def index_file_name(lrse_table):
+    return lrse_table.replace('/', '\\').split('\\')[-1] + '.index'
+# def index_file_name()
+
+# open_index: Return the index for a LRSE table, loading it from the cache directory if it is there
+#             and up to date, and otherwise building it (and saving it to the cache directory)
+#
+# Parameters: lrse_table - full path to the LRSE table or feature class
+#             value_fields - list of the names of the value fields to be indexed
+#             cache_dir - full path of the cache directory (see route_geometry_cache.py)
+#             verify - (optional) if False, load a cached index without checking that it is up to date
+# Return value: LrseEventIndex
+#
+def open_index(lrse_table, value_fields, cache_dir, verify=True):
+    index_path = os.path.join(cache_dir, index_file_name(lrse_table))
+    if os.path.exists(index_path):
+        index = LrseEventIndex.load(index_path)
+        if index.value_fields == list(value_fields) and not verify:
+            return index
+        # end_if
+    else:
+        index = None
+    # end_if
+    fingerprint = route_geometry_cache.source_fingerprint(lrse_table)
+    if index is not None and index.value_fields == list(value_fields) and index.fingerprint == fingerprint:
+        return index
+    # end_if
+    index = build_index(lrse_table, value_fields, fingerprint)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    # end_if
+    index.save(index_path)
+    return index
+# def open_index()
+
+# write_event_table: Write the events on a route (as returned by LrseEventIndex.query) to a new event table
+#
+# Parameters: out_gdb - full path of the geodatabase in which the event table is created
+#             out_table_name - name of the event table
+#             events - list of event dicts
+#             value_fields - list of (field name, field type) tuples of the value fields to be written,
+#                            e.g., [('speed_lim', 'LONG')]
+# Return value: none
+#
+def write_event_table(out_gdb, out_table_name, events, value_fields):
+    out_table = out_gdb + '\\' + out_table_name
+    if arcpy.Exists(out_table):
+        arcpy.Delete_management(out_table)
+    # end_if
+    arcpy.CreateTable_management(out_gdb, out_table_name)
+    arcpy.AddField_management(out_table, 'route_id', 'TEXT', '', '', 32)
+    arcpy.AddField_management(out_table, 'from_meas', 'DOUBLE')
+    arcpy.AddField_management(out_table, 'to_meas', 'DOUBLE')
+    for field_name, field_type in value_fields:
+        arcpy.AddField_management(out_table, field_name, field_type)
+    # for
+    field_names = ['route_id', 'from_meas', 'to_meas'] + [field_name for field_name, field_type in value_fields]
+    out_csr = arcpy.da.InsertCursor(out_table, field_names)
+    for event in events:
+        out_csr.insertRow([event[field_name] for field_name in field_names])
+    # for
+    del out_csr
+# def write_event_table()
@@ -0,0 +1,145 @@
+# massdot_routes.py - The list of MassDOT arterial route_ids processed by the scripts in this directory,
+#                     and utility functions for working with MassDOT route_ids and "route pairs."
+#
+# Recall that a MassDOT 'route_id' is a triple of {route_system, route_number, route_direction},
+# e.g., 'SR9 EB'. Its "route_id root" is the portion of the route_id that specifies the route system
+# and route number, e.g., 'SR9'. A "route pair" comprises the primary direction (NB or EB) of a route
+# and its secondary direction (SB or WB, respectively).
+
+# The MassDOT route_ids of all arterial routes, in both directions.
+# (Note that the secondary direction of SR135 is coded by MassDOT as 'SB'.)
+arterial_route_ids = [ 'SR107 NB', 'SR107 SB',
+                       'SR109 EB', 'SR109 WB',
+                       'SR114 EB', 'SR114 WB',
+                       'SR115 NB', 'SR115 SB',
+                       'SR117 EB', 'SR117 WB',
+                       'SR119 EB', 'SR119 WB',
+                       'SR123 EB', 'SR123 WB',
+                       'SR126 NB', 'SR126 SB',
+                       'SR129 EB', 'SR129 WB',
+                       'SR135 EB', 'SR135 SB',
+                       'SR138 NB', 'SR138 SB',
+                       'SR139 EB', 'SR139 WB',
+                       'SR140 EB', 'SR140 WB',
+                       'SR16 EB',  'SR16 WB',
+                       'SR18 NB',  'SR18 SB',
+                       'SR1A NB',  'SR1A SB',
+                       'SR203 EB', 'SR203 WB',
+                       'SR225 EB', 'SR225 WB',
+                       'SR228 NB', 'SR228 SB',
+                       'SR27 NB',  'SR27 SB',
+                       'SR28 NB',  'SR28 SB',
+                       'SR2A EB',  'SR2A WB',
+                       'SR30 EB',  'SR30 WB',
+                       'SR37 NB',  'SR37 SB',
+                       'SR38 NB',  'SR38 SB',
+                       'SR3A NB',  'SR3A SB',
+                       'SR4 NB',   'SR4 SB',
+                       'SR53 NB',  'SR53 SB',
+                       'SR60 EB',  'SR60 WB',
+                       'SR62 EB',  'SR62 WB',
+                       'SR85 NB',  'SR85 SB',
+                       'SR9 EB',   'SR9 WB',
+                       'SR99 NB',  'SR99 SB',
+                       'US1 NB',   'US1 SB',
+                       'US20 EB',  'US20 WB' ]
+
+# read_route_list_file: Read a file containing a newline-delimited list of MassDOT route_ids
+#
+# Parameter: route_list_file_name - full path to the file
+# Return value: list of route_ids; blank lines are ignored
+#
+def read_route_list_file(route_list_file_name):
+    with open(route_list_file_name, 'r') as f:
+        s = f.read()
+    # with
+    return [route_id.strip() for route_id in s.split('\n') if route_id.strip() != '']
+# def read_route_list_file()
+
+# get_route_list: Return the list of route_ids specified by the (optional) route list file parameter
+#                 of the scripts in this directory
+#
+# Parameter: route_list_file_name - full path to a file containing a newline-delimited list of MassDOT route_ids,
+#                                   or '' (or 'ALL') to specify all arterial routes
+# Return value: list of route_ids
+#
+def get_route_list(route_list_file_name):
+    if route_list_file_name == '' or route_list_file_name.upper() == 'ALL':
+        return list(arterial_route_ids)
+    else:
+        return read_route_list_file(route_list_file_name)
+    # end_if
+# def get_route_list()
+
+# route_direction: Return the direction of the given direction of a route, as coded in arterial_route_ids
+#
+# Parameters: route_id_root - route_id root of the route, e.g., 'SR135'
+#             primary - True for the primary direction of the route, False for its secondary direction
+# Return value: direction, e.g., 'SB'; None if the route is not in arterial_route_ids
+#
+def route_direction(route_id_root, primary):
+    for route_id in arterial_route_ids:
+        parts = route_id.split(' ')
+        if parts[0] == route_id_root and is_primary_route_id(route_id) == primary:
+            return parts[1]
+        # end_if
+    # for
+    return None
+# def route_direction()
+
+# secondary_direction: Return the secondary direction corresponding to a primary direction
+#
+# Parameters: primary_dir - primary direction ('NB' or 'EB')
+#             route_id_root - (optional) route_id root of the route; if given, and the route is in arterial_route_ids,
+#                             its secondary direction as coded there is returned, e.g., 'SB' for 'SR135' (whose
+#                             primary direction is 'EB')
+# Return value: 'SB' or 'WB'
+#
+def secondary_direction(primary_dir, route_id_root=None):
+    secondary_dir = route_direction(route_id_root, False) if route_id_root is not None else None
+    if secondary_dir is not None:
+        return secondary_dir
+    # end_if
+    return 'SB' if primary_dir == 'NB' else 'WB'
+# def secondary_direction()
+
+# secondary_route_id: Return the route_id of the secondary direction of a route pair, e.g., 'SR135 SB' for ('SR135', 'EB')
+#
+def secondary_route_id(route_id_root, primary_dir):
+    return route_id_root + ' ' + secondary_direction(primary_dir, route_id_root)
+# def secondary_route_id()
+
+# is_primary_route_id: Return True if the given route_id is for the primary direction (NB or EB) of a route
+#
+def is_primary_route_id(route_id):
+    return route_id.endswith("NB") or route_id.endswith("EB")
+# def is_primary_route_id()
+
+# get_route_pairs: Return the list of route pairs for a list of route_ids
+#
+# Parameter: route_list - list of MassDOT route_ids; either or both directions of a route may be included
+# Return value: list of (route_id root, primary direction) tuples, one per route pair, in order of first appearance
+#
+def get_route_pairs(route_list):
+    retval = []
+    for route_id in route_list:
+        parts = route_id.split(' ')
+        route_id_root = parts[0]
+        route_dir = parts[1]
+        if is_primary_route_id(route_id):
+            primary_dir = route_dir
+        else:
+            primary_dir = route_direction(route_id_root, True) or ('NB' if route_dir == 'SB' else 'EB')
+            # Accommodate routes whose directions are coded irregularly, e.g., 'SR135 EB' / 'SR135 SB'
+            for other_route_id in route_list:
+                if other_route_id.split(' ')[0] == route_id_root and is_primary_route_id(other_route_id):
+                    primary_dir = other_route_id.split(' ')[1]
+                # end_if
+            # for
+        # end_if
+        if (route_id_root, primary_dir) not in retval:
+            retval.append((route_id_root, primary_dir))
+        # end_if
+    # for
+    return retval
+# def get_route_pairs()
@@ -0,0 +1,239 @@
+# pipeline_dag.py - Dependency graph of pipeline stages, and a scheduler that runs independent stages concurrently.
+#
+# A stage is a function, with declared inputs: the stages whose outputs it consumes. Adding a stage to a
+# PipelineGraph returns a StageHandle, which stands for the stage's output, and which later stages name as
+# an input; the function of a stage is called with the outputs of its inputs as its arguments, in order.
+#
+# PipelineGraph.run starts every stage whose inputs are complete, so that stages that do not depend upon each
+# other (e.g., the generation of the TMC, town, speed limit, and number-of-lanes events of a route, which depend
+# only upon the route) run at the same time, on a pool of threads. Stages that call arcpy, which is not
+# thread-safe, are declared main_thread=True, and are run in the thread that called run, as soon as their
+# inputs are complete. Note that (because of the global interpreter lock) threads overlap the time that stages
+# spend waiting on I/O (reading caches and indices, SQLite, etc.) and in NumPy, rather than in pure Python code.
+#
+# PipelineGraph.dry_run returns a description of the graph - the stages in the order in which they may run,
+# with their inputs, estimated durations, and earliest start and finish times - marking the critical path, i.e.,
+# the chain of dependent stages that determines the least possible elapsed time. The estimated durations may be
+# taken from a previous run, e.g., from its metrics record (see pipeline_metrics.py and durations_from_metrics).
+# If the graph is given a pipeline_metrics.PipelineMetrics, each stage is recorded in it under its name.
+#
+# This module does not depend upon arcpy.
+
+import concurrent.futures
+import json
+import os
+import time
+
+# StageHandle: The output of a stage
+#
+class StageHandle(object):
+    def __init__(self, name):
+        self.name = name
+        self.done = False
+        self.value = None
+    # def __init__()
+
+    # result: Return the output of the stage; raises RuntimeError if it has not been run
+    #
+    def result(self):
+        if not self.done:
+            raise RuntimeError("Stage " + self.name + " has not been run.")
+        # end_if
+        return self.value
+    # def result()
+# class StageHandle
+
+# PipelineGraph: A dependency graph of stages
+#
+class PipelineGraph(object):
+    # __init__: Create an empty graph
+    #
+    # Parameter: metrics - (optional) pipeline_metrics.PipelineMetrics in which each stage is recorded
+    #
+    def __init__(self, metrics=None):
+        self.metrics = metrics
+        # Stages, in the order in which they were added: dicts with the fields 'name', 'fn', 'inputs'
+        # (list of names), 'main_thread', 'rows_out_fn', and 'handle'
+        self.stages = []
+        self.stages_by_name = {}
+        # Elapsed (wall-clock) time of each stage, in seconds, once run
+        self.durations = {}
+    # def __init__()
+
+    # add_stage: Add a stage to the graph
+    #
+    # Parameters: name - name of the stage (e.g., the name under which its metrics are recorded)
+    #             fn - function performing the stage; called with the outputs of the stages in inputs
+    #             inputs - (optional) list of the StageHandles of the stages whose outputs the stage consumes
+    #             main_thread - (optional) if True, the stage is run in the thread that calls run (e.g., if it calls arcpy)
+    #             rows_out_fn - (optional) function returning the number of rows output, given the output of the stage
+    # Return value: StageHandle
+    #
+    def add_stage(self, name, fn, inputs=None, main_thread=False, rows_out_fn=None):
+        if name in self.stages_by_name:
+            raise ValueError("Duplicate stage name: " + name)
+        # end_if
+        input_names = [handle.name for handle in (inputs or [])]
+        for input_name in input_names:
+            if input_name not in self.stages_by_name:
+                raise ValueError("Stage " + name + ": unknown input stage " + input_name)
+            # end_if
+        # for
+        stage = { 'name' : name, 'fn' : fn, 'inputs' : input_names, 'main_thread' : main_thread,
+                  'rows_out_fn' : rows_out_fn, 'handle' : StageHandle(name) }
+        self.stages.append(stage)
+        self.stages_by_name[name] = stage
+        return stage['handle']
+    # def add_stage()
+
+    # _call: Perform a stage, recording its elapsed time
+    #
+    def _call(self, stage):
+        args = [self.stages_by_name[input_name]['handle'].value for input_name in stage['inputs']]
+        start = time.time()
+        if self.metrics is not None:
+            retval = self.metrics.time(stage['name'], lambda: stage['fn'](*args), rows_out_fn=stage['rows_out_fn'])
+        else:
+            retval = stage['fn'](*args)
+        # end_if
+        self.durations[stage['name']] = time.time() - start
+        return retval
+    # def _call()
+
+    # run: Run the stages, each as soon as its inputs are complete
+    #
+    # Parameter: max_workers - (optional) maximum number of stages run at once in the thread pool
+    # Return value: dict mapping the name of each stage to its output; if a stage raises an exception,
+    #               no further stages are started, and the exception is re-raised once running stages finish
+    #
+    def run(self, max_workers=4):
+        pending = list(self.stages)
+        running = {}
+        error = None
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            while len(pending) > 0 or len(running) > 0:
+                ready = [stage for stage in pending if error is None and
+                         all(self.stages_by_name[input_name]['handle'].done for input_name in stage['inputs'])]
+                for stage in ready:
+                    pending.remove(stage)
+                    if not stage['main_thread']:
+                        running[executor.submit(self._call, stage)] = stage
+                    # end_if
+                # for
+                main_thread_stages = [stage for stage in ready if stage['main_thread']]
+                if len(main_thread_stages) > 0:
+                    # Run one main-thread stage, then look again for stages that have become ready
+                    stage = main_thread_stages[0]
+                    for other in main_thread_stages[1:]:
+                        pending.insert(0, other)
+                    # for
+                    try:
+                        stage['handle'].value = self._call(stage)
+                        stage['handle'].done = True
+                    except BaseException as e:
+                        error = e
+                    # try/except
+                    continue
+                # end_if
+                if len(running) == 0:
+                    if error is not None or len(pending) == 0:
+                        break
+                    # end_if
+                    raise RuntimeError("Stages cannot be run (cyclic inputs?): " + ', '.join(stage['name'] for stage in pending))
+                # end_if
+                done, not_done = concurrent.futures.wait(list(running.keys()), return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    try:
+                        stage['handle'].value = future.result()
+                        stage['handle'].done = True
+                    except BaseException as e:
+                        if error is None:
+                            error = e
+                        # end_if
+                    # try/except
+                # for
+                if error is not None:
+                    pending = []
+                # end_if
+            # while
+        finally:
+            executor.shutdown(wait=True)
+        # try/finally
+        if error is not None:
+            raise error
+        # end_if
+        retval = {}
+        for stage in self.stages:
+            retval[stage['name']] = stage['handle'].value
+        # for
+        return retval
+    # def run()
+
+    # schedule: Compute the earliest start and finish time of each stage, given its (estimated) duration,
+    #           and the critical path (assuming that every stage can start as soon as its inputs are complete)
+    #
+    # Parameter: durations - (optional) dict mapping stage name to duration in seconds; stages not in it take 1.0
+    # Return value: tuple of (dict mapping stage name to (start, finish) tuple, list of the names of the stages
+    #               on the critical path, in order)
+    #
+    def schedule(self, durations=None):
+        durations = durations if durations is not None else {}
+        times = {}
+        # Stages may only name earlier stages as inputs, so the order in which they were added is a topological order
+        for stage in self.stages:
+            start = max([times[input_name][1] for input_name in stage['inputs']] + [0.0])
+            times[stage['name']] = (start, start + durations.get(stage['name'], 1.0))
+        # for
+        critical_path = []
+        if len(self.stages) > 0:
+            name = max(self.stages, key=lambda stage: times[stage['name']][1])['name']
+            while name is not None:
+                critical_path.insert(0, name)
+                inputs = self.stages_by_name[name]['inputs']
+                name = max(inputs, key=lambda input_name: times[input_name][1]) if len(inputs) > 0 else None
+            # while
+        # end_if
+        return (times, critical_path)
+    # def schedule()
+
+    # dry_run: Return a description of the graph, without running it (see above)
+    #
+    # Parameter: durations - (optional) see schedule
+    # Return value: list of lines
+    #
+    def dry_run(self, durations=None):
+        times, critical_path = self.schedule(durations)
+        width = max([len(stage['name']) for stage in self.stages] + [0])
+        retval = []
+        for stage in sorted(self.stages, key=lambda stage: times[stage['name']][0]):
+            name = stage['name']
+            retval.append(('* ' if name in critical_path else '  ') + name.ljust(width) + ('%8.2f' % times[name][0]) + ' -' + ('%8.2f' % times[name][1]) +
+                          ' s' + (' [main thread]' if stage['main_thread'] else '') +
+                          ('  <- ' + ', '.join(stage['inputs']) if len(stage['inputs']) > 0 else ''))
+        # for
+        finish = max([t[1] for t in times.values()] + [0.0])
+        retval.append('Critical path (' + ('%.2f' % finish) + ' s): ' + ' -> '.join(critical_path))
+        return retval
+    # def dry_run()
+# class PipelineGraph
+
+# durations_from_metrics: Return the duration of each stage recorded in a metrics record (see pipeline_metrics.py)
+#
+# Parameter: metrics_path - full path of the metrics record
+# Return value: dict mapping stage name to wall-clock seconds per call; empty if there is no such record
+#
+def durations_from_metrics(metrics_path):
+    if not os.path.exists(metrics_path):
+        return {}
+    # end_if
+    with open(metrics_path, 'r') as f:
+        record = json.load(f)
+    # with
+    retval = {}
+    for name, stage in record.get('stages', {}).items():
+        retval[name] = stage['wall_s'] / max(stage['calls'], 1)
+    # for
+    return retval
+# def durations_from_metrics()
@@ -0,0 +1,221 @@
+# pipeline_logging.py - Leveled, buffered, rate-limited progress messages for the TMC conflation pipeline.
+#
+# Every call to arcpy.AddMessage is a synchronous call into the geoprocessing framework, which writes
+# to the geoprocessing message window (or the tool's result); issuing one per TMC, or per record, is
+# a measurable share of the run time of a statewide run. Messages are therefore:
+#     1. leveled - each message has a level (DEBUG, INFO, WARNING, or ERROR), and messages below the
+#        current level are discarded without being formatted (see enabled). Per-row messages are
+#        logged at DEBUG, which is off by default; summary lines are logged at INFO.
+#     2. buffered - messages are accumulated, and written as a single multi-line message when the
+#        buffer fills, when flush_interval seconds have passed since the last write, when a WARNING
+#        or ERROR is logged, or when flush is called (e.g., at the end of a script).
+#     3. rate-limited - at most max_lines_per_interval DEBUG/INFO lines are written per flush_interval;
+#        any more are dropped, and a single line noting how many were dropped is written in their place.
+#        WARNING and ERROR messages are never dropped.
+#
+# The level is INFO unless set by calling set_level, or by setting the TMC_LOG_LEVEL environment variable
+# (e.g., to DEBUG) before running a script; the environment variable is inherited by the worker processes
+# of batch_generate_tmc_events.py. Messages are written with arcpy.AddMessage/AddWarning/AddError when arcpy
+# is present, and printed otherwise.
+#
+# Messages may be logged from any thread (e.g., by the stages run by pipeline_dag.py), but, as arcpy is not
+# thread-safe, they are written only from the main thread: a flush in any other thread is deferred until
+# the main thread next logs a message, or calls flush.
+
+import atexit
+import os
+import sys
+import threading
+import time
+
+try:
+    import arcpy
+    arcpy_present = True
+except:
+    arcpy_present = False
+# end_try_except
+
+# Levels
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+level_names = { 'DEBUG' : DEBUG, 'INFO' : INFO, 'WARNING' : WARNING, 'ERROR' : ERROR }
+
+# parse_level: Return the level named by a string (e.g., 'DEBUG' or '10'), or default if it names no level
+#
+def parse_level(s, default=INFO):
+    if s is None:
+        return default
+    # end_if
+    s = s.strip().upper()
+    if s in level_names:
+        return level_names[s]
+    elif s.isdigit():
+        return int(s)
+    # end_if
+    return default
+# def parse_level()
+
+# write_message: Write a (possibly multi-line) message at the given level, immediately
+#
+def write_message(level, msg):
+    if arcpy_present:
+        if level >= ERROR:
+            arcpy.AddError(msg)
+        elif level >= WARNING:
+            arcpy.AddWarning(msg)
+        else:
+            arcpy.AddMessage(msg)
+        # end_if
+    else:
+        print(msg)
+        sys.stdout.flush()
+    # end_if
+# def write_message()
+
+# PipelineLogger: Leveled, buffered, rate-limited logger (see above)
+#
+class PipelineLogger(object):
+    # __init__: Create a logger
+    #
+    # Parameters: level - (optional) minimum level of the messages written; defaults to TMC_LOG_LEVEL, or INFO
+    #             flush_interval - (optional) maximum number of seconds for which a message is held in the buffer
+    #             max_buffered_lines - (optional) number of lines at which the buffer is flushed
+    #             max_lines_per_interval - (optional) maximum number of DEBUG/INFO lines written per flush_interval
+    #             write_fn - (optional) function(level, msg) by which messages are written; defaults to write_message
+    #
+    def __init__(self, level=None, flush_interval=2.0, max_buffered_lines=100, max_lines_per_interval=500, write_fn=None):
+        self.level = level if level is not None else parse_level(os.environ.get('TMC_LOG_LEVEL'))
+        self.flush_interval = flush_interval
+        self.max_buffered_lines = max_buffered_lines
+        self.max_lines_per_interval = max_lines_per_interval
+        self.write_fn = write_fn if write_fn is not None else write_message
+        # Buffered (level, line) tuples
+        self.buffer = []
+        self.last_flush = time.time()
+        # Start of the current rate-limiting interval, and the number of lines logged and dropped in it
+        self.interval_start = self.last_flush
+        self.interval_lines = 0
+        self.dropped_lines = 0
+        self.lock = threading.RLock()
+    # def __init__()
+
+    # enabled: Return True if messages at the given level are written; used to avoid formatting messages that would be discarded
+    #
+    def enabled(self, level):
+        return level >= self.level
+    # def enabled()
+
+    # log: Log a message at the given level
+    #
+    def log(self, level, msg):
+        if level < self.level:
+            return
+        # end_if
+        with self.lock:
+            now = time.time()
+            if now - self.interval_start >= self.flush_interval:
+                self._end_interval(now)
+            # end_if
+            if level < WARNING:
+                if self.interval_lines >= self.max_lines_per_interval:
+                    self.dropped_lines += 1
+                    return
+                # end_if
+                self.interval_lines += 1
+            else:
+                # Keep the note of any dropped lines in order with the warning
+                self._note_dropped_lines()
+            # end_if
+            self.buffer.append((level, msg))
+            if level >= WARNING or len(self.buffer) >= self.max_buffered_lines or now - self.last_flush >= self.flush_interval:
+                self.flush()
+            # end_if
+        # with
+    # def log()
+
+    def debug(self, msg):
+        self.log(DEBUG, msg)
+    # def debug()
+
+    def info(self, msg):
+        self.log(INFO, msg)
+    # def info()
+
+    def warning(self, msg):
+        self.log(WARNING, msg)
+    # def warning()
+
+    def error(self, msg):
+        self.log(ERROR, msg)
+    # def error()
+
+    # _note_dropped_lines: Buffer a line noting the number of lines dropped since the last such note, if any
+    #
+    def _note_dropped_lines(self):
+        if self.dropped_lines > 0:
+            self.buffer.append((INFO, "... " + str(self.dropped_lines) + " message(s) suppressed."))
+            self.dropped_lines = 0
+        # end_if
+    # def _note_dropped_lines()
+
+    # _end_interval: End the current rate-limiting interval
+    #
+    def _end_interval(self, now):
+        self._note_dropped_lines()
+        self.interval_start = now
+        self.interval_lines = 0
+    # def _end_interval()
+
+    # flush: Write the buffered messages; consecutive messages at the same level are written as a single message.
+    #        Deferred if called in a thread other than the main thread (see above).
+    #
+    def flush(self):
+        if threading.current_thread() is not threading.main_thread():
+            return
+        # end_if
+        with self.lock:
+            self._note_dropped_lines()
+            buffer = self.buffer
+            self.buffer = []
+            self.last_flush = time.time()
+        # with
+        i = 0
+        while i < len(buffer):
+            level = buffer[i][0]
+            j = i
+            while j < len(buffer) and buffer[j][0] == level:
+                j += 1
+            # while
+            self.write_fn(level, '\n'.join([line for (line_level, line) in buffer[i:j]]))
+            i = j
+        # while
+    # def flush()
+# class PipelineLogger
+
+# The logger shared by the modules of the pipeline
+logger = PipelineLogger()
+
+# get_logger: Return the logger shared by the modules of the pipeline
+#
+def get_logger():
+    return logger
+# def get_logger()
+
+# set_level: Set the level of the shared logger
+#
+# Parameter: level - a level, or the name of one (e.g., 'DEBUG')
+#
+def set_level(level):
+    logger.level = level if isinstance(level, int) else parse_level(level, logger.level)
+# def set_level()
+
+# flush: Write any messages buffered by the shared logger
+#
+def flush():
+    logger.flush()
+# def flush()
+
+# Messages still buffered when the interpreter exits are written
+atexit.register(flush)
@@ -0,0 +1,249 @@
+# pipeline_metrics.py - Per-stage timing and counter instrumentation for the TMC conflation pipeline.
+#
+# A PipelineMetrics object accumulates, for each named stage of a run (e.g., the processing of one route
+# pair by generate_tmc_events_for_arterials.py):
+#     1. the wall-clock and CPU time spent in it
+#     2. the number of times it was performed
+#     3. the number of rows input to, and output by, it (when these are given)
+# together with any named counters (e.g., the number of zero-length TMC events discarded) and values
+# (e.g., the number of "problem" TMCs), and the peak memory use of the process.
+#
+# A stage is timed either by bracketing it with calls to start and end, which suits the straight-line
+# code of generate_tmc_events_for_arterials.py, or by passing a function performing it to time.
+# When the run is finished, its metrics are written as a single JSON record; a directory of these
+# records (one per route pair) can then be read back with load_records.
+#
+# Stages may be timed concurrently, from several threads (see pipeline_dag.py), so the CPU time of a stage is
+# that of the thread performing it (stage_cpu_time), rather than that of the whole process, which would include
+# the CPU time of every other stage running at the same time; the CPU time of the run as a whole is that of the
+# process. A stage must therefore be started and ended by the same thread. (CPU time spent on behalf of a stage
+# by other threads, e.g., those of a multi-threaded library, is not counted in it.) The records of the stages,
+# and the counters and values, are updated under a lock, as they may be from any thread.
+
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import arcpy
+    arcpy_present = True
+except:
+    arcpy_present = False
+# end_try_except
+
+# peak_memory_bytes: Return the peak memory use (resident set size / working set) of this process, in bytes,
+#                    or None if it cannot be determined
+#
+def peak_memory_bytes():
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS, and in kilobytes elsewhere
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        pass
+    # try/except
+    try:
+        import ctypes
+        from ctypes import wintypes
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+        # class PROCESS_MEMORY_COUNTERS
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(PROCESS_MEMORY_COUNTERS)
+        GetCurrentProcess = ctypes.windll.kernel32.GetCurrentProcess
+        GetCurrentProcess.restype = wintypes.HANDLE
+        if ctypes.windll.psapi.GetProcessMemoryInfo(GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+        # end_if
+    except Exception:
+        pass
+    # try/except
+    return None
+# def peak_memory_bytes()
+
+# stage_cpu_time: Return the CPU time of the calling thread, in seconds, where this can be determined
+#                 (Python 3.7 and later), and otherwise that of the process
+#
+stage_cpu_time = time.thread_time if hasattr(time, 'thread_time') else time.process_time
+
+# table_row_count: Return the number of rows in a table (or feature class, or layer / table view), using arcpy
+#
+def table_row_count(table):
+    return int(arcpy.GetCount_management(table).getOutput(0))
+# def table_row_count()
+
+# PipelineMetrics: The metrics of one run of the pipeline
+#
+class PipelineMetrics(object):
+    # __init__: Begin recording the metrics of a run
+    #
+    # Parameter: attributes - (optional) dict of attributes identifying the run, e.g., { 'route_id' : 'SR9 EB' }
+    #
+    def __init__(self, attributes=None):
+        self.attributes = dict(attributes) if attributes is not None else {}
+        self.stages = {}
+        self.stage_order = []
+        self.counters = {}
+        self.values = {}
+        self._open_stages = {}
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self._cpu_started = time.process_time()
+        self.finished = None
+        self._cpu_finished = None
+    # def __init__()
+
+    # _stage: Return the record for a stage, creating it if necessary; the caller holds self._lock
+    #
+    def _stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = { 'wall_s' : 0.0, 'cpu_s' : 0.0, 'calls' : 0, 'rows_in' : None, 'rows_out' : None }
+            self.stage_order.append(name)
+        # end_if
+        return self.stages[name]
+    # def _stage()
+
+    # start: Note the start of (an execution of) a stage
+    #
+    # Parameters: name - name of the stage
+    #             rows_in - (optional) number of rows input to the stage
+    #
+    def start(self, name, rows_in=None):
+        with self._lock:
+            stage = self._stage(name)
+            if rows_in is not None:
+                stage['rows_in'] = (stage['rows_in'] or 0) + rows_in
+            # end_if
+            self._open_stages[(name, threading.get_ident())] = (time.time(), stage_cpu_time())
+        # with
+    # def start()
+
+    # end: Note the end of (an execution of) a stage
+    #
+    # Parameters: name - name of the stage
+    #             rows_out - (optional) number of rows output by the stage
+    #             rows_in - (optional) number of rows input to the stage, if not known when it was started
+    #
+    def end(self, name, rows_out=None, rows_in=None):
+        wall_end = time.time(); cpu_end = stage_cpu_time()
+        with self._lock:
+            wall_start, cpu_start = self._open_stages.pop((name, threading.get_ident()))
+            stage = self._stage(name)
+            stage['wall_s'] += wall_end - wall_start
+            stage['cpu_s'] += cpu_end - cpu_start
+            stage['calls'] += 1
+            if rows_in is not None:
+                stage['rows_in'] = (stage['rows_in'] or 0) + rows_in
+            # end_if
+            if rows_out is not None:
+                stage['rows_out'] = (stage['rows_out'] or 0) + rows_out
+            # end_if
+        # with
+    # def end()
+
+    # time: Perform a stage, timing it
+    #
+    # Parameters: name - name of the stage
+    #             fn - function of no arguments performing the stage; its value is returned
+    #             rows_in - (optional) number of rows input to the stage
+    #             rows_out_fn - (optional) function returning the number of rows output, given the value of fn()
+    #
+    def time(self, name, fn, rows_in=None, rows_out_fn=None):
+        self.start(name, rows_in)
+        retval = fn()
+        self.end(name, rows_out_fn(retval) if rows_out_fn is not None else None)
+        return retval
+    # def time()
+
+    # count: Add to a named counter
+    #
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+        # with
+    # def count()
+
+    # set_value: Record a named value
+    #
+    def set_value(self, name, value):
+        with self._lock:
+            self.values[name] = value
+        # with
+    # def set_value()
+
+    # finish: Note the end of the run
+    #
+    def finish(self):
+        self.finished = time.time()
+        self._cpu_finished = time.process_time()
+    # def finish()
+
+    # stage_report: Return the stage records, in the order in which the stages were first performed
+    #
+    def stage_report(self):
+        retval = {}
+        for name in self.stage_order:
+            retval[name] = self.stages[name]
+        # for
+        return retval
+    # def stage_report()
+
+    # to_dict: Return the metrics of the run as a dict (a JSON-serializable record)
+    #
+    def to_dict(self):
+        finished = self.finished if self.finished is not None else time.time()
+        cpu_finished = self._cpu_finished if self._cpu_finished is not None else time.process_time()
+        retval = dict(self.attributes)
+        retval['started'] = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started))
+        retval['wall_s'] = finished - self.started
+        retval['cpu_s'] = cpu_finished - self._cpu_started
+        retval['peak_memory_bytes'] = peak_memory_bytes()
+        with self._lock:
+            retval['stages'] = dict((name, dict(stage)) for name, stage in self.stage_report().items())
+            retval['counters'] = dict(self.counters)
+            retval['values'] = dict(self.values)
+        # with
+        return retval
+    # def to_dict()
+
+    # write: Write the metrics of the run, as a JSON record, to a file
+    #
+    # Parameters: out_dir - full path of directory into which the file is written; created if it does not exist
+    #             out_file - name of the file
+    #
+    def write(self, out_dir, out_file):
+        if not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+        # end_if
+        out_fn = os.path.join(out_dir, out_file)
+        tmp_fn = out_fn + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_fn, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        # with
+        os.replace(tmp_fn, out_fn)
+    # def write()
+# class PipelineMetrics
+
+# load_records: Read the metrics records written to a directory (e.g., one per route pair)
+#
+# Parameter: metrics_dir - full path of the directory
+# Return value: list of dicts
+#
+def load_records(metrics_dir):
+    retval = []
+    for file_name in sorted(os.listdir(metrics_dir)):
+        if file_name.endswith('_metrics.json'):
+            with open(os.path.join(metrics_dir, file_name), 'r') as f:
+                retval.append(json.load(f))
+            # with
+        # end_if
+    # for
+    return retval
+# def load_records()
@@ -0,0 +1,259 @@
+# process_csv_columnar.py - Vectorized (NumPy) alternative to process_csv_file.main_routine.
+#
+# Loads one or more intermediate CSV files (i.e., the *_events_output.csv files produced by
+# phase 1 of generate_tmc_events_for_arterials.py) into typed columns, and computes the
+# per-TMC summary record for EVERY TMC in a single batch, using segment-reduce operations
+# over the records sorted by (input file, TMC ID, from_meas).
+#
+# The output records, and the list of "problem" TMCs, are the same as those produced by
+# process_csv_file.process_one_tmc_id: the records for each TMC are visited in the same order,
+# and the length-weighted sums are accumulated in the same order, so that the results of the
+# rounding to a multiple of 5 MPH (speed limit) and of math.ceil (number of lanes) are identical.
+#
+# The input files may also be typed, columnar intermediate files (see intermediate_format.py),
+# which are memory-mapped rather than parsed.
+#
+# This module depends upon numpy, in addition to the modules process_csv_file.py depends upon.
+
+import csv
+import math
+import os
+import numpy as np
+import intermediate_format
+import process_csv_file
+from process_csv_file import report, log
+
+# Names of the string-valued columns loaded from the intermediate CSV file
+string_column_names = ['tmc', 'tmctype', 'route_id', 'roadnum', 'direction', 'firstnm']
+# Names and types of the numeric columns loaded from the intermediate CSV file
+numeric_column_types = { 'town_id' : np.int64, 'speed_lim' : np.int64, 'num_lanes' : np.int64,
+                         'from_meas' : np.float64, 'to_meas' : np.float64, 'calc_len' : np.float64 }
+
+# load_csv_columns: Read an intermediate CSV file into a dict of typed NumPy arrays
+#
+# Parameters: in_csv_dir - full path of directory containing input CSV file
+#             in_csv_file - name of input CSV file
+# Return value: dict of NumPy arrays, keyed by column name
+#
+def load_csv_columns(in_csv_dir, in_csv_file):
+    column_names = string_column_names + list(numeric_column_types.keys())
+    raw = {}
+    for name in column_names:
+        raw[name] = []
+    # for
+    open_fn = os.path.join(in_csv_dir, in_csv_file)
+    with open(open_fn) as csvfile:
+        reader = csv.reader(csvfile)
+        header = next(reader)
+        col_ixs = [(name, header.index(name)) for name in column_names]
+        for row in reader:
+            for name, ix in col_ixs:
+                raw[name].append(row[ix])
+            # for
+        # for
+    # with
+    retval = {}
+    for name in string_column_names:
+        retval[name] = np.array(raw[name], dtype=object)
+    # for
+    for name, dtype in numeric_column_types.items():
+        retval[name] = np.array(raw[name], dtype=dtype)
+    # for
+    return retval
+# def load_csv_columns()
+
+# load_columns: Read 1..N intermediate files and load them into a dict of typed NumPy arrays.
+#               Each file may be either a CSV file or a typed, columnar intermediate file
+#               (see intermediate_format.py), which is memory-mapped rather than parsed.
+#               The index (in in_csv_files) of the file from which each record was read is
+#               recorded in the 'source' column.
+#
+# Parameters: in_csv_dir - full path of directory containing input files
+#             in_csv_files - list of names of input files
+# Return value: dict of NumPy arrays, keyed by column name
+#
+def load_columns(in_csv_dir, in_csv_files):
+    column_names = string_column_names + list(numeric_column_types.keys())
+    per_file = []
+    for in_csv_file in in_csv_files:
+        if intermediate_format.is_intermediate_file(in_csv_file):
+            per_file.append(intermediate_format.load_columns(in_csv_dir, in_csv_file))
+        else:
+            per_file.append(load_csv_columns(in_csv_dir, in_csv_file))
+        # end_if
+    # for
+    # A single memory-mapped file is used as is, without copying its columns
+    if len(per_file) == 1:
+        retval = dict(per_file[0])
+    else:
+        retval = {}
+        for name in column_names:
+            retval[name] = np.concatenate([cols[name] for cols in per_file]) if len(per_file) > 0 else np.array([])
+        # for
+        for name, dtype in numeric_column_types.items():
+            retval[name] = retval[name].astype(dtype, copy=False)
+        # for
+    # end_if
+    retval['source'] = np.repeat(np.arange(len(per_file), dtype=np.int64), [len(cols['tmc']) for cols in per_file])
+    return retval
+# def load_columns()
+
+# segment_sum: Sum the values in each of a set of contiguous segments of an array.
+#
+# Parameters: values - 1-D array of float values
+#             starts - array of the index of the first element of each segment
+#             sizes - array of the number of elements in each segment
+# Return value: array of per-segment sums
+#
+# Note: The elements of each segment are added in order, starting from 0.0, as is done by the
+#       pydash.collections.reduce_ calls in process_csv_file.process_one_tmc_id. (np.add.reduceat
+#       is NOT used, because it uses pairwise summation, whose results can differ in the last bit.)
+#       The loop below runs once per element of the LARGEST segment, not once per segment.
+#
+def segment_sum(values, starts, sizes):
+    sums = np.zeros(len(starts), dtype=np.float64)
+    max_size = sizes.max() if len(sizes) > 0 else 0
+    for k in range(max_size):
+        live = sizes > k
+        sums[live] += values[starts[live] + k]
+    # for
+    return sums
+# def segment_sum()
+
+# aggregate_columns: Compute the summary record for each (input file, TMC ID) in the given columns
+#
+# Parameter: cols - dict of NumPy arrays, as returned by load_columns
+# Return value: tuple of (1) list of lists of summary dicts, one list per input file, each list
+#               sorted on from_meas; the summary dicts have the same fields and values as those
+#               returned by process_csv_file.process_one_tmc_id; and (2) list of problem TMCs
+#
+def aggregate_columns(cols):
+    num_sources = (cols['source'].max() + 1) if len(cols['source']) > 0 else 0
+    problem_tmcs = []
+    if len(cols['tmc']) == 0:
+        return [[] for i in range(num_sources)], problem_tmcs
+    # end_if
+
+    # Sort on (source, tmc, from_meas); np.lexsort is stable, so records with the same
+    # from_meas value remain in the order in which they were read, as in process_one_tmc_id.
+    tmc_uniq, tmc_codes = np.unique(cols['tmc'], return_inverse=True)
+    order = np.lexsort((cols['from_meas'], tmc_codes, cols['source']))
+    key = cols['source'][order] * len(tmc_uniq) + tmc_codes[order]
+    starts = np.flatnonzero(np.concatenate(([True], key[1:] != key[:-1])))
+    sizes = np.diff(np.concatenate((starts, [len(order)])))
+    ends = starts + sizes - 1
+
+    from_meas = cols['from_meas'][order]
+    to_meas = cols['to_meas'][order]
+    calc_len = cols['calc_len'][order]
+    speed_lim = cols['speed_lim'][order]
+    num_lanes = cols['num_lanes'][order]
+    town_id = cols['town_id'][order]
+
+    # Group number of each record
+    group_ix = np.repeat(np.arange(len(starts)), sizes)
+
+    # Total length
+    total_length = segment_sum(calc_len, starts, sizes)
+
+    # Speed limit: exclude records for which 'speed_lim' is 0 or 99 (see process_one_tmc_id)
+    sl_mask = (speed_lim != 0) & (speed_lim != 99)
+    sl_total_length = segment_sum(np.where(sl_mask, calc_len, 0.0), starts, sizes)
+    sl_count = segment_sum(sl_mask.astype(np.float64), starts, sizes)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sl_partial = speed_lim.astype(np.float64) * (calc_len / sl_total_length[group_ix])
+    # with
+    speed_limit = segment_sum(np.where(sl_mask, sl_partial, 0.0), starts, sizes)
+
+    # Number of lanes: exclude records for which 'num_lanes' is 0 (see process_one_tmc_id)
+    nl_mask = num_lanes != 0
+    nl_total_length = segment_sum(np.where(nl_mask, calc_len, 0.0), starts, sizes)
+    nl_count = segment_sum(nl_mask.astype(np.float64), starts, sizes)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        nl_partial = num_lanes.astype(np.float64) * (calc_len / nl_total_length[group_ix])
+    # with
+    num_lanes_wtd = segment_sum(np.where(nl_mask, nl_partial, 0.0), starts, sizes)
+
+    # Sorted list of unique town_ids for each group
+    max_town_id = town_id.max() + 1
+    group_town_pairs = np.unique(group_ix * max_town_id + town_id)
+    pair_group_ix = group_town_pairs // max_town_id
+    pair_town_id = group_town_pairs % max_town_id
+    pair_starts = np.searchsorted(pair_group_ix, np.arange(len(starts) + 1))
+
+    first = order[starts]
+    round_to_multiple_of_5 = lambda x: 5 * round(x/5)
+    retval = [[] for i in range(num_sources)]
+    for g in range(len(starts)):
+        rec_ix = first[g]
+        tmc_id = cols['tmc'][rec_ix]
+        summary = {}
+        for name in string_column_names:
+            summary[name] = cols[name][rec_ix]
+        # for
+        summary['from_meas'] = float(from_meas[starts[g]])
+        summary['to_meas'] = float(to_meas[ends[g]])
+        summary['length'] = float(total_length[g])
+        if sl_count[g] == 0:
+            log.debug("    No usable speed limit records for TMC " + tmc_id)
+            summary['speed_limit'] = -1
+            problem_tmcs.append(tmc_id)
+        else:
+            summary['speed_limit'] = round_to_multiple_of_5(float(speed_limit[g]))
+        # end_if
+        if nl_count[g] == 0:
+            log.debug("    No usable number of lanes records for TMC " + tmc_id)
+            summary['num_lanes'] = -1
+            problem_tmcs.append(tmc_id)
+        else:
+            summary['num_lanes'] = math.ceil(float(num_lanes_wtd[g]))
+        # end_if
+        town_ids = [int(x) for x in pair_town_id[pair_starts[g]:pair_starts[g+1]]]
+        summary['towns'] = process_csv_file.town_ids_to_town_names(town_ids)
+        retval[cols['source'][rec_ix]].append(summary)
+    # for
+
+    for summaries in retval:
+        summaries.sort(key=lambda x : x['from_meas'])
+    # for
+    return retval, problem_tmcs
+# def aggregate_columns()
+
+# batch_main_routine: Given 1..N input CSV files with 1..N records per TMC ID, generate
+#                     the corresponding output CSV files with a single record per TMC ID,
+#                     processing all the input files in a single batch.
+#
+# Parameters: in_csv_dir - full path of directory containing input CSV files
+#             in_csv_files - list of names of input CSV files
+#             out_csv_dir - full path of directory into which output CSV files are to be written
+#             out_csv_files - list of names of output CSV files, parallel to in_csv_files
+# Return value: list of TMCs for which no usable attribute value(s) were found
+#
+def batch_main_routine(in_csv_dir, in_csv_files, out_csv_dir, out_csv_files):
+    cols = load_columns(in_csv_dir, in_csv_files)
+    report("Loaded " + str(len(cols['tmc'])) + " records from " + str(len(in_csv_files)) + " CSV file(s).")
+    summaries_per_file, problem_tmcs = aggregate_columns(cols)
+    # Files from which no records were read still get an (empty) output CSV file
+    summaries_per_file += [[] for i in range(len(in_csv_files) - len(summaries_per_file))]
+    for out_csv_file, summaries in zip(out_csv_files, summaries_per_file):
+        process_csv_file.write_csv(out_csv_dir, out_csv_file, summaries)
+    # for
+    process_csv_file.problem_tmcs.extend(problem_tmcs)
+    if len(problem_tmcs) > 0:
+        # Written as a single message, so that the list is never broken up (or cut short) by the logger's rate limit
+        report("*** No usable attribute value(s) were found for the following TMCs:\n    " + "\n    ".join(problem_tmcs))
+    # end_if
+    return problem_tmcs
+# def batch_main_routine()
+
+# main_routine: Drop-in replacement for process_csv_file.main_routine, for a single input CSV file
+#
+# Parameters: in_csv_dir - full path of directory containing input CSV file
+#             in_csv_file - name of input CSV file
+#             out_csv_dir - full path of directory into which output CSV file is to be written
+#             out_csv_dir - name out output CSV file
+# Return value: none
+#
+def main_routine(in_csv_dir, in_csv_file, out_csv_dir, out_csv_file):
+    batch_main_routine(in_csv_dir, [in_csv_file], out_csv_dir, [out_csv_file])
+# def main_routine()
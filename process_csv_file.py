@@ -1,13 +1,19 @@
 # Process CSV file produced by tmc_events_for_expressways.py, 
 # producing an output CSV file with one record per TMC. 
 # The input CSV file is expected to have been sorted on from_meas field, in ascending order.
+# It is processed in a single streaming pass if the records for each TMC are contiguous in it;
+# otherwise, its records are first sorted by TMC within a memory budget (see external_sort.py).
 #
 # Ben Krepp 12/27/2019, 12/31/2019, 01/02/2020, 01/07/2020, 01/16/2020, 01/17/2020
 
+import collections
 import csv
 import math
+import os
 import pydash
 import ma_towns
+import pipeline_logging
+import external_sort
 
 # The following is to allow this script to be run stand-alone outside of ArcMap.
 #
@@ -18,26 +24,25 @@ except:
     arcpy_present = False
 # end_try_except
     
+# Messages are written through the (leveled, buffered) logger shared by the pipeline; see pipeline_logging.py
+log = pipeline_logging.get_logger()
+
 def report(msg):
-    if arcpy_present:
-        arcpy.AddMessage(msg)
-    else:
-        print(msg)
-    # end_if
+    log.info(msg)
 # end_def
 
 # Accumulate list of any TMCs for which no usable attribute records were found.
 problem_tmcs = []
 
-# load_csv: Read input CSV file and load it into a list of dicts (i.e., an array of ojbects in JS-speak)
+# iter_csv: Read input CSV file, yielding its records one at a time as dicts.
+#           Only the record currently being read is held in memory.
 #
 # Parameters: in_csv_dir - full path of directory containing input CSV file
 #             in_csv_file - name of input CSV file
-# Return value: list of dicts containing records read from CSV file
+# Return value: generator of dicts containing records read from CSV file
 # 
-def load_csv(in_csv_dir, in_csv_file):
-    open_fn = in_csv_dir + '\\' + in_csv_file
-    retval = []
+def iter_csv(in_csv_dir, in_csv_file):
+    open_fn = os.path.join(in_csv_dir, in_csv_file)
     with open(open_fn) as csvfile:
         reader = csv.DictReader(csvfile)
         for row in reader:
@@ -48,12 +53,89 @@ def load_csv(in_csv_dir, in_csv_file):
             row['from_meas'] = float(row['from_meas'])
             row['to_meas'] = float(row['to_meas'])
             row['calc_len'] = float(row['calc_len'])           
-            retval.append(row)
+            yield row
         # for
      # with
-    return retval
+# def iter_csv()
+
+# Names of the columns of the input CSV file that are used in producing the output
+event_record_fields = ['tmc', 'tmctype', 'route_id', 'roadnum', 'direction', 'firstnm', 
+                       'town_id', 'speed_lim', 'num_lanes', 'from_meas', 'to_meas', 'calc_len']
+
+# EventRecord: Compact (tuple) record holding only the columns of an input CSV record that are used in producing 
+#              the output. Fields can be accessed either as attributes, or by name with get, e.g., rec.get('tmc'),
+#              as for the dicts returned by iter_csv, so that EventRecords can be passed to process_one_tmc_id
+#              (which reads the fields of its records with get). Indexing is that of a tuple.
+#
+class EventRecord(collections.namedtuple('EventRecord', event_record_fields)):
+    __slots__ = ()
+
+    # get: Return the value of the named field
+    #
+    def get(self, name):
+        return getattr(self, name)
+    # def get()
+# class EventRecord
+
+# iter_event_records: Read input CSV file, yielding its records one at a time as EventRecords.
+#                     Only the columns in event_record_fields are read; the numeric ones are converted 
+#                     directly to their typed values, and no dict is built for any row.
+#
+# Parameters: in_csv_dir - full path of directory containing input CSV file
+#             in_csv_file - name of input CSV file
+# Return value: generator of EventRecords
+#
+def iter_event_records(in_csv_dir, in_csv_file):
+    open_fn = os.path.join(in_csv_dir, in_csv_file)
+    with open(open_fn) as csvfile:
+        reader = csv.reader(csvfile)
+        header = next(reader)
+        # Index of each column read, in the order of event_record_fields
+        (tmc_ix, tmctype_ix, route_id_ix, roadnum_ix, direction_ix, firstnm_ix, 
+         town_id_ix, speed_lim_ix, num_lanes_ix, from_meas_ix, to_meas_ix, calc_len_ix) = [header.index(name) for name in event_record_fields]
+        for row in reader:
+            yield EventRecord(row[tmc_ix], row[tmctype_ix], row[route_id_ix], row[roadnum_ix], row[direction_ix], row[firstnm_ix],
+                              int(row[town_id_ix]), int(row[speed_lim_ix]), int(row[num_lanes_ix]),
+                              float(row[from_meas_ix]), float(row[to_meas_ix]), float(row[calc_len_ix]))
+        # for
+    # with
+# def iter_event_records()
+
+# iter_event_record_chunks: Read input CSV file, yielding its records in lists ("chunks") of EventRecords
+#
+# Parameters: in_csv_dir - full path of directory containing input CSV file
+#             in_csv_file - name of input CSV file
+#             chunk_size - maximum number of records in each chunk
+# Return value: generator of lists of EventRecords; only the last list may contain fewer than chunk_size records
+#
+def iter_event_record_chunks(in_csv_dir, in_csv_file, chunk_size=10000):
+    chunk = []
+    for rec in iter_event_records(in_csv_dir, in_csv_file):
+        chunk.append(rec)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+        # end_if
+    # for
+    if len(chunk) > 0:
+        yield chunk
+    # end_if
+# def iter_event_record_chunks()
+
+# load_csv: Read input CSV file and load it into a list of dicts (i.e., an array of ojbects in JS-speak)
+#
+# Parameters: in_csv_dir - full path of directory containing input CSV file
+#             in_csv_file - name of input CSV file
+# Return value: list of dicts containing records read from CSV file
+# 
+def load_csv(in_csv_dir, in_csv_file):
+    return list(iter_csv(in_csv_dir, in_csv_file))
 # def load_csv()
 
+# Fields of the output CSV file, in order
+output_csv_fields = ['tmc', 'tmctype', 'route_id', 'roadnum', 'direction', 'firstnm', \
+                     'from_meas', 'to_meas', 'length', 'speed_limit', 'num_lanes', 'towns']
+
 # write_csv: Write, in CSV format, list of dicts containing data to be output
 #
 # Parameters: out_csv_dir - full path of directory into which output CSV file is to be written
@@ -61,12 +143,19 @@ def load_csv(in_csv_dir, in_csv_file):
 # Return value: none
 #
 def write_csv(out_csv_dir, out_csv_file, output_data):
-    open_fn = out_csv_dir + '\\' + out_csv_file
-    # Note we have to open the CSV file in 'wb' mode on Windows in order to prevent each record being written out with and EXTRA newline.
-    with open(open_fn, 'wb') as csvfile:
-        fieldnames = ['tmc', 'tmctype', 'route_id', 'roadnum', 'direction', 'firstnm', \
-                      'from_meas', 'to_meas', 'length', 'speed_limit', 'num_lanes', 'towns']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+    open_fn = os.path.join(out_csv_dir, out_csv_file)
+    # Under Python 3, the csv module writes to a file opened in text mode; opening it with newline='' likewise
+    # prevents each record being written out with an EXTRA newline on Windows.
+    #
+    # *** Beginning of original code:
+    #
+    # # Note we have to open the CSV file in 'wb' mode on Windows in order to prevent each record being written out with and EXTRA newline.
+    # with open(open_fn, 'wb') as csvfile:
+    #
+    # *** End of original code
+    #
+    with open(open_fn, 'w', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=output_csv_fields)
         writer.writeheader()
         for row in output_data:
             writer.writerow({ 'tmc' : row['tmc'], 'tmctype' : row['tmctype'], 'route_id' : row['route_id'], 'roadnum' : row['roadnum'], 'direction' : row['direction'], \
@@ -76,26 +165,111 @@ def write_csv(out_csv_dir, out_csv_file, output_data):
     # with
 # def write_csv()
 
+# write_csv_stream: Write, in CSV format, the output records yielded by a generator (or any other iterable),
+#                   writing each record as it is produced, rather than collecting them in a list first
+#
+# Parameters: out_csv_dir - full path of directory into which output CSV file is to be written
+#             out_csv_file - name of output CSV file
+#             output_data - iterable of dicts containing data to be output
+# Return value: number of records written
+#
+# Note: The file is written under a temporary name and then renamed, so that it is never seen half-written.
+#
+def write_csv_stream(out_csv_dir, out_csv_file, output_data):
+    open_fn = os.path.join(out_csv_dir, out_csv_file)
+    tmp_fn = open_fn + '.' + str(os.getpid()) + '.tmp'
+    retval = 0
+    with open(tmp_fn, 'w', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=output_csv_fields, extrasaction='ignore')
+        writer.writeheader()
+        for row in output_data:
+            writer.writerow(row)
+            retval += 1
+        # for
+    # with
+    os.replace(tmp_fn, open_fn)
+    return retval
+# def write_csv_stream()
+
 # get_uniq_tmc_ids: Return list of unique TMC IDs in the given list of csv_records
 #
 # Parameter: csv_records - list of dicts from input CSV file
 # Return value: list of unique TMC IDs in the above list
 #
 def get_uniq_tmc_ids(csv_records):
-    tmc_lyst_map_obj = map(lambda x: x['tmc'], csv_records)
+    tmc_lyst_map_obj = map(lambda x: x.get('tmc'), csv_records)
     tmc_lyst = list(tmc_lyst_map_obj)
     tmc_set = set(tmc_lyst)
     uniq_tmc_list = list(tmc_set)
     return uniq_tmc_list
 # def get_uniq_tmc_ids() 
 
+# TmcOrderError: Raised by group_sorted_records when the records for a TMC ID are not contiguous,
+#                i.e., when a TMC ID re-appears after the group of records for it has been closed.
+#                The (first) offending TMC ID is carried in args[0].
+#
+class TmcOrderError(Exception):
+    pass
+# class TmcOrderError
+
+# group_sorted_records: Group a stream of records by TMC ID, assuming the records for each TMC ID are contiguous,
+#                       e.g., because the input CSV file has been sorted on (tmc, from_meas).
+#                       Only the records for one TMC ID are held in memory at a time.
+#
+# Parameter: records - iterable of dicts from input CSV file
+# Return value: generator of lists of dicts, one list per TMC ID, in order of first appearance;
+#               the records in each list are in the order in which they were read
+#
+# Note: Raises TmcOrderError if the records for some TMC ID turn out not to be contiguous.
+#
+def group_sorted_records(records):
+    closed_tmc_ids = set()
+    rec_list = []
+    for rec in records:
+        if len(rec_list) > 0 and rec.get('tmc') != rec_list[0].get('tmc'):
+            closed_tmc_ids.add(rec_list[0].get('tmc'))
+            yield rec_list
+            rec_list = []
+        # end_if
+        if len(rec_list) == 0 and rec.get('tmc') in closed_tmc_ids:
+            raise TmcOrderError(rec.get('tmc'))
+        # end_if
+        rec_list.append(rec)
+    # for
+    if len(rec_list) > 0:
+        yield rec_list
+    # end_if
+# def group_sorted_records()
+
+# group_unsorted_records: Group a stream of records by TMC ID, in a single pass, making no assumption
+#                         about the order of the records. All records are held in memory.
+#
+# Parameter: records - iterable of dicts from input CSV file
+# Return value: generator of lists of dicts, one list per TMC ID, in order of first appearance;
+#               the records in each list are in the order in which they were read
+#
+def group_unsorted_records(records):
+    groups = {}
+    tmc_ids = []
+    for rec in records:
+        if rec.get('tmc') not in groups:
+            groups[rec.get('tmc')] = []
+            tmc_ids.append(rec.get('tmc'))
+        # end_if
+        groups[rec.get('tmc')].append(rec)
+    # for
+    for tmc_id in tmc_ids:
+        yield groups.pop(tmc_id)
+    # for
+# def group_unsorted_records()
+
 # get_uniq_town_ids: Return list of uniqe TOWN_IDs, sorted in ascending order 
 #
 # Parameter: list of dicts from input CSV data
 # Return value: list of unique MassGIS TOWN_IDs in this list of dicts
 #
 def get_uniq_town_ids(rec_list):
-    town_id_lyst_map_obj = map(lambda x: x['town_id'], rec_list)
+    town_id_lyst_map_obj = map(lambda x: x.get('town_id'), rec_list)
     town_id_lyst = list(town_id_lyst_map_obj)
     town_id_set = set(town_id_lyst)
     uniq_town_id_list = list(town_id_set)
@@ -132,28 +306,30 @@ def process_one_tmc_id(rec_list):
     #                   route_id, roadnum, direction, firstnm, 
     #                   towns, town_ids (?), speed_limit, num_lanes
     
-    report("Processing TMC " + rec_list[0]['tmc'] + " : " + str(len(rec_list)) + " records.")
+    if log.enabled(pipeline_logging.DEBUG):
+        log.debug("Processing TMC " + rec_list[0].get('tmc') + " : " + str(len(rec_list)) + " records.")
+    # end_if
     
     # Sort rec_list on from_meas in ascending order
-    pydash.arrays.sort(rec_list,comparator=None,key=lambda x : x['from_meas'],reverse=False)
-    overall_from_meas = rec_list[0]['from_meas']
-    overall_to_meas = rec_list[len(rec_list)-1]['to_meas']
+    pydash.arrays.sort(rec_list,comparator=None,key=lambda x : x.get('from_meas'),reverse=False)
+    overall_from_meas = rec_list[0].get('from_meas')
+    overall_to_meas = rec_list[len(rec_list)-1].get('to_meas')
     
     # Prepare return value
     retval = {}
-    retval['tmc'] = rec_list[0]['tmc']
-    retval['tmctype'] = rec_list[0]['tmctype']
-    retval['route_id'] = rec_list[0]['route_id']
-    retval['roadnum'] = rec_list[0]['roadnum']
-    retval['direction'] = rec_list[0]['direction']
-    retval['firstnm'] = rec_list[0]['firstnm']
+    retval['tmc'] = rec_list[0].get('tmc')
+    retval['tmctype'] = rec_list[0].get('tmctype')
+    retval['route_id'] = rec_list[0].get('route_id')
+    retval['roadnum'] = rec_list[0].get('roadnum')
+    retval['direction'] = rec_list[0].get('direction')
+    retval['firstnm'] = rec_list[0].get('firstnm')
     
     # from_meas and to_meas
     retval['from_meas'] = overall_from_meas
     retval['to_meas'] = overall_to_meas
     
     # Total length
-    total_length = pydash.collections.reduce_(rec_list, lambda total, x: total + x['calc_len'], 0.0)
+    total_length = pydash.collections.reduce_(rec_list, lambda total, x: total + x.get('calc_len'), 0.0)
     retval['length'] = total_length
 
     # Speed limit
@@ -163,17 +339,17 @@ def process_one_tmc_id(rec_list):
     #       event exisits; 99 is an illegal speed limit and is used by MassDOT to indicate "no value".
     #       (MassDOT is currently frowning on using <Null> event values.)
     #
-    sl_rec_list = pydash.collections.filter_(rec_list, lambda rec: rec['speed_lim'] != 0 and rec['speed_lim'] != 99)
-    sl_total_length = pydash.collections.reduce_(sl_rec_list, lambda total, x: total + x['calc_len'], 0.0)   
+    sl_rec_list = pydash.collections.filter_(rec_list, lambda rec: rec.get('speed_lim') != 0 and rec.get('speed_lim') != 99)
+    sl_total_length = pydash.collections.reduce_(sl_rec_list, lambda total, x: total + x.get('calc_len'), 0.0)   
 
     if len(sl_rec_list) == 0:
-        report("    No usable speed limit records for TMC " +  rec_list[0]['tmc']) 
+        log.debug("    No usable speed limit records for TMC " +  rec_list[0].get('tmc')) 
         sl_for_tmc = -1
-        problem_tmcs.append(rec_list[0]['tmc'])
+        problem_tmcs.append(rec_list[0].get('tmc'))
     else:
         speed_limit = 0
         for rec in sl_rec_list:
-            partial_sl = float(rec['speed_lim']) * (rec['calc_len'] / sl_total_length)
+            partial_sl = float(rec.get('speed_lim')) * (rec.get('calc_len') / sl_total_length)
             speed_limit += partial_sl
         # end_for    
         round_to_multiple_of_5 = lambda x: 5 * round(x/5)
@@ -187,17 +363,17 @@ def process_one_tmc_id(rec_list):
     # NOTE: Exclude recors for which 'num_lanes' is 0: 0 indicates a place in which no 'num_lanes'
     #       event exists.
     #
-    nl_rec_list = pydash.collections.filter_(rec_list, lambda rec: rec['num_lanes'] != 0)
-    nl_total_length = pydash.collections.reduce_(nl_rec_list, lambda total, x: total + x['calc_len'], 0.0)
+    nl_rec_list = pydash.collections.filter_(rec_list, lambda rec: rec.get('num_lanes') != 0)
+    nl_total_length = pydash.collections.reduce_(nl_rec_list, lambda total, x: total + x.get('calc_len'), 0.0)
     
     if len(nl_rec_list) == 0:
-        report("    No usable number of lanes records for TMC " +  rec_list[0]['tmc']) 
+        log.debug("    No usable number of lanes records for TMC " +  rec_list[0].get('tmc')) 
         nl_for_tmc = -1
-        problem_tmcs.append(rec_list[0]['tmc'])
+        problem_tmcs.append(rec_list[0].get('tmc'))
     else:   
         num_lanes = 0
         for rec in nl_rec_list:
-            partial_nl = float(rec['num_lanes']) * (rec['calc_len'] / nl_total_length)
+            partial_nl = float(rec.get('num_lanes')) * (rec.get('calc_len') / nl_total_length)
             num_lanes += partial_nl
         # end_for
         nl_for_tmc = math.ceil(num_lanes)
@@ -221,28 +397,53 @@ def process_one_tmc_id(rec_list):
 #             in_csv_file - name of input CSV file
 #             out_csv_dir - full path of directory into which output CSV file is to be written
 #             out_csv_dir - name out output CSV file
+#             sorted_by_tmc - (optional) if True, the records for each TMC ID are expected to be contiguous
+#                             in the input CSV file, and are grouped as they are streamed in; if this turns
+#                             out not to be the case, the input is read again and sorted, as if False.
+#                             If False (the default), records are first sorted by TMC ID with an external
+#                             merge sort, so that the entire input is never held in memory. The intermediate
+#                             file exported by generate_tmc_events_for_arterials.py is sorted on from_meas
+#                             and tmc, and holds the events of both routes of the route pair, so the records
+#                             for each TMC ID are not in general contiguous in it.
+#             sort_memory_budget - (optional) memory budget of that sort, in bytes
 # Return value: none
 #
-def main_routine(in_csv_dir, in_csv_file, out_csv_dir, out_csv_file):
+# Note: Each TMC ID's records are passed to process_one_tmc_id exactly once, in the order in which they
+#       were read. Only the columns that are used are read (see iter_event_records).
+#
+def main_routine(in_csv_dir, in_csv_file, out_csv_dir, out_csv_file, sorted_by_tmc=False, 
+                 sort_memory_budget=external_sort.default_memory_budget):
     global problem_tmcs
-    # List of CSV data loaded - 1 to N records per TMC
-    csv_loaded = []
     # List of processed CSV data - 1 record per TMC, ready for output
     csv_processed = []
-    csv_loaded = load_csv(in_csv_dir, in_csv_file)
-    # Get unique TMC IDs
-    uniq_tmc_ids = get_uniq_tmc_ids(csv_loaded)
-    for tmc_id in uniq_tmc_ids:
-        recs_to_process = pydash.collections.filter_(csv_loaded, lambda x: x['tmc'] == tmc_id)
-        output_rec = process_one_tmc_id(recs_to_process)
-        csv_processed.append(output_rec)
-    # for
+    num_prior_problem_tmcs = len(problem_tmcs)
+    if sorted_by_tmc:
+        try:
+            for recs_to_process in group_sorted_records(iter_event_records(in_csv_dir, in_csv_file)):
+                output_rec = process_one_tmc_id(recs_to_process)
+                csv_processed.append(output_rec)
+            # for
+        except TmcOrderError as e:
+            report("Records for TMC " + e.args[0] + " are not contiguous in " + in_csv_file + "; re-processing after sorting by TMC.")
+            # Discard partial results
+            csv_processed = []
+            del problem_tmcs[num_prior_problem_tmcs:]
+            sorted_by_tmc = False
+        # try/except
+    # end_if
+    if not sorted_by_tmc:
+        # The sort is stable, so the records for each TMC ID remain in the order in which they were read
+        recs_by_tmc = external_sort.sort_records(iter_event_records(in_csv_dir, in_csv_file), lambda rec: rec.tmc, sort_memory_budget)
+        for recs_to_process in group_sorted_records(recs_by_tmc):
+            output_rec = process_one_tmc_id(recs_to_process)
+            csv_processed.append(output_rec)
+        # for
+    # end_if
     pydash.arrays.sort(csv_processed,comparator=None,key=lambda x : x['from_meas'],reverse=False)
     write_csv(out_csv_dir, out_csv_file, csv_processed)
+    report("Processed " + str(len(csv_processed)) + " TMC(s) from " + in_csv_file + ".")
     if len(problem_tmcs) > 0:
-        report("*** No usable attribute value(s) were found for the following TMCs:")
-        for tmc in problem_tmcs:
-            report("    " + tmc)
-        # end_for
+        # Written as a single message, so that the list is never broken up (or cut short) by the logger's rate limit
+        report("*** No usable attribute value(s) were found for the following TMCs:\n    " + "\n    ".join(problem_tmcs))
     # end_if
 # def main_routine()
\ No newline at end of file
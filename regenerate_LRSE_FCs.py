@@ -21,58 +21,32 @@
 #      
 # NOTE (03/23/2020): The above two-pass process is being replaced by the "brute force" approach, described above.
 #
+# NOTE: The per-route geoprocessing loop has been replaced by a native dynamic segmentation engine
+#       (see dynamic_segmentation.py): the records of each LRSE are read once, the polylines of all of them
+#       are cut from the cached LRSN route geometry (see route_geometry_cache.py) in a single batch, and they
+#       are written to a single FC per LRSE, so no Merge step is needed. The original loop is retained,
+#       commented out, at the end of this script.
+#
 # Ben Krepp, attending metaphysician
 # 03/12/2020, 03/16/2020, 3/23/2020
 
+import os
 import arcpy
+import massdot_routes
+import lrse_event_index
+import route_geometry_cache
+import dynamic_segmentation
 
 
 
 # Single (optional) parameter, specifying a file containing a newline-delimited list of MassDOT route_ids.  
 route_list_file_name = arcpy.GetParameterAsText(0)  
+# If no route list file is specified, all arterial routes are processed (see massdot_routes.py)
+route_list = massdot_routes.get_route_list(route_list_file_name)
 if route_list_file_name != '':
-    f = open(route_list_file_name, 'r')
-    s = f.read()
-    route_list = s.split('\n')
     for route_id in route_list:
         arcpy.AddMessage(route_id)
     # for   
-else:
-    route_list = [ 'SR107 NB', 'SR107 SB', 
-                   'SR109 EB', 'SR109 WB', 
-                   'SR114 EB', 'SR114 WB', 
-                   'SR115 NB', 'SR115 SB',
-                   'SR117 EB', 'SR117 WB', 
-                   'SR119 EB', 'SR119 WB', 
-                   'SR123 EB', 'SR123 WB', 
-                   'SR126 NB', 'SR126 SB',
-                   'SR129 EB', 'SR129 WB',
-                   'SR135 EB', 'SR135 SB', 
-                   'SR138 NB', 'SR138 SB', 
-                   'SR139 EB', 'SR139 WB', 
-                   'SR140 EB', 'SR140 WB',
-                   'SR16 EB',  'SR16 WB',
-                   'SR18 NB',  'SR18 SB', 
-                   'SR1A NB',  'SR1A SB',                    
-                   'SR203 EB', 'SR203 WB', 
-                   'SR225 EB', 'SR225 WB',
-                   'SR228 NB', 'SR228 SB', 
-                   'SR27 NB',  'SR27 SB', 
-                   'SR28 NB',  'SR28 SB',
-                   'SR2A EB',  'SR2A WB', 
-                   'SR30 EB',  'SR30 WB', 
-                   'SR37 NB',  'SR37 SB', 
-                   'SR38 NB',  'SR38 SB',
-                   'SR3A NB',  'SR3A SB', 
-                   'SR4 NB',   'SR4 SB',                   
-                   'SR53 NB',  'SR53 SB', 
-                   'SR60 EB',  'SR60 WB', 
-                   'SR62 EB',  'SR62 WB', 
-                   'SR85 NB',  'SR85 SB',
-                   'SR9 EB',   'SR9 WB', 
-                   'SR99 NB',  'SR99 SB',                     
-                   'US1 NB',   'US1 SB', 
-                   'US20 EB',  'US20 WB' ]
 # end_if
 
 # Connection file for read-only connection to ArcGIS 10.6 SDE mpodata.mpodata database
@@ -92,7 +66,7 @@ Speed_Limit_Layer = "Speed_Limit_Layer"
 
 # MassDOT number of travel lanes LRSE - geometry here may be out of sync w.r.t. LRSN_Routes; event table data is assumed to be OK.
 #
-LRSE_Number_Travel_Lanes = sde_mpdata_ro_connection + '\mpodata.mpodata.CTPS_RoadInventory_for_INRIX_2019\mpodata.mpodata.LRSE_Number_Travel_Lanes'
+LRSE_Number_Travel_Lanes = sde_mpodata_ro_connection + '\mpodata.mpodata.CTPS_RoadInventory_for_INRIX_2019\mpodata.mpodata.LRSE_Number_Travel_Lanes'
 # Layer containing data selected from the above
 
 Num_Lanes_Layer = "Num_Lanes_Layer"
@@ -113,36 +87,75 @@ speed_limit_gdb = base_dir + '\\LRSE_Speed_Limit_FC_redux.gdb'
 num_lanes_gdb = base_dir + '\\LRSE_Number_Travel_Lanes_FC_redux.gdb'
 
 
-# Layers for raw MassDOT LRSE Speed Limit FC and raw MassDOT LRSE Number of Travel Lanes FC
-arcpy.MakeFeatureLayer_management(LRSE_Speed_Limit, Speed_Limit_Layer)
-arcpy.MakeFeatureLayer_management(LRSE_Number_Travel_Lanes, Num_Lanes_Layer)
-
-for route_id in route_list:
-    arcpy.AddMessage("Processing " + route_id)
-    
-    MassDOT_route_query_string = "route_id = " + "'" + route_id + "'" 
-    
-    arcpy.AddMessage('MassDOT_route_query_string = ' + MassDOT_route_query_string)
-    
-    normalized_route_id = route_id.replace(' ', '_')    
-    sl_et_name = normalized_route_id + '_sl_events'
-    sl_layer_name = normalized_route_id + '_sl_layer'
-    sl_fc_name = normalized_route_id + '_sl_fc'    
-    nl_et_name = normalized_route_id + '_nl_events'
-    nl_layer_name = normalized_route_id + '_nl_layer'
-    nl_fc_name = normalized_route_id + '_nl_fc'
-      
-    arcpy.AddMessage('    Generating speed limit FC.')
-    arcpy.SelectLayerByAttribute_management(Speed_Limit_Layer, "NEW_SELECTION", MassDOT_route_query_string)
-    arcpy.TableToTable_conversion("Speed_Limit_Layer", speed_limit_events_gdb, sl_et_name)  
-    arcpy.MakeRouteEventLayer_lr(MASSDOT_LRSN_Routes_19Dec2019, "route_id", 
-                                 speed_limit_events_gdb + '\\' + sl_et_name, "route_id LINE from_measure to_measure", sl_layer_name)
-    arcpy.CopyFeatures_management(sl_layer_name, speed_limit_gdb + '\\' + sl_fc_name)
-    
-    arcpy.AddMessage('    Generating number of travel lanes FC.')
-    arcpy.SelectLayerByAttribute_management(Num_Lanes_Layer, "NEW_SELECTION", MassDOT_route_query_string)
-    arcpy.TableToTable_conversion("Num_Lanes_Layer", num_lanes_events_gdb, nl_et_name)
-    arcpy.MakeRouteEventLayer_lr(MASSDOT_LRSN_Routes_19Dec2019, "route_id", 
-                                 num_lanes_events_gdb + '\\' + nl_et_name, "route_id LINE from_measure to_measure", nl_layer_name)                                   
-    arcpy.CopyFeatures_management(nl_layer_name, num_lanes_gdb + '\\' + nl_fc_name )
-# end_for over route_list
\ No newline at end of file
+# Full path of local directory containing the route geometry cache (see route_geometry_cache.py)
+route_geometry_cache_dir = os.path.join(os.path.expanduser('~'), 'conflate-tmcs-and-massdot-arterials', 'route_geometry_cache')
+
+# The LRSEs to be regenerated: (MassDOT LRSE, value fields and their types, name of regenerated FC, regenerated FC GDB)
+# All records of the routes processed are carried through, whatever their to_date.
+# The regenerated FCs are NOT named LRSE_Speed_Limit and LRSE_Number_Travel_Lanes: those FCs in the same GDBs are
+# written by regenerate_LRSE_FCs_for_arterials.py (with the synthesized secondary direction events), and are the
+# ones read by generate_tmc_events_for_arterials.py.
+lrses = [ (LRSE_Speed_Limit, [('speed_lim', 'LONG'), ('op_dir_sl', 'LONG')], 'LRSE_Speed_Limit_regenerated', speed_limit_gdb),
+          (LRSE_Number_Travel_Lanes, [('num_lanes', 'LONG'), ('opp_lanes', 'LONG')], 'LRSE_Number_Travel_Lanes_regenerated', num_lanes_gdb) ]
+date_fields = [('from_date', 'DATE'), ('to_date', 'DATE')]
+
+route_geom_cache = route_geometry_cache.open_cache(MASSDOT_LRSN_Routes_19Dec2019, route_geometry_cache_dir)
+spatial_reference = arcpy.Describe(MASSDOT_LRSN_Routes_19Dec2019).spatialReference
+route_set = set(route_list)
+
+for (lrse, value_fields, fc_name, fc_gdb) in lrses:
+    arcpy.AddMessage("Processing " + fc_name)
+    # The records of the LRSE are read ONCE, and the polylines of the records of all routes are cut from
+    # the cached route geometry in a single batch (see dynamic_segmentation.py), and written to a single FC
+    attribute_fields = date_fields + value_fields
+    records = [rec for rec in lrse_event_index.read_lrse_table(lrse, [field_name for (field_name, field_type) in attribute_fields], None)
+               if rec[0] in route_set]
+    segments = dynamic_segmentation.segment_events(route_geom_cache, [rec[0] for rec in records],
+                                                   [rec[1] if rec[1] is not None else float('nan') for rec in records],
+                                                   [rec[2] if rec[2] is not None else float('nan') for rec in records])
+    num_written = dynamic_segmentation.write_feature_class(fc_gdb, fc_name, segments, records,
+                                                           [('route_id', 'TEXT'), ('from_measure', 'DOUBLE'), ('to_measure', 'DOUBLE')] + attribute_fields,
+                                                           spatial_reference)
+    arcpy.AddMessage('    ' + str(num_written) + ' of ' + str(len(records)) + ' events located; regenerated ' + fc_gdb + '\\' + fc_name)
+# end_for over lrses
+
+route_geom_cache.close()
+
+# *** Beginning of original code: one SelectLayerByAttribute / TableToTable / MakeRouteEventLayer / CopyFeatures
+#     sequence per route and LRSE, each result to be subsequently combined into a single FC using the 'Merge' tool
+#
+# # Layers for raw MassDOT LRSE Speed Limit FC and raw MassDOT LRSE Number of Travel Lanes FC
+# arcpy.MakeFeatureLayer_management(LRSE_Speed_Limit, Speed_Limit_Layer)
+# arcpy.MakeFeatureLayer_management(LRSE_Number_Travel_Lanes, Num_Lanes_Layer)
+#
+# for route_id in route_list:
+#     arcpy.AddMessage("Processing " + route_id)
+#
+#     MassDOT_route_query_string = "route_id = " + "'" + route_id + "'" 
+#
+#     arcpy.AddMessage('MassDOT_route_query_string = ' + MassDOT_route_query_string)
+#
+#     normalized_route_id = route_id.replace(' ', '_')    
+#     sl_et_name = normalized_route_id + '_sl_events'
+#     sl_layer_name = normalized_route_id + '_sl_layer'
+#     sl_fc_name = normalized_route_id + '_sl_fc'    
+#     nl_et_name = normalized_route_id + '_nl_events'
+#     nl_layer_name = normalized_route_id + '_nl_layer'
+#     nl_fc_name = normalized_route_id + '_nl_fc'
+#
+#     arcpy.AddMessage('    Generating speed limit FC.')
+#     arcpy.SelectLayerByAttribute_management(Speed_Limit_Layer, "NEW_SELECTION", MassDOT_route_query_string)
+#     arcpy.TableToTable_conversion("Speed_Limit_Layer", speed_limit_events_gdb, sl_et_name)  
+#     arcpy.MakeRouteEventLayer_lr(MASSDOT_LRSN_Routes_19Dec2019, "route_id", 
+#                                  speed_limit_events_gdb + '\\' + sl_et_name, "route_id LINE from_measure to_measure", sl_layer_name)
+#     arcpy.CopyFeatures_management(sl_layer_name, speed_limit_gdb + '\\' + sl_fc_name)
+#
+#     arcpy.AddMessage('    Generating number of travel lanes FC.')
+#     arcpy.SelectLayerByAttribute_management(Num_Lanes_Layer, "NEW_SELECTION", MassDOT_route_query_string)
+#     arcpy.TableToTable_conversion("Num_Lanes_Layer", num_lanes_events_gdb, nl_et_name)
+#     arcpy.MakeRouteEventLayer_lr(MASSDOT_LRSN_Routes_19Dec2019, "route_id", 
+#                                  num_lanes_events_gdb + '\\' + nl_et_name, "route_id LINE from_measure to_measure", nl_layer_name)                                   
+#     arcpy.CopyFeatures_management(nl_layer_name, num_lanes_gdb + '\\' + nl_fc_name )
+# # end_for over route_list
+#
+# *** End of original code
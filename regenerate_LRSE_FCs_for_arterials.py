@@ -0,0 +1,94 @@
+# regenerate_LRSE_FCs_for_arterials.py - script to re-generate the LRSE speed limit and number of travel lanes
+#                                        feature classes for ARTERIAL routes, from LRSN route geometry and the
+#                                        LRSE event data, in a single pass.
+#
+# This replaces the two-pass process of regenerate_LRSE_FCsForArterialsy_pass_1.py and
+# regenerate_LRSE_FCsForArterialsy_pass_2.py (and the manual Merge steps between them), and completes the
+# "TBD" special processing of the secondary direction of each route left by the latter:
+#     1. The current (to_date IS NULL) events of each LRSE are read ONCE, for all routes.
+#     2. Wherever the secondary direction of an arterial route has no events (i.e., where the road is un-divided,
+#        and MassDOT has coded only the primary direction, with "opposing direction" attributes), events are
+#        synthesized from the opposing direction attributes of the primary direction's events
+#        (see secondary_direction_events.py).
+#     3. The polylines of the events of all routes, coded and synthesized, are cut from the cached route geometry
+#        in a single batch (see dynamic_segmentation.py), and written, with their attributes, to the regenerated
+#        feature class of the LRSE.
+#
+# The regenerated feature classes are written to the "redux" geodatabases read by generate_tmc_events_for_arterials.py.
+# (regenerate_LRSE_FCs.py, which does not synthesize secondary direction events, writes its feature classes under
+# other names, so that it does not overwrite these.)
+#
+# Single (optional) parameter, specifying a file containing a newline-delimited list of MassDOT route_ids;
+# if none is specified, all arterial routes are processed (see massdot_routes.py). Events of routes that are
+# not processed are carried through unchanged.
+
+import os
+import arcpy
+import massdot_routes
+import lrse_event_index
+import route_geometry_cache
+import secondary_direction_events
+import dynamic_segmentation
+import pipeline_logging
+
+log = pipeline_logging.get_logger()
+
+route_list_file_name = arcpy.GetParameterAsText(0)
+route_list = massdot_routes.get_route_list(route_list_file_name)
+route_pairs = massdot_routes.get_route_pairs(route_list)
+log.info(str(len(route_pairs)) + " route pair(s) to be processed.")
+
+# Connection file for read-only connection to ArcGIS 10.6 SDE mpodata.mpodata database
+sde_mpodata_ro_connection = r'\\lindalino\users\Public\Documents\Public ArcGIS\Database Connections\CTPS 10.6.sde'
+
+# MassDOT LRSN_Routes - the route geometry here is assumed to be definitive
+#
+MASSDOT_LRSN_Routes_19Dec2019 = sde_mpodata_ro_connection + '\\mpodata.mpodata.CTPS_RoadInventory_for_INRIX_2019\\mpodata.mpodata.MASSDOT_LRSN_Routes_19Dec2019'
+
+# MassDOT LRSEs - geometry here may be out of sync w.r.t. LRSN_Routes; event data is assumed to be OK.
+#
+LRSE_Speed_Limit_MassDOT = sde_mpodata_ro_connection + '\\mpodata.mpodata.CTPS_RoadInventory_for_INRIX_2019\\mpodata.mpodata.LRSE_Speed_Limit'
+LRSE_Number_Travel_Lanes_MassDOT = sde_mpodata_ro_connection + '\\mpodata.mpodata.CTPS_RoadInventory_for_INRIX_2019\\mpodata.mpodata.LRSE_Number_Travel_Lanes'
+
+# Path to "base directory"
+base_dir = r'\\lilliput\groups\Data_Resources\conflate-tmcs-and-massdot-arterials'
+
+# Full path of local directory containing the route geometry cache (see route_geometry_cache.py)
+route_geometry_cache_dir = os.path.join(os.path.expanduser('~'), 'conflate-tmcs-and-massdot-arterials', 'route_geometry_cache')
+
+# Path to GDBs for the regenerated FCs
+speed_limit_gdb = base_dir + '\\LRSE_Speed_Limit_FC_redux.gdb'
+num_lanes_gdb = base_dir + '\\LRSE_Number_Travel_Lanes_FC_redux.gdb'
+
+# The LRSEs to be regenerated: (MassDOT LRSE, value fields and their types, opposing direction fields,
+#                               name of regenerated FC, regenerated FC GDB)
+lrses = [ (LRSE_Speed_Limit_MassDOT, [('speed_lim', 'LONG'), ('op_dir_sl', 'LONG')],
+           secondary_direction_events.speed_limit_opposing_fields, 'LRSE_Speed_Limit', speed_limit_gdb),
+          (LRSE_Number_Travel_Lanes_MassDOT, [('num_lanes', 'LONG'), ('opp_lanes', 'LONG')],
+           secondary_direction_events.num_lanes_opposing_fields, 'LRSE_Number_Travel_Lanes', num_lanes_gdb) ]
+
+route_geom_cache = route_geometry_cache.open_cache(MASSDOT_LRSN_Routes_19Dec2019, route_geometry_cache_dir)
+spatial_reference = arcpy.Describe(MASSDOT_LRSN_Routes_19Dec2019).spatialReference
+
+for (lrse, value_fields, opposing_fields, name, fc_gdb) in lrses:
+    log.info("Processing " + name)
+    value_field_names = [field_name for (field_name, field_type) in value_fields]
+    records = list(lrse_event_index.read_lrse_table(lrse, value_field_names))
+    all_records, num_synthesized = secondary_direction_events.complete_route_pairs(records, value_field_names, opposing_fields,
+                                                                                   route_geom_cache, route_pairs)
+    log.info("    " + str(len(records)) + " events read; " + str(num_synthesized) + " secondary direction events synthesized.")
+
+    # Write the polylines of the events to the regenerated FC; 'to_date' is retained (as NULL), since the pipeline
+    # selects the current events of the LRSE with "to_date IS NULL"
+    all_records = [rec for rec in all_records if rec[0] is not None and rec[1] is not None and rec[2] is not None]
+    segments = dynamic_segmentation.segment_events(route_geom_cache, [rec[0] for rec in all_records], [rec[1] for rec in all_records],
+                                                   [rec[2] for rec in all_records])
+    num_written = dynamic_segmentation.write_feature_class(fc_gdb, name, segments, [rec[:3] + (None,) + tuple(rec[3:]) for rec in all_records],
+                                                           [('route_id', 'TEXT'), ('from_measure', 'DOUBLE'), ('to_measure', 'DOUBLE'),
+                                                            ('to_date', 'DATE')] + value_fields,
+                                                           spatial_reference)
+    log.info("    " + str(num_written) + " of " + str(len(all_records)) + " events located; regenerated " + fc_gdb + '\\' + name)
+# for
+
+route_geom_cache.close()
+pipeline_logging.flush()
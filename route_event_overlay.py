@@ -0,0 +1,394 @@
+# route_event_overlay.py - Native, in-memory implementation of the ESRI "Overlay Route Events" tool.
+#
+# The event tables overlaid by generate_tmc_events_for_arterials.py are represented here as lists of dicts,
+# one dict per event, as is done for the records of the intermediate CSV file in process_csv_file.py.
+# The overlay is computed separately for each route, by sorting the breakpoints (i.e., the from- and to-measures)
+# of the events of both tables and sweeping over them once; the cost is O(n log n) in the number of events,
+# plus the size of the output.
+#
+# The semantics of the UNION overlay are those of arcpy.OverlayRouteEvents_lr with the "FIELDS" option:
+#     1. Each output event is the maximal stretch of the route over which the same pair of (input event, overlay event)
+#        both apply. Where only an input event (or only an overlay event) applies, the fields from the other table
+#        are given "empty" values: 0 for numeric fields, '' for string fields. Subsequent processing relies on this,
+#        e.g., tmc = '' marks places where no TMC was located and speed_lim = 0 marks places with no speed limit event.
+#     2. The output route_id and measure fields are named by out_event_properties. The route_id and measure fields of
+#        the input event table are replaced by these; the measure fields of the overlay event table are dropped.
+#     3. All other fields of the overlay event table, including its route_id field, are carried through. A field whose
+#        name is already in use gets the suffix '_1'; if that is in use too, further digits are appended. Thus, as in
+#        the ESRI tool, successive overlays produce fields named 'route_id_1', 'route_id_12', ...
+#     4. Zero-length events in either table are dropped with the "NO_ZERO" option. With the "ZERO" option they are
+#        overlaid with the events of the other table that contain their position.
+#
+# An "INTERSECT" overlay, which keeps only the output events to which both an input and an overlay event apply,
+# is also supported.
+#
+# overlay_route_events_multi overlays any number of event tables in a single sweep over all of their breakpoints.
+# Its output is that of overlaying the tables pairwise, in turn, but none of the intermediate tables is produced:
+# each additional table merely adds its breakpoints to the sweep. iter_overlay_route_events_multi yields the same
+# output one route at a time (see streaming_pipeline.py).
+
+# parse_event_properties: Parse an event properties string of the form "route_id LINE from_meas to_meas"
+#
+# Parameter: event_properties - event properties string
+# Return value: tuple of (route_id field name, from-measure field name, to-measure field name)
+#
+def parse_event_properties(event_properties):
+    parts = event_properties.split()
+    if len(parts) != 4 or parts[1].upper() != 'LINE':
+        raise ValueError("Unsupported event properties (only LINE events are supported): " + event_properties)
+    # end_if
+    return (parts[0], parts[2], parts[3])
+# def parse_event_properties()
+
+# unique_field_name: Return a name for a field that does not collide with the names already in use,
+#                    following the field-renaming convention of the ESRI overlay tools
+#
+# Parameters: name - name of the field
+#             names_in_use - collection of names of fields already in use
+# Return value: name, or name + '_1', or name + '_12', or name + '_123', ...
+#
+def unique_field_name(name, names_in_use):
+    if name not in names_in_use:
+        return name
+    # end_if
+    candidate = name + '_1'
+    n = 2
+    while candidate in names_in_use:
+        candidate += str(n)
+        n += 1
+    # while
+    return candidate
+# def unique_field_name()
+
+# empty_value: Return the "empty" value written to a field for which no event applies
+#
+def empty_value(sample_value):
+    if isinstance(sample_value, bool):
+        return False
+    elif isinstance(sample_value, (int, float)):
+        return type(sample_value)(0)
+    elif isinstance(sample_value, str):
+        return ''
+    else:
+        return None
+    # end_if
+# def empty_value()
+
+# event_fields: Return the list of names of the fields of an event table, other than the given ones,
+#               in order of first appearance, together with a dict of the "empty" value of each field
+#
+def event_fields(events, excluded_fields):
+    names = []
+    empties = {}
+    for event in events:
+        for name, value in event.items():
+            if name in excluded_fields:
+                continue
+            # end_if
+            if name not in empties:
+                names.append(name)
+                empties[name] = None
+            # end_if
+            if empties[name] is None and value is not None:
+                empties[name] = empty_value(value)
+            # end_if
+        # for
+    # for
+    return (names, empties)
+# def event_fields()
+
+# group_events_by_route: Group a list of events by route_id
+#
+# Return value: dict mapping each route_id to the list of events on that route
+#
+def group_events_by_route(events, route_field):
+    retval = {}
+    for event in events:
+        retval.setdefault(event[route_field], []).append(event)
+    # for
+    return retval
+# def group_events_by_route()
+
+# sweep_overlay: Overlay 1..N lists of events on the same route by sweeping once over their merged, sorted breakpoints
+#
+# Parameters: extents_lists - list, with one entry per event table, of lists of (from_meas, to_meas) tuples
+#             overlay_type - 'UNION' or 'INTERSECT'
+#             keep_zero - list, with one entry per event table, of booleans: True to overlay the zero-length events
+#                         of the table, False to drop them
+# Return value: list of (from_meas, to_meas, ixs) tuples, one per output event, sorted on (from_meas, to_meas, ixs);
+#               ixs is a tuple with one entry per event table, the index into its extents list of the event
+#               that applies, or None if no event applies (possible only with the 'UNION' overlay type)
+#
+def sweep_overlay(extents_lists, overlay_type, keep_zero):
+    union = overlay_type == 'UNION'
+    num_tables = len(extents_lists)
+    # Breakpoints: (measure, kind, table, index); kind 0 = end of event, 1 = start of event, 2 = zero-length event.
+    breakpoints = []
+    for table, extents in enumerate(extents_lists):
+        for ix, (from_meas, to_meas) in enumerate(extents):
+            lo = min(from_meas, to_meas); hi = max(from_meas, to_meas)
+            if lo == hi:
+                if keep_zero[table]:
+                    breakpoints.append((lo, 2, table, ix))
+                # end_if
+            else:
+                breakpoints.append((lo, 1, table, ix))
+                breakpoints.append((hi, 0, table, ix))
+            # end_if
+        # for
+    # for
+    breakpoints.sort()
+
+    retval = []
+    active = [set() for table in range(num_tables)]
+    # Open runs of combinations of events, mapped to the measure at which each run started
+    open_runs = {}
+    i = 0
+    while i < len(breakpoints):
+        pos = breakpoints[i][0]
+        ends = [[] for table in range(num_tables)]
+        starts = [[] for table in range(num_tables)]
+        points = [[] for table in range(num_tables)]
+        while i < len(breakpoints) and breakpoints[i][0] == pos:
+            _, kind, table, ix = breakpoints[i]
+            (ends, starts, points)[kind][table].append(ix)
+            i += 1
+        # while
+
+        # Zero-length events are overlaid as if the tables had been overlaid pairwise, in turn (see zero_length_combinations)
+        if any(len(p) > 0 for p in points):
+            active_after = [(active[t] - set(ends[t])) | set(starts[t]) for t in range(num_tables)]
+            for combo in zero_length_combinations(active, active_after, starts, points, union):
+                retval.append((pos, pos, combo))
+            # for
+        # end_if
+
+        for table in range(num_tables):
+            active[table].difference_update(ends[table])
+            active[table].update(starts[table])
+        # for
+
+        # Combinations of events that apply from pos onward
+        combos = combinations([list(a) for a in active], union)
+        for combo in list(open_runs.keys()):
+            if combo not in combos:
+                retval.append((open_runs.pop(combo), pos, combo))
+            # end_if
+        # for
+        for combo in combos:
+            if combo not in open_runs:
+                open_runs[combo] = pos
+            # end_if
+        # for
+    # while
+
+    sort_key = lambda x: (x[0], x[1], tuple(-1 if ix is None else ix for ix in x[2]))
+    retval.sort(key=sort_key)
+    return retval
+# def sweep_overlay()
+
+# combinations: Return the set of combinations of events, one (or, with union, possibly None) per table
+#
+# Parameters: ix_lists - list, with one entry per event table, of lists of indices of events
+#             union - True if tables with no event contribute None to the combinations;
+#                     the combination in which every entry is None is never produced
+# Return value: set of tuples of event indices
+#
+def combinations(ix_lists, union):
+    combos = [()]
+    for ixs in ix_lists:
+        if len(ixs) == 0:
+            if not union:
+                return set()
+            # end_if
+            ixs = [None]
+        # end_if
+        combos = [combo + (ix,) for combo in combos for ix in ixs]
+    # for
+    return set(combo for combo in combos if any(ix is not None for ix in combo))
+# def combinations()
+
+# zero_length_combinations: Return the set of combinations of events for the zero-length output events at a breakpoint.
+#
+# Parameters: active_before - list, with one entry per event table, of the set of events that apply just before the breakpoint
+#             active_after - list, with one entry per event table, of the set of events that apply just after the breakpoint
+#             starts - list, with one entry per event table, of the list of events that start at the breakpoint
+#             points - list, with one entry per event table, of the list of zero-length events at the breakpoint
+#             union - True for a 'UNION' overlay, False for an 'INTERSECT' overlay
+# Return value: set of tuples of event indices
+#
+# Note: The result is the same as if the tables had been overlaid pairwise, in turn: at step k, each zero-length
+#       event of table k is overlaid with every output event of the previous step that contains the breakpoint
+#       (i.e., those just before it, those just after it, and the zero-length ones at it), and each zero-length
+#       output event of the previous step is overlaid with the events of table k that contain the breakpoint.
+#
+def zero_length_combinations(active_before, active_after, starts, points, union):
+    zero_combos = set((p,) for p in points[0])
+    for k in range(1, len(points)):
+        containing_k = list(active_before[k]) + starts[k] + points[k]
+        next_combos = set()
+        for combo in zero_combos:
+            if len(containing_k) > 0:
+                for ix in containing_k:
+                    next_combos.add(combo + (ix,))
+                # for
+            elif union:
+                next_combos.add(combo + (None,))
+            # end_if
+        # for
+        if len(points[k]) > 0:
+            rows = combinations([list(a) for a in active_before[:k]], union) | \
+                   combinations([list(a) for a in active_after[:k]], union)
+            for p in points[k]:
+                for combo in rows:
+                    next_combos.add(combo + (p,))
+                # for
+                if len(rows) == 0 and len(zero_combos) == 0 and union:
+                    next_combos.add((None,) * k + (p,))
+                # end_if
+            # for
+        # end_if
+        zero_combos = next_combos
+    # for
+    return zero_combos
+# def zero_length_combinations()
+
+# iter_overlay_route_events_multi: Overlay 1..N event tables in a single pass, as overlay_route_events_multi does,
+#                                  yielding the output events one route at a time rather than returning a list of them.
+#                                  Only the output events of the route currently being overlaid are held in memory.
+#
+# Parameters: as for overlay_route_events_multi
+# Return value: generator of dicts: the output events, in order of route_id and from_meas
+#
+def iter_overlay_route_events_multi(event_tables, event_properties_list, overlay_type, out_event_properties,
+                                    zero_length_events_list, fields_list=None):
+    overlay_type = overlay_type.upper()
+    if overlay_type not in ('UNION', 'INTERSECT'):
+        raise ValueError("Unsupported overlay type: " + overlay_type)
+    # end_if
+    for zero_length_events in zero_length_events_list:
+        if zero_length_events not in ('ZERO', 'NO_ZERO'):
+            raise ValueError("Unsupported zero-length events option: " + zero_length_events)
+        # end_if
+    # for
+    if len(event_tables) != len(event_properties_list) or len(event_tables) != len(zero_length_events_list):
+        raise ValueError("The event tables, event properties, and zero-length events options do not correspond.")
+    # end_if
+    if fields_list is None:
+        fields_list = [None] * len(event_tables)
+    elif len(fields_list) != len(event_tables):
+        raise ValueError("The event tables and their fields do not correspond.")
+    # end_if
+    out_route, out_from, out_to = parse_event_properties(out_event_properties)
+    props = [parse_event_properties(event_properties) for event_properties in event_properties_list]
+
+    # Output fields: (name in event table, name in output event table, empty value) for each event table
+    names_in_use = set([out_route, out_from, out_to])
+    table_fields = []
+    for table, events in enumerate(event_tables):
+        route_field, from_field, to_field = props[table]
+        if table == 0:
+            excluded_fields = (route_field, from_field, to_field, out_route, out_from, out_to)
+        else:
+            excluded_fields = (from_field, to_field)
+        # end_if
+        if fields_list[table] is None:
+            names, empties = event_fields(events, excluded_fields)
+        else:
+            names = [name for (name, empty) in fields_list[table] if name not in excluded_fields]
+            empties = dict(fields_list[table])
+        # end_if
+        fields = []
+        for name in names:
+            out_name = unique_field_name(name, names_in_use)
+            names_in_use.add(out_name)
+            fields.append((name, out_name, empties[name]))
+        # for
+        table_fields.append(fields)
+    # for
+
+    by_route = [group_events_by_route(events, props[table][0]) for table, events in enumerate(event_tables)]
+    route_ids = set()
+    for table_by_route in by_route:
+        route_ids |= set(table_by_route.keys())
+    # for
+    # Routes on which there are no events of some table contribute nothing to an INTERSECT overlay
+    if overlay_type == 'INTERSECT':
+        for table_by_route in by_route:
+            route_ids &= set(table_by_route.keys())
+        # for
+    # end_if
+    keep_zero = [zero_length_events == 'ZERO' for zero_length_events in zero_length_events_list]
+
+    for route_id in sorted(route_ids):
+        route_events = [table_by_route.get(route_id, []) for table_by_route in by_route]
+        extents_lists = []
+        for table, events in enumerate(route_events):
+            route_field, from_field, to_field = props[table]
+            extents_lists.append([(e[from_field], e[to_field]) for e in events])
+        # for
+        for (from_meas, to_meas, ixs) in sweep_overlay(extents_lists, overlay_type, keep_zero):
+            out_event = { out_route : route_id, out_from : from_meas, out_to : to_meas }
+            for table, ix in enumerate(ixs):
+                event = route_events[table][ix] if ix is not None else None
+                for (name, out_name, empty) in table_fields[table]:
+                    out_event[out_name] = event.get(name, empty) if event is not None else empty
+                # for
+            # for
+            yield out_event
+        # for
+    # for
+# def iter_overlay_route_events_multi()
+
+# overlay_route_events_multi: Overlay 1..N event tables in a single pass, producing the same output event table as
+#                             successive (pairwise) overlays of the tables, but without producing the intermediate
+#                             event tables
+#
+# Parameters: event_tables - list of lists of dicts: the event tables; the first is the "input" event table
+#             event_properties_list - list of the event properties of each event table,
+#                                     e.g., "route_id LINE from_meas to_meas"
+#             overlay_type - 'UNION' or 'INTERSECT'
+#             out_event_properties - event properties of the output event table
+#             zero_length_events_list - list of the zero-length events option ('NO_ZERO' or 'ZERO') for each event table
+#             fields_list - (optional) list, with one entry per event table, of the list of (name, empty value) tuples
+#                           of the fields of the table, in order, e.g., [('route_id', ''), ('speed_lim', 0)];
+#                           the empty value is written to the field where no event of the table applies.
+#                           An entry of None (the default for every table) means that the fields, and their empty
+#                           values, are inferred from the events of the table, in which case a table with no
+#                           events contributes no fields to the output event table.
+# Return value: list of dicts: the output event table, sorted on route_id and from_meas
+#
+# Note: The dicts in the output event table all have the same fields, in the same order: the output
+#       route_id, from-measure, and to-measure fields, followed by the fields of the input event table,
+#       and then by the (possibly renamed) fields of each of the other event tables, in turn.
+#       The zero-length events option of each table applies to the zero-length events of that table only.
+#       (In a chain of pairwise overlays, a "NO_ZERO" step also drops the zero-length events produced by the
+#       preceding steps; the two agree when, as in generate_tmc_events_for_arterials.py, "ZERO" is used
+#       only for the last table, or for all of them.)
+#
+def overlay_route_events_multi(event_tables, event_properties_list, overlay_type, out_event_properties,
+                               zero_length_events_list, fields_list=None):
+    return list(iter_overlay_route_events_multi(event_tables, event_properties_list, overlay_type, out_event_properties,
+                                                zero_length_events_list, fields_list))
+# def overlay_route_events_multi()
+
+# overlay_route_events: Overlay two event tables, in the manner of arcpy.OverlayRouteEvents_lr
+#
+# Parameters: in_events - list of dicts: the input event table
+#             in_event_properties - event properties of in_events, e.g., "route_id LINE from_meas to_meas"
+#             overlay_events - list of dicts: the overlay event table
+#             overlay_event_properties - event properties of overlay_events
+#             overlay_type - 'UNION' or 'INTERSECT'
+#             out_event_properties - event properties of the output event table
+#             zero_length_events - 'NO_ZERO' (the default) or 'ZERO'
+# Return value: list of dicts: the output event table, sorted on route_id and from_meas
+#
+# Note: The dicts in the output event table all have the same fields, in the same order: the output
+#       route_id, from-measure, and to-measure fields, followed by the fields of the input event table,
+#       and then by the (possibly renamed) fields of the overlay event table.
+#
+def overlay_route_events(in_events, in_event_properties, overlay_events, overlay_event_properties,
+                         overlay_type, out_event_properties, zero_length_events='NO_ZERO'):
+    return overlay_route_events_multi([in_events, overlay_events], [in_event_properties, overlay_event_properties],
+                                      overlay_type, out_event_properties, [zero_length_events, zero_length_events])
+# def overlay_route_events()
@@ -0,0 +1,274 @@
+# route_geometry_cache.py - Persistent, compact cache of the geometry of the MassDOT LRSN routes.
+#
+# The geometry of ALL routes in MASSDOT_LRSN_Routes is extracted ONCE, and stored in two files
+# in a local cache directory:
+#     1. route_geometry.<fingerprint>.bin - the x-coordinates of the points of all routes, followed by their
+#        y-coordinates, followed by their M-values, packed as native 8-byte floats.
+#     2. route_geometry.json - a manifest giving, for each route_id, the index of its first point
+#        in the above, its number of points, and the index of the first point of each of its parts;
+#        the "fingerprint" of the source feature class from which the cache was built; and the name
+#        of the data file (1).
+#
+# Since the data file is named after the fingerprint, a rebuilt cache never overwrites the data file that
+# an existing manifest refers to: the new data file is written, then the manifest is replaced, so that a
+# reader sees either the old manifest and data file, or the new ones. A reader also checks that the size
+# of the data file agrees with the number of points in the manifest.
+#
+# The .bin file is memory-mapped, read-only, when the cache is opened. The coordinates of a route
+# are therefore read lazily, and processes that open the same cache (e.g., the workers started by
+# batch_generate_tmc_events.py) share a single copy of them in the operating system's page cache.
+#
+# The fingerprint of the source feature class is a hash of the objectid and the date_edited value of
+# each of its records, which is cheap to compute as no geometry need be read. If the fingerprint of
+# the source no longer matches that recorded in the manifest, the cache is rebuilt.
+#
+# Only building the cache and computing the fingerprint of the source require arcpy.
+
+import hashlib
+import json
+import mmap
+import os
+from array import array
+import lr_projection
+
+try:
+    import arcpy
+    arcpy_present = True
+except:
+    arcpy_present = False
+# end_try_except
+
+manifest_file_name = 'route_geometry.json'
+# Name of the data file of caches written before the data file was named after the fingerprint
+data_file_name = 'route_geometry.bin'
+
+# cache_data_file_name: Return the name of the data file of a cache built from a source with the given fingerprint
+#
+def cache_data_file_name(fingerprint):
+    return 'route_geometry.' + fingerprint + '.bin'
+# def cache_data_file_name()
+
+# source_fingerprint: Compute the fingerprint of a route feature class
+#
+# Parameter: routes_fc - full path to the route feature class, e.g., MASSDOT_LRSN_Routes_19Dec2019
+# Return value: hex string
+#
+def source_fingerprint(routes_fc):
+    if not arcpy_present:
+        raise RuntimeError("Computing the fingerprint of " + routes_fc + " requires arcpy.")
+    # end_if
+    h = hashlib.sha1()
+    h.update(routes_fc.encode('utf-8'))
+    for row in sorted(arcpy.da.SearchCursor(routes_fc, ['objectid', 'date_edited'])):
+        h.update((str(row[0]) + '|' + str(row[1]) + '\n').encode('utf-8'))
+    # for
+    return h.hexdigest()
+# def source_fingerprint()
+
+# write_cache: Write a route geometry cache
+#
+# Parameters: cache_dir - full path of the cache directory
+#             routes - iterable of (route_id, parts) tuples, where parts is a list of lists of (x, y, m) tuples
+#             fingerprint - fingerprint of the source of the routes
+# Return value: none
+#
+# Note: The files are written under temporary names and then renamed, so that a cache that is
+#       being rebuilt is never seen half-written by another process.
+#
+def write_cache(cache_dir, routes, fingerprint):
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    # end_if
+    xs = array('d'); ys = array('d'); ms = array('d')
+    route_index = {}
+    for route_id, parts in routes:
+        first_ix = len(xs)
+        part_starts = []
+        for part in parts:
+            part_starts.append(len(xs) - first_ix)
+            for (x, y, m) in part:
+                xs.append(x)
+                ys.append(y)
+                ms.append(m)
+            # for
+        # for
+        route_index[route_id] = { 'first' : first_ix, 'count' : len(xs) - first_ix, 'part_starts' : part_starts }
+    # for
+    manifest = { 'fingerprint' : fingerprint, 'num_points' : len(xs), 'data_file' : cache_data_file_name(fingerprint),
+                 'routes' : route_index }
+
+    data_path = os.path.join(cache_dir, manifest['data_file'])
+    manifest_path = os.path.join(cache_dir, manifest_file_name)
+    # Temporary file names are unique to this process, in case several processes rebuild the cache at once
+    tmp_suffix = '.' + str(os.getpid()) + '.tmp'
+    with open(data_path + tmp_suffix, 'wb') as f:
+        xs.tofile(f)
+        ys.tofile(f)
+        ms.tofile(f)
+    # with
+    with open(manifest_path + tmp_suffix, 'w') as f:
+        json.dump(manifest, f)
+    # with
+    # The manifest is replaced last: a reader never sees a new manifest with an old data file, and
+    # (as the data file of the old manifest is not overwritten) never sees an old manifest with a new data file.
+    os.replace(data_path + tmp_suffix, data_path)
+    os.replace(manifest_path + tmp_suffix, manifest_path)
+    remove_stale_data_files(cache_dir, manifest['data_file'])
+# def write_cache()
+
+# remove_stale_data_files: Remove the data files of earlier builds of a cache, other than those still in use
+#
+# Parameters: cache_dir - full path of the cache directory
+#             current_data_file - name of the data file of the current manifest
+# Return value: none
+#
+def remove_stale_data_files(cache_dir, current_data_file):
+    for file_name in os.listdir(cache_dir):
+        if file_name.startswith('route_geometry.') and file_name.endswith('.bin') and file_name != current_data_file:
+            try:
+                os.remove(os.path.join(cache_dir, file_name))
+            except OSError:
+                # The file is still open (e.g., memory-mapped by another process, on Windows); it is removed by a later build
+                pass
+            # try/except
+        # end_if
+    # for
+# def remove_stale_data_files()
+
+# extract_routes: Generator yielding (route_id, parts) for every route in a route feature class
+#
+def extract_routes(routes_fc):
+    for route_id, shape in arcpy.da.SearchCursor(routes_fc, ['route_id', 'shape@']):
+        if shape is None:
+            continue
+        # end_if
+        parts = []
+        for part_ix in range(shape.partCount):
+            parts.append([(pt.X, pt.Y, pt.M) for pt in shape.getPart(part_ix) if pt is not None])
+        # for
+        yield (route_id, parts)
+    # for
+# def extract_routes()
+
+# build_cache: Extract the geometry of all routes in a route feature class, and write it to a cache
+#
+# Parameters: routes_fc - full path to the route feature class
+#             cache_dir - full path of the cache directory
+#             fingerprint - (optional) fingerprint of routes_fc, if already computed
+# Return value: none
+#
+def build_cache(routes_fc, cache_dir, fingerprint=None):
+    if fingerprint is None:
+        fingerprint = source_fingerprint(routes_fc)
+    # end_if
+    write_cache(cache_dir, extract_routes(routes_fc), fingerprint)
+# def build_cache()
+
+# RouteGeometryCache: An open (memory-mapped) route geometry cache
+#
+class RouteGeometryCache(object):
+    # __init__: Open the cache in cache_dir
+    #
+    # Raises RuntimeError if the size of the data file does not agree with the manifest
+    #
+    def __init__(self, cache_dir):
+        # If the cache is rebuilt between the reading of the manifest and the opening of its data file,
+        # the data file may have been removed as stale; the (new) manifest is then read again
+        max_attempts = 3
+        for attempt in range(max_attempts):
+            with open(os.path.join(cache_dir, manifest_file_name), 'r') as f:
+                self.manifest = json.load(f)
+            # with
+            data_path = os.path.join(cache_dir, self.manifest.get('data_file', data_file_name))
+            try:
+                self._file = open(data_path, 'rb')
+                break
+            except (IOError, OSError):
+                if attempt == max_attempts - 1:
+                    raise
+                # end_if
+            # try/except
+        # for
+        self.fingerprint = self.manifest['fingerprint']
+        self.routes = self.manifest['routes']
+        num_points = self.manifest['num_points']
+        data_size = os.fstat(self._file.fileno()).st_size
+        if data_size != 3 * 8 * num_points:
+            self._file.close()
+            raise RuntimeError("Route geometry cache in " + cache_dir + " is inconsistent: " + data_path + " has " + str(data_size) + 
+                               " bytes; the manifest gives " + str(num_points) + " points.")
+        # end_if
+        if num_points > 0:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._values = memoryview(self._mmap).cast('d')
+        else:
+            self._mmap = None
+            self._values = memoryview(array('d'))
+        # end_if
+        self._xs = self._values[0:num_points]
+        self._ys = self._values[num_points:2*num_points]
+        self._ms = self._values[2*num_points:3*num_points]
+    # def __init__()
+
+    # route_ids: Return the list of route_ids in the cache
+    #
+    def route_ids(self):
+        return list(self.routes.keys())
+    # def route_ids()
+
+    # get_points: Return the x, y, and M arrays (zero-copy views) and part start indices of a route
+    #
+    # Parameter: route_id - MassDOT route_id
+    # Return value: tuple of (xs, ys, ms, part_starts); raises KeyError if the route is not in the cache
+    #
+    def get_points(self, route_id):
+        entry = self.routes[route_id]
+        first = entry['first']; last = first + entry['count']
+        return (self._xs[first:last], self._ys[first:last], self._ms[first:last], entry['part_starts'])
+    # def get_points()
+
+    # get_route_geometry: Return an lr_projection.RouteGeometry for a route, backed by the memory-mapped arrays
+    #
+    def get_route_geometry(self, route_id):
+        xs, ys, ms, part_starts = self.get_points(route_id)
+        return lr_projection.RouteGeometry.from_arrays(route_id, xs, ys, ms, part_starts)
+    # def get_route_geometry()
+
+    # close: Close the cache. Arrays returned by get_points (and the RouteGeometry objects
+    #        returned by get_route_geometry) must have been released before this is called.
+    #
+    def close(self):
+        self._xs.release(); self._ys.release(); self._ms.release(); self._values.release()
+        if self._mmap is not None:
+            self._mmap.close()
+        # end_if
+        self._file.close()
+    # def close()
+# class RouteGeometryCache
+
+# open_cache: Open the route geometry cache for a route feature class, (re)building it first
+#             if it does not exist or if it is out of date
+#
+# Parameters: routes_fc - full path to the route feature class
+#             cache_dir - full path of the cache directory
+#             verify - (optional) if False, open an existing cache without checking that it is up to date,
+#                      e.g., in worker processes when the parent process has already done so
+# Return value: RouteGeometryCache
+#
+def open_cache(routes_fc, cache_dir, verify=True):
+    manifest_path = os.path.join(cache_dir, manifest_file_name)
+    if os.path.exists(manifest_path) and not verify:
+        return RouteGeometryCache(cache_dir)
+    # end_if
+    fingerprint = source_fingerprint(routes_fc)
+    cached_fingerprint = None
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            cached_fingerprint = json.load(f)['fingerprint']
+        # with
+    # end_if
+    if cached_fingerprint != fingerprint:
+        build_cache(routes_fc, cache_dir, fingerprint)
+    # end_if
+    return RouteGeometryCache(cache_dir)
+# def open_cache()
@@ -0,0 +1,193 @@
+# secondary_direction_events.py - Synthesize the LRSE events of the secondary direction of an arterial route
+#                                 from the "opposing direction" attributes of the events of its primary direction.
+#
+# MassDOT practice has been to NOT code events on the secondary direction (SB or WB) of an arterial route where
+# the two directions are co-incident (i.e., where the road is un-divided), but instead to code an "opposing
+# direction" attribute on the events of the primary direction (NB or EB), e.g., op_dir_sl in LRSE_Speed_Limit
+# and opp_lanes in LRSE_Number_Travel_Lanes. (See regenerate_LRSE_FCsForArterialsy_pass_2.py, in which the
+# handling of these was left "TBD".)
+#
+# For each route pair, the engine here:
+#     1. finds the "gaps" in the secondary direction, i.e., the stretches of the secondary route that are
+#        covered by none of its events
+#     2. translates the measures of the ends of each gap to measures on the primary route, by locating the
+#        point of the secondary route at each measure and projecting it onto the primary route (lr_projection.py);
+#        a gap whose ends do not lie within the given tolerance of the primary route is not on an un-divided
+#        stretch, and is left alone
+#     3. clips the primary events overlapping each gap to it, and maps their measures back onto the secondary
+#        route, linearly between the translated ends of the gap (the two routes follow the same centerline
+#        there, in opposite directions)
+#     4. gives each synthesized event the opposing direction attributes of the primary event, e.g., its
+#        speed_lim is the primary event's op_dir_sl (and vice versa)
+# Steps 1 and 3 are performed with NumPy over all the gaps and events of both directions at once.
+#
+# Events are represented as in lrse_event_index.py: (route_id, from_measure, to_measure, value_1, ..., value_n) tuples.
+# This module depends upon numpy; it does not depend upon arcpy.
+
+import numpy as np
+import lr_projection
+import massdot_routes
+
+# Opposing direction fields of the LRSE tables used by the pipeline: each value field maps to the field
+# holding its value for the opposing direction
+speed_limit_opposing_fields = { 'speed_lim' : 'op_dir_sl', 'op_dir_sl' : 'speed_lim' }
+num_lanes_opposing_fields = { 'num_lanes' : 'opp_lanes', 'opp_lanes' : 'num_lanes' }
+
+# Default maximum distance (in the units of the routes' coordinate system) between the ends of a gap in
+# the secondary direction and the primary route, for the gap to be treated as an un-divided stretch
+default_tolerance = 5.0
+
+# Gaps shorter than this (in measure units) are ignored
+default_min_gap_length = 0.0001
+
+# coverage_gaps: Return the stretches of [first_m, last_m] covered by none of the given events
+#
+# Parameters: from_meas, to_meas - parallel NumPy arrays of the measures of the events
+#             first_m, last_m - measures of the beginning and end of the route
+#             min_gap_length - (optional) gaps shorter than this are omitted
+# Return value: tuple of parallel NumPy arrays (gap_from, gap_to)
+#
+def coverage_gaps(from_meas, to_meas, first_m, last_m, min_gap_length=default_min_gap_length):
+    lo = np.minimum(from_meas, to_meas)
+    hi = np.maximum(from_meas, to_meas)
+    order = np.argsort(lo, kind='mergesort')
+    lo = lo[order]
+    hi = hi[order]
+    # Extent covered by the events up to and including each one
+    covered_to = np.maximum.accumulate(hi) if len(hi) > 0 else hi
+    gap_from = np.concatenate(([first_m], covered_to))
+    gap_to = np.concatenate((lo, [last_m]))
+    gap_from = np.maximum(gap_from, first_m)
+    gap_to = np.minimum(gap_to, last_m)
+    keep = (gap_to - gap_from) > min_gap_length
+    return (gap_from[keep], gap_to[keep])
+# def coverage_gaps()
+
+# translate_measures: Translate measures on one route to measures on another, by locating the point of the
+#                     first route at each measure and projecting it onto the second
+#
+# Parameters: from_route, to_route - lr_projection.RouteGeometry
+#             meas - NumPy array of measures on from_route
+# Return value: tuple of parallel NumPy arrays (measures on to_route, distances of the points from to_route)
+#
+def translate_measures(from_route, to_route, meas):
+    xs, ys = lr_projection.points_at_measures(from_route, meas)
+    to_meas = np.empty(len(meas))
+    distances = np.empty(len(meas))
+    for i in range(len(meas)):
+        to_meas[i], distances[i] = to_route.project_point(float(xs[i]), float(ys[i]))
+    # for
+    return (to_meas, distances)
+# def translate_measures()
+
+# synthesize_secondary_events: Synthesize the events of the secondary direction of a route pair wherever it has none
+#
+# Parameters: primary_recs - list of the event tuples of the primary route
+#             secondary_recs - list of the event tuples of the secondary route
+#             primary_route, secondary_route - lr_projection.RouteGeometry of each route
+#             value_fields - list of the names of the value fields of the event tuples, e.g., ['speed_lim', 'op_dir_sl']
+#             opposing_fields - dict mapping each value field of a synthesized event to the field of the primary
+#                               event from which its value is taken, e.g., speed_limit_opposing_fields
+#             tolerance - (optional) see default_tolerance
+#             min_gap_length - (optional) see default_min_gap_length
+# Return value: list of event tuples for the secondary route, sorted on from_measure
+#
+# Note: A primary event with no opposing direction value for the first value field (e.g., no op_dir_sl,
+#       for speed_lim) contributes no event.
+#
+def synthesize_secondary_events(primary_recs, secondary_recs, primary_route, secondary_route, value_fields, opposing_fields,
+                                tolerance=default_tolerance, min_gap_length=default_min_gap_length):
+    if len(primary_recs) == 0:
+        return []
+    # end_if
+    sec_from = np.array([rec[1] for rec in secondary_recs], dtype=np.float64)
+    sec_to = np.array([rec[2] for rec in secondary_recs], dtype=np.float64)
+    first_m = float(secondary_route.ms[0])
+    gap_from, gap_to = coverage_gaps(sec_from, sec_to, first_m, secondary_route.last_m_value, min_gap_length)
+    if len(gap_from) == 0:
+        return []
+    # end_if
+
+    # Translate the ends of the gaps onto the primary route; keep the gaps that lie along it
+    gap_ends = np.concatenate((gap_from, gap_to))
+    prim_ends, distances = translate_measures(secondary_route, primary_route, gap_ends)
+    num_gaps = len(gap_from)
+    p0 = prim_ends[:num_gaps]; p1 = prim_ends[num_gaps:]
+    on_primary = (distances[:num_gaps] <= tolerance) & (distances[num_gaps:] <= tolerance) & (p0 != p1)
+    gap_from = gap_from[on_primary]; gap_to = gap_to[on_primary]
+    p0 = p0[on_primary]; p1 = p1[on_primary]
+    p_lo = np.minimum(p0, p1); p_hi = np.maximum(p0, p1)
+
+    # Primary events, sorted on from_measure; the events overlapping [p_lo, p_hi] of each gap are found
+    # by binary search, which assumes (as MassDOT's LRSE segmentation ensures) that they do not overlap
+    prim_recs = sorted(primary_recs, key=lambda rec: (min(rec[1], rec[2]), max(rec[1], rec[2])))
+    prim_lo = np.array([min(rec[1], rec[2]) for rec in prim_recs], dtype=np.float64)
+    prim_hi = np.array([max(rec[1], rec[2]) for rec in prim_recs], dtype=np.float64)
+    first_ix = np.searchsorted(prim_hi, p_lo, side='right')
+    end_ix = np.searchsorted(prim_lo, p_hi, side='left')
+    counts = np.maximum(end_ix - first_ix, 0)
+    gap_ix = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    event_ix = np.repeat(first_ix, counts) + offsets
+
+    # Clip the primary events to their gaps, and map their measures linearly onto the secondary route
+    clip_lo = np.maximum(prim_lo[event_ix], p_lo[gap_ix])
+    clip_hi = np.minimum(prim_hi[event_ix], p_hi[gap_ix])
+    scale = (gap_to[gap_ix] - gap_from[gap_ix]) / (p1[gap_ix] - p0[gap_ix])
+    s_a = gap_from[gap_ix] + (clip_lo - p0[gap_ix]) * scale
+    s_b = gap_from[gap_ix] + (clip_hi - p0[gap_ix]) * scale
+    s_lo = np.minimum(s_a, s_b); s_hi = np.maximum(s_a, s_b)
+
+    value_ixs = [3 + value_fields.index(opposing_fields.get(field_name, field_name)) for field_name in value_fields]
+    retval = []
+    for i in np.flatnonzero(s_hi > s_lo):
+        prim_rec = prim_recs[event_ix[i]]
+        values = tuple(prim_rec[value_ix] for value_ix in value_ixs)
+        if values[0] is None:
+            continue
+        # end_if
+        retval.append((secondary_route.route_id, float(s_lo[i]), float(s_hi[i])) + values)
+    # for
+    retval.sort(key=lambda rec: rec[1])
+    return retval
+# def synthesize_secondary_events()
+
+# complete_route_pairs: Add the synthesized secondary direction events of every route pair to a list of LRSE events
+#
+# Parameters: records - list of event tuples of all routes, e.g., as read by lrse_event_index.read_lrse_table
+#             value_fields, opposing_fields - see synthesize_secondary_events
+#             route_geom_cache - route_geometry_cache.RouteGeometryCache
+#             route_pairs - (optional) list of (route_id root, primary direction) tuples; defaults to the route
+#                           pairs of all arterial routes (see massdot_routes.py)
+#             tolerance - (optional) see default_tolerance
+# Return value: tuple of (list of all event tuples, number of them that were synthesized)
+#
+def complete_route_pairs(records, value_fields, opposing_fields, route_geom_cache, route_pairs=None, tolerance=default_tolerance):
+    records_by_route = {}
+    for rec in records:
+        if rec[0] is None or rec[1] is None or rec[2] is None:
+            continue
+        # end_if
+        records_by_route.setdefault(rec[0], []).append(rec)
+    # for
+    if route_pairs is None:
+        route_pairs = massdot_routes.get_route_pairs(massdot_routes.get_route_list(''))
+    # end_if
+    retval = list(records)
+    num_synthesized = 0
+    for route_id_root, primary_dir in route_pairs:
+        primary_route_id = route_id_root + ' ' + primary_dir
+        secondary_route_id = massdot_routes.secondary_route_id(route_id_root, primary_dir)
+        if primary_route_id not in route_geom_cache.routes or secondary_route_id not in route_geom_cache.routes:
+            continue
+        # end_if
+        synthesized = synthesize_secondary_events(records_by_route.get(primary_route_id, []),
+                                                  records_by_route.get(secondary_route_id, []),
+                                                  route_geom_cache.get_route_geometry(primary_route_id),
+                                                  route_geom_cache.get_route_geometry(secondary_route_id),
+                                                  value_fields, opposing_fields, tolerance)
+        retval += synthesized
+        num_synthesized += len(synthesized)
+    # for
+    return (retval, num_synthesized)
+# def complete_route_pairs()
@@ -0,0 +1,137 @@
+# streaming_pipeline.py - Streaming alternative to the table-by-table second half of generate_tmc_events_for_arterials.py:
+#                         overlay, cleanup, sort, export of the intermediate file, and phase 2 (process_csv_file.py).
+#
+# In the table-based pipeline, the stages materialize their output before the next stage starts: the (native)
+# overlay is cleaned up and sorted into the output event table, which is exported to the intermediate file,
+# and phase 2 reads the intermediate file back in, and builds the complete list of output records before
+# writing the final CSV file.
+#
+# Here, the stages are chained generators:
+#     1. iter_overlay_route_events_multi (see route_event_overlay.py) overlays the TMC, town, speed limit, and
+#        number-of-lanes events of a route pair in a single sweep, yielding the output events of one route at a time
+#     2. cleanup_events performs the cleanup operations of generate_tmc_events_for_arterials.py on each event,
+#        and computes its calc_len, by the same rules (see event_cleanup.py)
+#     3. group_events_by_tmc groups the events of each route by TMC, optionally coalescing each group (see event_coalescing.py)
+#     4. aggregate_tmc_groups computes the summary record of each TMC (process_csv_file.process_one_tmc_id)
+#     5. process_csv_file.write_csv_stream writes each summary record to the final CSV file as it is produced
+# At any time, only the output events of one route (i.e., its breakpoints), and the summary records not yet
+# written, are held in memory; no intermediate event table or file is written.
+#
+# The final CSV file contains the same records as that produced by the table-based pipeline. The records
+# are in order of route_id and then of from_meas, rather than in order of from_meas alone.
+#
+# This module does not depend upon arcpy.
+
+import itertools
+import event_cleanup
+import event_coalescing
+import process_csv_file
+import route_event_overlay
+
+# Event properties of all the event tables of the pipeline
+event_properties = "route_id LINE from_meas to_meas"
+
+# Zero-length events option for each of the TMC, town, speed limit, and number-of-lanes event tables,
+# as used in the successive overlays in generate_tmc_events_for_arterials.py
+zero_length_events_list = ['NO_ZERO', 'NO_ZERO', 'NO_ZERO', 'ZERO']
+
+# Fields of each of the TMC, town, speed limit, and number-of-lanes event tables, with the value written to each
+# where no event of the table applies, as declared to the overlay (see route_event_overlay.py), so that the
+# output events have all their fields even when there are no events of some table on the route pair
+# (e.g., where no speed limit is recorded, speed_lim is 0, and phase 2 writes -1 as the speed limit of the TMC).
+# As in the original overlay_events_3, the route_id of the town event table is not carried through, and those
+# of the speed limit and number-of-lanes event tables are carried through as route_id_1 and route_id_12;
+# op_dir_sl and opp_lanes, which were deleted from those event tables, are not carried through either.
+event_table_fields = [[('route_id', ''), ('from_meas', 0.0), ('to_meas', 0.0), ('tmc', ''), ('tmctype', ''), ('roadnum', ''),
+                       ('firstnm', ''), ('direction', '')],
+                      [('from_meas', 0.0), ('to_meas', 0.0), ('town', ''), ('town_id', 0)],
+                      [('route_id', ''), ('from_meas', 0.0), ('to_meas', 0.0), ('speed_lim', 0)],
+                      [('route_id', ''), ('from_meas', 0.0), ('to_meas', 0.0), ('num_lanes', 0)]]
+
+# cleanup_events: Perform the cleanup operations that generate_tmc_events_for_arterials.py performs on overlay_events_3,
+#                 and compute the calc_len of each remaining event
+#
+# Parameters: events - iterable of dicts: the events output by the overlay
+#             prune_no_tmc - (optional) if True (the default), drop events with tmc = '' (i.e., where no TMC
+#                            was located), as is done when a list of TMCs is specified
+#             cleanup - (optional) event_cleanup.EventCleanup to apply, e.g., so that the caller can report its
+#                       counts; by default, one applying event_cleanup.overlay_cleanup_rules(prune_no_tmc)
+# Return value: generator of dicts
+#
+def cleanup_events(events, prune_no_tmc=True, cleanup=None):
+    if cleanup is None:
+        cleanup = event_cleanup.EventCleanup(event_cleanup.overlay_cleanup_rules(prune_no_tmc))
+    # end_if
+    return cleanup.apply(events)
+# def cleanup_events()
+
+# group_events_by_tmc: Group a stream of events, in order of route_id, by TMC. The events of one route
+#                      are held in memory at a time; the groups of each route are yielded in order of
+#                      first appearance, i.e., of from_meas, and each group is sorted on (from_meas, tmc),
+#                      as the records of the intermediate file are.
+#
+# Parameters: events - iterable of dicts, in order of route_id
+#             coalescer - (optional) event_coalescing.EventCoalescer by which each (sorted) group is coalesced
+# Return value: generator of lists of dicts, one list per TMC
+#
+def group_events_by_tmc(events, coalescer=None):
+    for route_id, route_events in itertools.groupby(events, key=lambda event: event['route_id']):
+        for rec_list in process_csv_file.group_unsorted_records(route_events):
+            rec_list.sort(key=lambda rec: (rec['from_meas'], rec['tmc']))
+            if coalescer is not None:
+                rec_list = list(coalescer.apply(rec_list))
+            # end_if
+            yield rec_list
+        # for
+    # for
+# def group_events_by_tmc()
+
+# aggregate_tmc_groups: Compute the summary record of each TMC, as phase 2 does
+#
+# Parameter: groups - iterable of lists of dicts, one list per TMC
+# Return value: generator of dicts, one per TMC
+#
+def aggregate_tmc_groups(groups):
+    for rec_list in groups:
+        yield process_csv_file.process_one_tmc_id(rec_list)
+    # for
+# def aggregate_tmc_groups()
+
+# iter_tmc_summaries: Chain the stages of the streaming pipeline, from the overlay to the per-TMC summary records
+#
+# Parameters: tmc_events, town_events, speed_limit_events, num_lanes_events - lists of dicts: the event tables
+#                 of the route pair, each with the fields 'route_id', 'from_meas', and 'to_meas'
+#             prune_no_tmc, cleanup - (optional) see cleanup_events
+#             coalescer - (optional) see group_events_by_tmc
+# Return value: generator of dicts, one per TMC
+#
+def iter_tmc_summaries(tmc_events, town_events, speed_limit_events, num_lanes_events, prune_no_tmc=True, cleanup=None,
+                       coalescer=None):
+    event_tables = [tmc_events, town_events, speed_limit_events, num_lanes_events]
+    overlay = route_event_overlay.iter_overlay_route_events_multi(event_tables, [event_properties] * len(event_tables),
+                                                                  'UNION', event_properties, zero_length_events_list,
+                                                                  event_table_fields)
+    return aggregate_tmc_groups(group_events_by_tmc(cleanup_events(overlay, prune_no_tmc, cleanup), coalescer))
+# def iter_tmc_summaries()
+
+# main_routine: Run the streaming pipeline for a route pair, writing the final CSV file
+#
+# Parameters: tmc_events, town_events, speed_limit_events, num_lanes_events - see iter_tmc_summaries
+#             out_csv_dir - full path of directory into which the final CSV file is to be written
+#             out_csv_file - name of the final CSV file
+#             prune_no_tmc, cleanup - (optional) see cleanup_events
+#             coalescer - (optional) see group_events_by_tmc
+# Return value: number of records (i.e., TMCs) written
+#
+def main_routine(tmc_events, town_events, speed_limit_events, num_lanes_events, out_csv_dir, out_csv_file, prune_no_tmc=True,
+                 cleanup=None, coalescer=None):
+    num_prior_problem_tmcs = len(process_csv_file.problem_tmcs)
+    summaries = iter_tmc_summaries(tmc_events, town_events, speed_limit_events, num_lanes_events, prune_no_tmc, cleanup, coalescer)
+    retval = process_csv_file.write_csv_stream(out_csv_dir, out_csv_file, summaries)
+    process_csv_file.report("Processed " + str(retval) + " TMC(s).")
+    problem_tmcs = process_csv_file.problem_tmcs[num_prior_problem_tmcs:]
+    if len(problem_tmcs) > 0:
+        process_csv_file.report("*** No usable attribute value(s) were found for the following TMCs:\n    " + "\n    ".join(problem_tmcs))
+    # end_if
+    return retval
+# def main_routine()
@@ -0,0 +1,156 @@
+# tmc_location_cache.py - Persistent cache of the results of locating TMCs along MassDOT routes.
+#
+# The TMC-location step (lr_projection.locate_events) projects the first and last points of every TMC onto
+# its route on every run, although INRIX TMC geometry and the LRSN routes rarely change between refreshes.
+# Here, the result for each (tmc, route_id) pair - its from_meas, its to_meas, and whether its event is kept
+# (i.e., is not zero-length) - is stored in a local SQLite database, keyed by a hash of:
+#     1. the route_id, and a hash of the route's geometry (its x, y, and M arrays and part starts)
+#     2. the tmc, and the coordinates of its first and last points (the only parts of its geometry used)
+#     3. cache_version, which is to be changed whenever the results of lr_projection.locate_events would change
+# so that a change in the geometry of either the TMC or the route simply results in a new key. On each run,
+# only the TMCs whose keys are not in the cache are projected.
+#
+# The cache is bounded in size: each entry records when it was last used, and once the cache holds more than
+# max_entries entries, the least recently used are evicted. Entries for superseded geometry are thus evicted in time.
+#
+# This module does not depend upon arcpy.
+
+import hashlib
+import os
+import sqlite3
+import time
+from array import array
+import lr_projection
+
+# Name of the cache database file, in the cache directory (see route_geometry_cache.py)
+cache_file_name = 'tmc_locations.sqlite'
+
+# Version of the results stored in the cache
+cache_version = '1'
+
+# Default maximum number of entries in the cache
+default_max_entries = 1000000
+
+# route_geometry_hash: Return a hash of the geometry of a route in the route geometry cache
+#
+# Parameters: route_geom_cache - route_geometry_cache.RouteGeometryCache
+#             route_id - MassDOT route_id
+# Return value: hex string
+#
+def route_geometry_hash(route_geom_cache, route_id):
+    xs, ys, ms, part_starts = route_geom_cache.get_points(route_id)
+    h = hashlib.sha1()
+    for values in (xs, ys, ms):
+        h.update(values.tobytes())
+        values.release()
+    # for
+    h.update(repr(part_starts).encode('utf-8'))
+    return h.hexdigest()
+# def route_geometry_hash()
+
+# location_key: Return the key of the location of a TMC along a route
+#
+def location_key(route_id, route_hash, tmc_id, from_x, from_y, to_x, to_y):
+    s = '|'.join([cache_version, route_id, route_hash, tmc_id, repr(float(from_x)), repr(float(from_y)), repr(float(to_x)), repr(float(to_y))])
+    return hashlib.sha1(s.encode('utf-8')).hexdigest()
+# def location_key()
+
+# TmcLocationCache: An open TMC location cache
+#
+class TmcLocationCache(object):
+    # __init__: Open (creating, if need be) the cache in cache_dir
+    #
+    # Parameters: cache_dir - full path of the cache directory
+    #             max_entries - (optional) maximum number of entries retained in the cache
+    #
+    def __init__(self, cache_dir, max_entries=default_max_entries):
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        # end_if
+        self.max_entries = max_entries
+        # The worker processes of batch_generate_tmc_events.py may use the cache at the same time
+        self.conn = sqlite3.connect(os.path.join(cache_dir, cache_file_name), timeout=60.0)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS locations (key TEXT PRIMARY KEY, from_meas REAL, to_meas REAL, " +
+                          "keep INTEGER, last_used REAL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS locations_last_used ON locations (last_used)")
+        self.conn.commit()
+    # def __init__()
+
+    # lookup: Look up the locations with the given keys, marking those found as used
+    #
+    # Parameter: keys - list of keys (see location_key)
+    # Return value: dict mapping each key found to a (from_meas, to_meas, keep) tuple
+    #
+    def lookup(self, keys):
+        retval = {}
+        # SQLite limits the number of parameters of a statement
+        batch = 500
+        for b in range(0, len(keys), batch):
+            batch_keys = keys[b:b+batch]
+            sql = "SELECT key, from_meas, to_meas, keep FROM locations WHERE key IN (" + ','.join(['?'] * len(batch_keys)) + ")"
+            for (key, from_meas, to_meas, keep) in self.conn.execute(sql, batch_keys):
+                retval[key] = (from_meas, to_meas, keep != 0)
+            # for
+        # for
+        now = time.time()
+        self.conn.executemany("UPDATE locations SET last_used = ? WHERE key = ?", [(now, key) for key in retval])
+        self.conn.commit()
+        return retval
+    # def lookup()
+
+    # store: Store locations, and evict the least recently used entries if the cache holds more than max_entries
+    #
+    # Parameter: entries - list of (key, from_meas, to_meas, keep) tuples
+    #
+    def store(self, entries):
+        now = time.time()
+        self.conn.executemany("INSERT OR REPLACE INTO locations (key, from_meas, to_meas, keep, last_used) VALUES (?, ?, ?, ?, ?)",
+                              [(key, from_meas, to_meas, 1 if keep else 0, now) for (key, from_meas, to_meas, keep) in entries])
+        num_entries = self.conn.execute("SELECT COUNT(*) FROM locations").fetchone()[0]
+        if num_entries > self.max_entries:
+            self.conn.execute("DELETE FROM locations WHERE key IN (SELECT key FROM locations ORDER BY last_used LIMIT ?)",
+                              (num_entries - self.max_entries,))
+        # end_if
+        self.conn.commit()
+    # def store()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM locations").fetchone()[0]
+    # def __len__()
+
+    def close(self):
+        self.conn.close()
+    # def close()
+# class TmcLocationCache
+
+# locate_events_cached: Locate a batch of TMCs along a route, as lr_projection.locate_events does, projecting
+#                       only those whose locations are not in the cache, and storing the locations of those
+#
+# Parameters: cache - TmcLocationCache
+#             route - lr_projection.RouteGeometry
+#             route_hash - hash of the route's geometry (see route_geometry_hash)
+#             tmc_ids - the tmc of each TMC
+#             from_xs, from_ys - coordinates of the first point of each TMC
+#             to_xs, to_ys - coordinates of the last point of each TMC
+# Return value: tuple of (from_meas array, to_meas array, list of booleans indicating which events are
+#               to be kept, number of TMCs projected)
+#
+def locate_events_cached(cache, route, route_hash, tmc_ids, from_xs, from_ys, to_xs, to_ys):
+    keys = [location_key(route.route_id, route_hash, tmc_ids[i], from_xs[i], from_ys[i], to_xs[i], to_ys[i]) for i in range(len(tmc_ids))]
+    found = cache.lookup(keys)
+    misses = [i for i in range(len(keys)) if keys[i] not in found]
+    if len(misses) > 0:
+        from_meas, to_meas, keep = lr_projection.locate_events(route, [from_xs[i] for i in misses], [from_ys[i] for i in misses],
+                                                               [to_xs[i] for i in misses], [to_ys[i] for i in misses])
+        new_entries = []
+        for j, i in enumerate(misses):
+            found[keys[i]] = (from_meas[j], to_meas[j], keep[j])
+            new_entries.append((keys[i], from_meas[j], to_meas[j], keep[j]))
+        # for
+        cache.store(new_entries)
+    # end_if
+    from_meas = array('d', [found[key][0] for key in keys])
+    to_meas = array('d', [found[key][1] for key in keys])
+    keep = [found[key][2] for key in keys]
+    return (from_meas, to_meas, keep, len(misses))
+# def locate_events_cached()
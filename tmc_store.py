@@ -0,0 +1,203 @@
+# tmc_store.py - Local store of the attributes and endpoints of ALL INRIX TMCs, and set-based selection of TMCs from it.
+#
+# This replaces the selection of TMCs by a where-clause of the form "tmc IN ('129+04567', '129+04568', ...)",
+# built from the contents of a TMC list file, and passed to MakeFeatureLayer_management. For long corridors, or
+# statewide lists, that string becomes enormous: the database parses it slowly, and limits the length of IN-lists.
+#
+# Instead:
+#     1. the attributes used by the pipeline (tmc, tmctype, roadnum, firstnm, direction), and the coordinates
+#        of the first and last points, of every TMC in the INRIX TMC feature class are read ONCE, and saved in
+#        a dict keyed by tmc, in a local cache directory (see route_geometry_cache.py); the store is rebuilt only
+#        when the fingerprint of the feature class changes
+#     2. the TMC list file is parsed into a list of TMC IDs, detecting duplicate and malformed IDs (see read_tmc_list)
+#     3. the TMCs are selected by looking up each listed ID in the store (a hash join), which takes time
+#        proportional to the length of the list, and no query is sent to the database
+#
+# TMC list files may contain IDs in the form of a SQL IN-list (e.g., '129+04567',), as they have been written
+# for the where-clause, or one bare ID per line. Only building the store, and computing the fingerprint of the
+# TMC feature class (from its row count and objectid range; see tmc_fingerprint), require arcpy.
+
+import hashlib
+import os
+import pickle
+import re
+
+try:
+    import arcpy
+    arcpy_present = True
+except:
+    arcpy_present = False
+# end_try_except
+
+# Name of the file, in the cache directory, in which the store is saved
+store_file_name = 'tmc_store.pickle'
+
+# Fields of each TMC read from the TMC feature class, in order (see generate_tmc_events_for_arterials.py)
+tmc_attribute_fields = ['tmc', 'tmctype', 'roadnum', 'firstnm', 'direction']
+
+# A well-formed TMC ID: 3-digit location table prefix, direction character, and 5-digit location code, e.g., 129+04567
+tmc_id_pattern = re.compile(r'^[0-9]{3}[+\-PN][0-9]{5}$')
+
+# read_tmc_list: Read the TMC IDs in a TMC list file
+#
+# Parameter: path - full path of the TMC list file
+# Return value: tuple of (list of distinct, well-formed TMC IDs, in order of first appearance,
+#                         list of IDs that appear more than once, list of malformed IDs)
+#
+def read_tmc_list(path):
+    tmc_ids = []; duplicates = []; malformed = []
+    seen = set()
+    with open(path, 'r') as f:
+        for line in f:
+            for token in line.split(','):
+                tmc_id = token.strip().strip('\'"').strip()
+                if tmc_id == '':
+                    continue
+                # end_if
+                if not tmc_id_pattern.match(tmc_id):
+                    malformed.append(tmc_id)
+                elif tmc_id in seen:
+                    duplicates.append(tmc_id)
+                else:
+                    seen.add(tmc_id)
+                    tmc_ids.append(tmc_id)
+                # end_if
+            # for
+        # for
+    # with
+    return (tmc_ids, duplicates, malformed)
+# def read_tmc_list()
+
+# TmcStore: The attributes and endpoints of all TMCs, keyed by tmc
+#
+class TmcStore(object):
+    # __init__: Build the store
+    #
+    # Parameters: records - iterable of (attributes, from_x, from_y, to_x, to_y) tuples, where attributes is a tuple
+    #                       of the values of tmc_attribute_fields
+    #             fingerprint - (optional) fingerprint of the TMC feature class from which the records were read
+    #
+    def __init__(self, records, fingerprint=None):
+        self.fingerprint = fingerprint
+        self.tmcs = {}
+        for rec in records:
+            self.tmcs[rec[0][0]] = tuple(rec)
+        # for
+    # def __init__()
+
+    def __len__(self):
+        return len(self.tmcs)
+    # def __len__()
+
+    # select: Select TMCs by ID
+    #
+    # Parameter: tmc_ids - list of TMC IDs
+    # Return value: tuple of (list of the (attributes, from_x, from_y, to_x, to_y) tuples of the TMCs found, in the order
+    #                         of tmc_ids, list of the IDs not found)
+    #
+    def select(self, tmc_ids):
+        selected = []; missing = []
+        for tmc_id in tmc_ids:
+            rec = self.tmcs.get(tmc_id)
+            if rec is not None:
+                selected.append(rec)
+            else:
+                missing.append(tmc_id)
+            # end_if
+        # for
+        return (selected, missing)
+    # def select()
+
+    # save: Save the store to a file
+    #
+    def save(self, path):
+        tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+        # with
+        os.replace(tmp_path, path)
+    # def save()
+
+    # load: Load a store saved by save
+    #
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+        # with
+    # def load()
+# class TmcStore
+
+# tmc_fingerprint: Return a fingerprint of the TMC feature class, from a cheap change marker: its row count, and its
+#                  lowest and highest objectid. The INRIX TMC feature class has no date_edited field, and is replaced
+#                  (i.e., reloaded, with new objectids) rather than edited in place, so this detects a new vintage
+#                  of it without reading every TMC (and its geometry), as building the store does. To force the store
+#                  to be rebuilt after an edit in place, delete tmc_store.pickle from the cache directory.
+#
+def tmc_fingerprint(tmc_fc):
+    if not arcpy_present:
+        raise RuntimeError("Computing the fingerprint of " + tmc_fc + " requires arcpy.")
+    # end_if
+    count = int(arcpy.GetCount_management(tmc_fc).getOutput(0))
+    oid_range = []
+    for order in ('ASC', 'DESC'):
+        with arcpy.da.SearchCursor(tmc_fc, ['objectid'], sql_clause=(None, 'ORDER BY objectid ' + order)) as csr:
+            for row in csr:
+                oid_range.append(row[0])
+                break
+            # for
+        # with
+    # for
+    h = hashlib.sha1()
+    h.update((tmc_fc + '\n').encode('utf-8'))
+    h.update((str(count) + '|' + '|'.join([str(oid) for oid in oid_range]) + '\n').encode('utf-8'))
+    return h.hexdigest()
+# def tmc_fingerprint()
+
+# build_store: Read ALL TMCs from the TMC feature class into a store
+#
+# Parameters: tmc_fc - full path to the TMC feature class, e.g., INRIX_MASSACHUSETTS_TMC_2019
+#             fingerprint - (optional) fingerprint of tmc_fc, if already computed
+# Return value: TmcStore
+#
+def build_store(tmc_fc, fingerprint=None):
+    if not arcpy_present:
+        raise RuntimeError("Reading " + tmc_fc + " requires arcpy.")
+    # end_if
+    records = []
+    for row in arcpy.da.SearchCursor(tmc_fc, tmc_attribute_fields + ['shape@']):
+        shape = row[-1]
+        if row[0] is None or shape is None:
+            continue
+        # end_if
+        records.append((tuple(row[:-1]), shape.firstPoint.X, shape.firstPoint.Y, shape.lastPoint.X, shape.lastPoint.Y))
+    # for
+    return TmcStore(records, fingerprint)
+# def build_store()
+
+# open_store: Return the TMC store, loading it from the cache directory if it is there and up to date,
+#             and otherwise building it (and saving it to the cache directory)
+#
+# Parameters: tmc_fc - full path to the TMC feature class
+#             cache_dir - full path of the cache directory
+#             verify - (optional) if False, load a saved store without checking that it is up to date,
+#                      e.g., in worker processes when the parent process has already done so
+# Return value: TmcStore
+#
+def open_store(tmc_fc, cache_dir, verify=True):
+    store_path = os.path.join(cache_dir, store_file_name)
+    store = TmcStore.load(store_path) if os.path.exists(store_path) else None
+    if store is not None and not verify:
+        return store
+    # end_if
+    fingerprint = tmc_fingerprint(tmc_fc)
+    if store is not None and store.fingerprint == fingerprint:
+        return store
+    # end_if
+    store = build_store(tmc_fc, fingerprint)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    # end_if
+    store.save(store_path)
+    return store
+# def open_store()
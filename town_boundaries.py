@@ -0,0 +1,433 @@
+# town_boundaries.py - Native generation of town events along a MassDOT route, from the town political boundaries.
+#
+# This is a replacement for the LocateFeaturesAlongRoutes_lr call that located ALL of the polygons of towns_pb_r
+# (351 towns, including their water areas) along each route, and for the later deletion of the town_id = 0
+# "sliver" records from overlay_events_3 (see generate_tmc_events_for_arterials.py).
+#
+# The town polygons are read once and held in an STR-tree (Sort-Tile-Recursive packed R-tree) of their bounding boxes.
+# For each route:
+#     1. the STR-tree is queried for the towns whose bounding boxes intersect that of the route
+#     2. the route's segments are intersected with the boundary edges of only those towns (with NumPy, in batches);
+#        the M-values of the crossings, and of the ends of the route's parts, break the route into intervals
+#     3. the town containing the midpoint of each interval is found by an even-odd (ray casting) test against
+#        the candidate towns; adjacent intervals in the same town are merged
+#     4. "slivers" - intervals in a town_id 0 polygon, or shorter than sliver_tolerance - are merged into the longer
+#        of their adjacent intervals, rather than being left to be deleted after the overlays; longer intervals
+#        in no town at all (e.g., beyond the state line) have no town event, as before
+# The result is a list of (route_id, from_meas, to_meas, town, town_id) events, as dicts, in order of from_meas.
+#
+# As the town events of a route depend only upon its geometry and the town polygons, both of which change rarely,
+# the town events of EVERY route in the route geometry cache are generated once, and saved, indexed by route_id
+# (as a lrse_event_index.LrseEventIndex), in the cache directory (see open_town_event_index). The saved index is
+# versioned by the fingerprints of the route geometry and of the town polygons, and is rebuilt only when either
+# (or the sliver tolerance, or this module) changes; each route run just looks up the events of its route.
+#
+# Only read_towns, and computing the fingerprint of the town polygons, depend upon arcpy.
+
+import hashlib
+import math
+import os
+import numpy as np
+import incremental_build
+import lr_projection
+import lrse_event_index
+
+try:
+    import arcpy
+    arcpy_present = True
+except:
+    arcpy_present = False
+# end_try_except
+
+# Default length (in measure units, i.e., miles) below which an interval is treated as a sliver
+default_sliver_tolerance = 0.005
+
+# Maximum number of (route segment, town edge) pairs tested for intersection in a single batch
+max_batch_pairs = 1000000
+
+# STRtree: Sort-Tile-Recursive packed R-tree over a static list of bounding boxes
+#
+class STRtree(object):
+    # __init__: Build the tree
+    #
+    # Parameters: boxes - list of (min_x, min_y, max_x, max_y) tuples
+    #             node_capacity - (optional) maximum number of children of each node
+    #
+    def __init__(self, boxes, node_capacity=10):
+        self.boxes = [tuple(box) for box in boxes]
+        self.node_capacity = node_capacity
+        # Each level is a list of (bounding box, list of children) tuples; the children of the nodes of the
+        # first level are indices in boxes, and those of each subsequent level are indices in the level below it
+        self.levels = []
+        entries = list(range(len(self.boxes)))
+        entry_boxes = self.boxes
+        while True:
+            level = self._pack(entries, entry_boxes)
+            self.levels.append(level)
+            if len(level) <= 1:
+                break
+            # end_if
+            entries = list(range(len(level)))
+            entry_boxes = [node_box for (node_box, children) in level]
+        # while
+    # def __init__()
+
+    # _pack: Pack entries into nodes: sort on the x-centers of their boxes, cut into vertical slices,
+    #        sort each slice on the y-centers, and group consecutive entries into nodes
+    #
+    def _pack(self, entries, entry_boxes):
+        cap = self.node_capacity
+        num_nodes = int(math.ceil(len(entries) / float(cap)))
+        num_slices = max(int(math.ceil(math.sqrt(num_nodes))), 1)
+        slice_size = num_slices * cap
+        by_x = sorted(entries, key=lambda e: entry_boxes[e][0] + entry_boxes[e][2])
+        level = []
+        for s in range(0, len(by_x), slice_size):
+            by_y = sorted(by_x[s:s+slice_size], key=lambda e: entry_boxes[e][1] + entry_boxes[e][3])
+            for n in range(0, len(by_y), cap):
+                children = by_y[n:n+cap]
+                node_box = (min(entry_boxes[c][0] for c in children), min(entry_boxes[c][1] for c in children),
+                            max(entry_boxes[c][2] for c in children), max(entry_boxes[c][3] for c in children))
+                level.append((node_box, children))
+            # for
+        # for
+        return level
+    # def _pack()
+
+    # query: Return the indices (in boxes) of the boxes that intersect the given box
+    #
+    def query(self, min_x, min_y, max_x, max_y):
+        def intersects(box):
+            return box[0] <= max_x and box[2] >= min_x and box[1] <= max_y and box[3] >= min_y
+        # def intersects()
+        candidates = list(range(len(self.levels[-1])))
+        for level in reversed(self.levels):
+            next_candidates = []
+            for node in candidates:
+                node_box, children = level[node]
+                if intersects(node_box):
+                    next_candidates += children
+                # end_if
+            # for
+            candidates = next_candidates
+        # for
+        return sorted(ix for ix in candidates if intersects(self.boxes[ix]))
+    # def query()
+# class STRtree
+
+# Town: A town polygon: its name, town_id, and rings (lists of (x, y) tuples), held as NumPy arrays of its edges
+#
+class Town(object):
+    def __init__(self, town, town_id, rings):
+        self.town = town
+        self.town_id = town_id
+        x0 = []; y0 = []; x1 = []; y1 = []
+        for ring in rings:
+            for i in range(len(ring)):
+                (xa, ya) = ring[i - 1]; (xb, yb) = ring[i]
+                x0.append(xa); y0.append(ya); x1.append(xb); y1.append(yb)
+            # for
+        # for
+        self.x0 = np.array(x0, dtype=np.float64); self.y0 = np.array(y0, dtype=np.float64)
+        self.x1 = np.array(x1, dtype=np.float64); self.y1 = np.array(y1, dtype=np.float64)
+        self.box = (float(min(self.x0.min(), self.x1.min())), float(min(self.y0.min(), self.y1.min())),
+                    float(max(self.x0.max(), self.x1.max())), float(max(self.y0.max(), self.y1.max())))
+    # def __init__()
+
+    # contains: Return a NumPy boolean array: True for each point that lies within the town (even-odd rule)
+    #
+    def contains(self, xs, ys):
+        retval = np.zeros(len(xs), dtype=bool)
+        batch = max(max_batch_pairs // max(len(self.x0), 1), 1)
+        for b in range(0, len(xs), batch):
+            px = xs[b:b+batch, None]; py = ys[b:b+batch, None]
+            straddles = (self.y0 > py) != (self.y1 > py)
+            dy = np.where(self.y1 != self.y0, self.y1 - self.y0, 1.0)
+            x_cross = self.x0 + (py - self.y0) * (self.x1 - self.x0) / dy
+            retval[b:b+batch] = (np.count_nonzero(straddles & (px < x_cross), axis=1) % 2) == 1
+        # for
+        return retval
+    # def contains()
+# class Town
+
+# TownIndex: The town polygons, with an STR-tree over their bounding boxes
+#
+class TownIndex(object):
+    # __init__: Parameter is a list of (town, town_id, rings) tuples, e.g., as returned by read_towns
+    #
+    def __init__(self, towns):
+        self.towns = [Town(town, town_id, rings) for (town, town_id, rings) in towns if len(rings) > 0]
+        self.tree = STRtree([town.box for town in self.towns])
+    # def __init__()
+
+    # query: Return the towns whose bounding boxes intersect the given box
+    #
+    def query(self, min_x, min_y, max_x, max_y):
+        return [self.towns[ix] for ix in self.tree.query(min_x, min_y, max_x, max_y)]
+    # def query()
+# class TownIndex
+
+# read_towns: Read the town polygons from a feature class, e.g., towns_pb_r
+#
+# Parameter: towns_fc - full path to the town feature class, with 'town' and 'town_id' fields
+# Return value: list of (town, town_id, rings) tuples
+#
+def read_towns(towns_fc):
+    if not arcpy_present:
+        raise RuntimeError("Reading " + towns_fc + " requires arcpy.")
+    # end_if
+    retval = []
+    for (town, town_id, shape) in arcpy.da.SearchCursor(towns_fc, ['town', 'town_id', 'shape@']):
+        rings = []
+        if shape is not None:
+            for part in shape:
+                ring = []
+                # The rings of a part (i.e., its exterior ring and any holes) are separated by None
+                for pt in part:
+                    if pt is None:
+                        if len(ring) > 0:
+                            rings.append(ring)
+                        # end_if
+                        ring = []
+                    else:
+                        ring.append((pt.X, pt.Y))
+                    # end_if
+                # for
+                if len(ring) > 0:
+                    rings.append(ring)
+                # end_if
+            # for
+        # end_if
+        retval.append((town, town_id, rings))
+    # for
+    return retval
+# def read_towns()
+
+# route_crossings: Return the M-values at which a route's segments cross the boundary edges of a town
+#
+# Parameters: seg_x0, seg_y0, seg_x1, seg_y1, seg_m0, seg_m1 - NumPy arrays of the ends of the route's segments
+#             town - Town
+# Return value: NumPy array of M-values
+#
+def route_crossings(seg_x0, seg_y0, seg_x1, seg_y1, seg_m0, seg_m1, town):
+    # Only the town's edges that lie within the bounding box of the route can cross it
+    min_x = min(seg_x0.min(), seg_x1.min()); max_x = max(seg_x0.max(), seg_x1.max())
+    min_y = min(seg_y0.min(), seg_y1.min()); max_y = max(seg_y0.max(), seg_y1.max())
+    near = (np.maximum(town.x0, town.x1) >= min_x) & (np.minimum(town.x0, town.x1) <= max_x) & \
+           (np.maximum(town.y0, town.y1) >= min_y) & (np.minimum(town.y0, town.y1) <= max_y)
+    ex0 = town.x0[near]; ey0 = town.y0[near]; edx = town.x1[near] - ex0; edy = town.y1[near] - ey0
+    if len(ex0) == 0:
+        return np.zeros(0)
+    # end_if
+    retval = []
+    batch = max(max_batch_pairs // len(ex0), 1)
+    for b in range(0, len(seg_x0), batch):
+        sx0 = seg_x0[b:b+batch, None]; sy0 = seg_y0[b:b+batch, None]
+        sdx = seg_x1[b:b+batch, None] - sx0; sdy = seg_y1[b:b+batch, None] - sy0
+        denom = sdx * edy - sdy * edx
+        ok = denom != 0
+        denom = np.where(ok, denom, 1.0)
+        qx = ex0 - sx0; qy = ey0 - sy0
+        t = (qx * edy - qy * edx) / denom
+        u = (qx * sdy - qy * sdx) / denom
+        hit_seg, hit_edge = np.nonzero(ok & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1))
+        m0 = seg_m0[b:b+batch][hit_seg]; m1 = seg_m1[b:b+batch][hit_seg]
+        retval.append(m0 + t[hit_seg, hit_edge] * (m1 - m0))
+    # for
+    return np.concatenate(retval)
+# def route_crossings()
+
+# merge_slivers: Merge each sliver into the longer of its adjacent (i.e., contiguous) intervals in a town,
+#                and merge adjacent intervals in the same town
+#
+# Parameters: intervals - list of [from_meas, to_meas, town, town_id] lists, in order of from_meas;
+#                         town is None (and town_id 0) for an interval in no town
+#             sliver_tolerance - see default_sliver_tolerance
+# Return value: list of [from_meas, to_meas, town, town_id] lists; intervals in no town that are not slivers,
+#               and slivers with town_id 0 with no adjacent interval to be merged into, are dropped
+#
+def merge_slivers(intervals, sliver_tolerance):
+    def length(iv):
+        return iv[1] - iv[0]
+    # def length()
+    def is_sliver(iv):
+        return iv[3] == 0 or length(iv) < sliver_tolerance
+    # def is_sliver()
+    def adjacent(a, b):
+        return abs(a[1] - b[0]) < 1e-9
+    # def adjacent()
+    def coalesce(ivs):
+        retval = []
+        for iv in ivs:
+            if len(retval) > 0 and adjacent(retval[-1], iv) and retval[-1][3] == iv[3]:
+                retval[-1][1] = iv[1]
+            else:
+                retval.append(iv)
+            # end_if
+        # for
+        return retval
+    # def coalesce()
+
+    intervals = coalesce([list(iv) for iv in intervals])
+    intervals = [iv for iv in intervals if iv[2] is not None or length(iv) < sliver_tolerance]
+    # Slivers that cannot be merged (in a town, but with no adjacent interval that is not a sliver) are kept
+    kept = set()
+    while True:
+        slivers = [i for i, iv in enumerate(intervals) if is_sliver(iv) and (iv[0], iv[1]) not in kept]
+        if len(slivers) == 0:
+            break
+        # end_if
+        # The shortest sliver is merged first
+        i = min(slivers, key=lambda i: length(intervals[i]))
+        neighbors = [j for j in [i - 1, i + 1] if j >= 0 and j < len(intervals) and intervals[j][3] != 0 and
+                     (adjacent(intervals[j], intervals[i]) if j < i else adjacent(intervals[i], intervals[j]))]
+        if len(neighbors) > 0:
+            j = max(neighbors, key=lambda j: length(intervals[j]))
+            intervals[j][0] = min(intervals[j][0], intervals[i][0])
+            intervals[j][1] = max(intervals[j][1], intervals[i][1])
+            del intervals[i]
+            intervals = coalesce(intervals)
+        elif intervals[i][3] == 0:
+            del intervals[i]
+        else:
+            kept.add((intervals[i][0], intervals[i][1]))
+        # end_if
+    # while
+    return intervals
+# def merge_slivers()
+
+# locate_towns_along_route: Generate the town events along a route
+#
+# Parameters: route - lr_projection.RouteGeometry
+#             town_index - TownIndex
+#             sliver_tolerance - (optional) see default_sliver_tolerance
+# Return value: list of event dicts with the fields 'route_id', 'from_meas', 'to_meas', 'town', and 'town_id',
+#               in order of from_meas
+#
+# Note: The M-values of the route are assumed to be non-decreasing along it.
+#
+def locate_towns_along_route(route, town_index, sliver_tolerance=default_sliver_tolerance):
+    xs = np.asarray(route.xs, dtype=np.float64); ys = np.asarray(route.ys, dtype=np.float64)
+    ms = np.asarray(route.ms, dtype=np.float64)
+    seg_starts = np.asarray(route.seg_starts, dtype=np.int64)
+    if len(seg_starts) == 0:
+        return []
+    # end_if
+    seg_x0 = xs[seg_starts]; seg_y0 = ys[seg_starts]; seg_m0 = ms[seg_starts]
+    seg_x1 = xs[seg_starts + 1]; seg_y1 = ys[seg_starts + 1]; seg_m1 = ms[seg_starts + 1]
+    towns = town_index.query(float(xs.min()), float(ys.min()), float(xs.max()), float(ys.max()))
+
+    # Break the route at every boundary crossing, and at the ends of its parts
+    part_ends = np.asarray(list(route.part_starts[1:]) + [len(xs)], dtype=np.int64) - 1
+    breaks = [ms[np.asarray(route.part_starts, dtype=np.int64)], ms[part_ends]]
+    for town in towns:
+        breaks.append(route_crossings(seg_x0, seg_y0, seg_x1, seg_y1, seg_m0, seg_m1, town))
+    # for
+    breaks = np.unique(np.concatenate(breaks))
+    lo = breaks[:-1]; hi = breaks[1:]
+    mid = (lo + hi) / 2.0
+    # Intervals that lie in a break in the M-values between two parts of the route are not on it
+    seg = np.clip(np.searchsorted(seg_m1, mid, side='left'), 0, len(seg_starts) - 1)
+    on_route = (seg_m0[seg] <= mid) & (mid <= seg_m1[seg])
+    lo = lo[on_route]; hi = hi[on_route]; mid = mid[on_route]
+
+    # The town containing the midpoint of each interval
+    mid_xs, mid_ys = lr_projection.points_at_measures(route, mid)
+    town_ix = np.full(len(mid), -1, dtype=np.int64)
+    for ix, town in enumerate(towns):
+        unassigned = np.flatnonzero(town_ix < 0)
+        if len(unassigned) == 0:
+            break
+        # end_if
+        inside = town.contains(mid_xs[unassigned], mid_ys[unassigned])
+        town_ix[unassigned[inside]] = ix
+    # for
+    intervals = []
+    for i in range(len(lo)):
+        if town_ix[i] >= 0:
+            town = towns[town_ix[i]]
+            intervals.append([float(lo[i]), float(hi[i]), town.town, town.town_id])
+        else:
+            intervals.append([float(lo[i]), float(hi[i]), None, 0])
+        # end_if
+    # for
+    retval = []
+    for (from_meas, to_meas, town, town_id) in merge_slivers(intervals, sliver_tolerance):
+        retval.append({ 'route_id' : route.route_id, 'from_meas' : from_meas, 'to_meas' : to_meas, 'town' : town, 'town_id' : town_id })
+    # for
+    return retval
+# def locate_towns_along_route()
+
+# Name of the file, in the cache directory (see route_geometry_cache.py), in which the statewide town event index is saved
+town_event_index_file_name = 'town_events.index'
+
+# town_event_fingerprint: Return the fingerprint of the inputs to the statewide town event index: the route
+#                         geometry (as recorded in the route geometry cache), the town polygons, the sliver
+#                         tolerance, and the source code of this module
+#
+# Parameters: route_geom_cache - route_geometry_cache.RouteGeometryCache
+#             towns_fc - full path to the town feature class, e.g., towns_pb_r
+#             sliver_tolerance - see default_sliver_tolerance
+# Return value: hex string
+#
+def town_event_fingerprint(route_geom_cache, towns_fc, sliver_tolerance):
+    h = hashlib.sha1()
+    h.update(('routes ' + route_geom_cache.fingerprint + '\ntowns ' + incremental_build.towns_fingerprint(towns_fc) +
+              '\nsliver_tolerance ' + repr(sliver_tolerance) + '\n').encode('utf-8'))
+    incremental_build.hash_file(h, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'town_boundaries.py'))
+    return h.hexdigest()
+# def town_event_fingerprint()
+
+# build_town_event_index: Generate the town events along EVERY route in the route geometry cache, and index them by route_id
+#
+# Parameters: route_geom_cache - route_geometry_cache.RouteGeometryCache
+#             towns - list of (town, town_id, rings) tuples, e.g., as returned by read_towns
+#             fingerprint - (optional) see town_event_fingerprint
+#             sliver_tolerance - (optional) see default_sliver_tolerance
+# Return value: lrse_event_index.LrseEventIndex, with the value fields 'town' and 'town_id'
+#
+def build_town_event_index(route_geom_cache, towns, fingerprint=None, sliver_tolerance=default_sliver_tolerance):
+    town_index = TownIndex(towns)
+    records = []
+    for route_id in sorted(route_geom_cache.route_ids()):
+        if route_geom_cache.routes[route_id]['count'] == 0:
+            continue
+        # end_if
+        route = route_geom_cache.get_route_geometry(route_id)
+        for event in locate_towns_along_route(route, town_index, sliver_tolerance):
+            records.append((route_id, event['from_meas'], event['to_meas'], event['town'], event['town_id']))
+        # for
+        del route
+    # for
+    return lrse_event_index.LrseEventIndex(records, ['town', 'town_id'], fingerprint)
+# def build_town_event_index()
+
+# open_town_event_index: Return the statewide town event index, loading it from the cache directory if it is
+#                        there and up to date, and otherwise building it (and saving it to the cache directory).
+#                        The town events of a route are then looked up with query(route_id).
+#
+# Parameters: towns_fc - full path to the town feature class, e.g., towns_pb_r
+#             route_geom_cache - route_geometry_cache.RouteGeometryCache
+#             cache_dir - full path of the cache directory
+#             verify - (optional) if False, load a saved index without checking that it is up to date,
+#                      e.g., in worker processes when the parent process has already done so
+#             sliver_tolerance - (optional) see default_sliver_tolerance
+# Return value: lrse_event_index.LrseEventIndex
+#
+def open_town_event_index(towns_fc, route_geom_cache, cache_dir, verify=True, sliver_tolerance=default_sliver_tolerance):
+    index_path = os.path.join(cache_dir, town_event_index_file_name)
+    index = lrse_event_index.LrseEventIndex.load(index_path) if os.path.exists(index_path) else None
+    if index is not None and not verify:
+        return index
+    # end_if
+    fingerprint = town_event_fingerprint(route_geom_cache, towns_fc, sliver_tolerance)
+    if index is not None and index.fingerprint == fingerprint:
+        return index
+    # end_if
+    index = build_town_event_index(route_geom_cache, read_towns(towns_fc), fingerprint, sliver_tolerance)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    # end_if
+    index.save(index_path)
+    return index
+# def open_town_event_index()